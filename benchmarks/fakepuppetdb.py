@@ -0,0 +1,334 @@
+"""
+Local stand-in for PuppetDB serving a synthetic fleet.
+
+Records are generated from their index when a request asks for them, so a
+fleet of 50k nodes does not have to be kept in memory. Only the parts of a
+query the benchmarked views depend on are understood: certname, report and
+fact name equality filters, summarize_by, limit, offset and include_total.
+Everything else in a query is ignored and order_by is not applied.
+
+GET /__stats returns the number of requests and bytes served since the
+last GET /__reset, neither is counted.
+
+Example:
+
+python benchmarks/fakepuppetdb.py --nodes 10000 --port 18081
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import re
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+__author__ = 'etaklar'
+
+STATUSES = ('success', 'noop', 'failure', 'skipped')
+REPORT_STATUSES = ('unchanged', 'unchanged', 'unchanged', 'changed', 'failed')
+NOW = datetime.datetime.utcnow().replace(microsecond=0)
+
+CERTNAME_RE = re.compile(r'\["=","certname","([^"]+)"\]')
+REPORT_RE = re.compile(r'\["=","report","([^"]+)"\]')
+FACT_NAME_RE = re.compile(r'\["=","name","([^"]+)"\]')
+
+
+def timestamp(seconds_ago):
+    return (NOW - datetime.timedelta(seconds=seconds_ago)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+class Fleet(object):
+    def __init__(self, nodes=1000, resources=500, events_per_node=5, reports_per_node=100, classes=50):
+        """
+        :param nodes: number of nodes
+        :param resources: number of resources in each catalogue
+        :param events_per_node: number of events in the latest report of each node
+        :param reports_per_node: number of stored reports of each node
+        :param classes: number of distinct classes containing the events
+        """
+        self.nodes = nodes
+        self.resources = resources
+        self.events_per_node = events_per_node
+        self.reports_per_node = reports_per_node
+        self.classes = classes
+
+    def certname(self, index):
+        return 'node%05d.example.com' % index
+
+    def node_index(self, certname):
+        match = re.match(r'node(\d+)\.example\.com$', certname)
+        if match is None or int(match.group(1)) >= self.nodes:
+            return None
+        return int(match.group(1))
+
+    def report_hash(self, index, number=0):
+        return '%040x' % (index * self.reports_per_node + number)
+
+    def report_node(self, report_hash):
+        return int(report_hash, 16) // self.reports_per_node
+
+    def node(self, index):
+        return {
+            'certname': self.certname(index),
+            'deactivated': None,
+            'expired': None,
+            'catalog_timestamp': timestamp(index % 1800),
+            'facts_timestamp': timestamp(index % 1800),
+            'report_timestamp': timestamp(index % 1800),
+            'catalog_environment': 'production',
+            'facts_environment': 'production',
+            'report_environment': 'production',
+            'latest_report_status': REPORT_STATUSES[index % len(REPORT_STATUSES)],
+            'latest_report_noop': False,
+            'latest_report_hash': self.report_hash(index),
+        }
+
+    def report(self, index, number=0):
+        return {
+            'certname': self.certname(index),
+            'hash': self.report_hash(index, number),
+            'environment': 'production',
+            'status': REPORT_STATUSES[(index + number) % len(REPORT_STATUSES)],
+            'noop': False,
+            'puppet_version': '4.7.0',
+            'configuration_version': '1474192855',
+            'start_time': timestamp(number * 1800 + 30),
+            'end_time': timestamp(number * 1800),
+            'receive_time': timestamp(number * 1800),
+        }
+
+    def event(self, index, number, report_number=0):
+        return {
+            'certname': self.certname(index),
+            'report': self.report_hash(index, report_number),
+            'status': STATUSES[(index + number) % len(STATUSES)],
+            'timestamp': timestamp(report_number * 1800 + number),
+            'resource_type': 'File',
+            'resource_title': '/etc/app/file%d.conf' % number,
+            'property': 'content',
+            'containing_class': 'Profile::App%d' % ((index + number) % self.classes),
+            'old_value': '{md5}d41d8cd98f00b204e9800998ecf8427e',
+            'new_value': '{md5}%032x' % index,
+            'message': 'content changed',
+        }
+
+    def event_counts(self, index):
+        counts = {'successes': 0, 'noops': 0, 'failures': 0, 'skips': 0}
+        fields = dict(zip(STATUSES, ('successes', 'noops', 'failures', 'skips')))
+        for number in range(self.events_per_node):
+            counts[fields[STATUSES[(index + number) % len(STATUSES)]]] += 1
+        return counts
+
+    def fact(self, index, name):
+        return {'certname': self.certname(index), 'name': name, 'value': '%s-%d' % (name, index % 10),
+                'environment': 'production'}
+
+    def catalogue(self, index):
+        # Every tenth resource differs between nodes so that comparing two catalogues finds changes.
+        resources = []
+        edges = []
+        for number in range(self.resources):
+            title = '/etc/app/file%d.conf' % number
+            resources.append({
+                'certname': self.certname(index),
+                'type': 'File',
+                'title': title,
+                'exported': False,
+                'tags': ['file', 'class', 'profile::app%d' % (number % self.classes)],
+                'file': '/etc/puppetlabs/code/modules/profile/manifests/app.pp',
+                'line': number,
+                'parameters': {
+                    'ensure': 'file',
+                    'owner': 'root',
+                    'mode': '0644',
+                    'content': 'setting = %d\n' % (index if number % 10 == 0 else number),
+                },
+            })
+            edges.append({
+                'certname': self.certname(index),
+                'source_type': 'Class',
+                'source_title': 'Profile::App%d' % (number % self.classes),
+                'relationship': 'contains',
+                'target_type': 'File',
+                'target_title': title,
+            })
+        return {
+            'certname': self.certname(index),
+            'hash': '%040x' % (index + 1),
+            'version': '1474192855',
+            'transaction_uuid': None,
+            'environment': 'production',
+            'producer_timestamp': timestamp(index % 1800),
+            'edges': {'href': '/pdb/query/v4/catalogs/%s/edges' % self.certname(index), 'data': edges},
+            'resources': {'href': '/pdb/query/v4/catalogs/%s/resources' % self.certname(index), 'data': resources},
+        }
+
+
+class FakePuppetDB(object):
+    def __init__(self, fleet):
+        self.fleet = fleet
+        self.requests = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.memo = {}
+
+    def node_indexes(self, query):
+        certnames = CERTNAME_RE.findall(query)
+        if not certnames:
+            return range(self.fleet.nodes)
+        indexes = [self.fleet.node_index(certname) for certname in certnames]
+        return [index for index in indexes if index is not None]
+
+    def answer(self, path, params):
+        """
+        :return: list or dict of the response and its total number of records if include_total was asked for
+        """
+        query = params.get('query', '')
+        endpoint = path.split('/')
+        if path == '/pdb/meta/v1/version':
+            return {'version': '4.1.0'}, None
+        if path.startswith('/metrics/v1/mbeans/'):
+            if 'avg-resources-per-node' in path:
+                return {'Value': float(self.fleet.resources)}, None
+            return {'Value': self.fleet.nodes * self.fleet.resources}, None
+        if len(endpoint) == 6 and endpoint[4] == 'catalogs':
+            index = self.fleet.node_index(endpoint[5])
+            if index is None:
+                return {'error': "Could not find catalog for '%s'" % endpoint[5]}, None
+            return self.fleet.catalogue(index), None
+        name = endpoint[-1]
+        if name == 'nodes':
+            records = (self.fleet.node(index) for index in self.node_indexes(query))
+            total = len(self.node_indexes(query))
+        elif name == 'reports':
+            indexes = self.node_indexes(query)
+            if 'latest_report?' in query or len(indexes) != 1:
+                records = (self.fleet.report(index) for index in indexes)
+                total = len(indexes)
+            else:
+                records = (self.fleet.report(indexes[0], number) for number in range(self.fleet.reports_per_node))
+                total = self.fleet.reports_per_node
+        elif name == 'event-counts':
+            records, total = self.event_counts(query, params.get('summarize_by', 'certname'))
+        elif name == 'events':
+            reports = REPORT_RE.findall(query)
+            if reports:
+                pairs = [(self.fleet.report_node(report_hash), int(report_hash, 16) % self.fleet.reports_per_node)
+                         for report_hash in reports]
+            else:
+                pairs = [(index, 0) for index in self.node_indexes(query)]
+            records = (self.fleet.event(index, number, report_number)
+                       for index, report_number in pairs for number in range(self.fleet.events_per_node))
+            total = len(pairs) * self.fleet.events_per_node
+        elif name == 'facts':
+            fact_names = FACT_NAME_RE.findall(query) or ['kernel']
+            records = (self.fleet.fact(index, fact_name)
+                       for fact_name in fact_names for index in self.node_indexes(query))
+            total = len(fact_names) * len(self.node_indexes(query))
+        else:
+            return [], None
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 0)) or None
+        records = list(itertools.islice(records, offset, None if limit is None else offset + limit))
+        return records, total if params.get('include_total') == 'true' else None
+
+    def event_counts(self, query, summarize_by):
+        indexes = self.node_indexes(query)
+        if summarize_by == 'certname':
+            records = [dict(self.fleet.event_counts(index), subject_type='certname',
+                            subject={'title': self.fleet.certname(index)}) for index in indexes]
+            return records, len(records)
+        # The fleet never changes, the counts of a query are only added up once.
+        key = (summarize_by, query)
+        if key not in self.memo:
+            fields = ('successes', 'noops', 'failures', 'skips')
+            subjects = {}
+            for index in indexes:
+                for number in range(self.fleet.events_per_node):
+                    if summarize_by == 'resource':
+                        subject = ('File', '/etc/app/file%d.conf' % number)
+                    else:
+                        subject = 'Profile::App%d' % ((index + number) % self.fleet.classes)
+                    if subject not in subjects:
+                        subjects[subject] = dict.fromkeys(fields, 0)
+                    subjects[subject][fields[(index + number) % len(fields)]] += 1
+            records = []
+            for subject, counts in subjects.items():
+                if summarize_by == 'resource':
+                    subject = {'type': subject[0], 'title': subject[1]}
+                else:
+                    subject = {'title': subject}
+                records.append(dict(counts, subject_type=summarize_by, subject=subject))
+            self.memo[key] = records
+        return self.memo[key], len(self.memo[key])
+
+
+def make_handler(puppetdb):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, data, headers=None):
+            body = json.dumps(data).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            return len(body)
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            if url.path == '/__stats':
+                self.send_json({'requests': puppetdb.requests, 'bytes': puppetdb.bytes})
+                return
+            if url.path == '/__reset':
+                with puppetdb.lock:
+                    puppetdb.requests = 0
+                    puppetdb.bytes = 0
+                self.send_json({})
+                return
+            params = {key: values[0] for key, values in urllib.parse.parse_qs(url.query).items()}
+            data, total = puppetdb.answer(url.path, params)
+            headers = {'X-Records': str(total)} if total is not None else None
+            sent = self.send_json(data, headers)
+            with puppetdb.lock:
+                puppetdb.requests += 1
+                puppetdb.bytes += sent
+
+    return Handler
+
+
+def serve(fleet, host='127.0.0.1', port=18081):
+    """
+    :return: the running ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(FakePuppetDB(fleet)))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves a synthetic fleet like PuppetDB does.')
+    parser.add_argument('--nodes', type=int, default=1000)
+    parser.add_argument('--resources', type=int, default=500, help='Resources per catalogue.')
+    parser.add_argument('--events', type=int, default=5, help='Events in the latest report of each node.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18081)
+    args = parser.parse_args()
+    server = serve(Fleet(nodes=args.nodes, resources=args.resources, events_per_node=args.events),
+                   args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
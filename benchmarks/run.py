@@ -0,0 +1,256 @@
+"""
+Benchmarks of the hot paths of panopuppet against a synthetic fleet.
+
+Starts benchmarks/fakepuppetdb.py in a separate process for every fleet
+size, configures panopuppet to use it with a temporary config file and
+SQLite database and requests each scenario through the Django test client.
+Reported per scenario and fleet size:
+
+- seconds: median wall time of --repeat requests
+- round_trips: requests sent to PuppetDB by one request
+- peak_mb: peak memory allocated by Python during one request, measured
+  with tracemalloc in a separate request because tracing slows it down
+
+Caches are cleared before every request, so the numbers are those of a
+request nobody asked before. Wall times depend on the machine, compare
+against a baseline saved on the same machine.
+
+Run from the root of the repository:
+
+python -m benchmarks.run --nodes 1000 10000 50000
+python -m benchmarks.run --nodes 1000 --save benchmarks/baseline.json
+python -m benchmarks.run --nodes 1000 --compare benchmarks/baseline.json --max-slowdown 1.25
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+__author__ = 'etaklar'
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+USERNAME = 'benchmark'
+PASSWORD = 'benchmark'
+
+SCENARIOS = (
+    ('dashboard', '/pano/api/dashboard/?show=recent'),
+    ('dashboard_failed', '/pano/api/dashboard/?show=failed'),
+    ('nodes', '/pano/api/nodes/'),
+    ('nodes_csv', '/pano/api/nodes/?dl_csv=true&include_facts=kernel,osfamily'),
+    ('reports', '/pano/api/reports/node00001.example.com/'),
+    ('event_analytics', '/pano/eventanalytics/'),
+    ('catalogue_compare',
+     '/pano/api/catalogue/compare/node00001.example.com/node00002.example.com/?show=resources'),
+    ('catalogue_compare_edges',
+     '/pano/api/catalogue/compare/node00001.example.com/node00002.example.com/?show=edges'),
+)
+
+
+def configure(port, directory):
+    """
+    Writes the panopuppet config for the fake PuppetDB and sets up Django.
+    """
+    config_file = os.path.join(directory, 'config.yaml')
+    with open(config_file, 'w') as config:
+        config.write('\n'.join([
+            "SECRET_KEY: 'benchmark'",
+            "PUPPETDB_HOST: 'http://127.0.0.1:%d/'" % port,
+            "AUTH_METHOD: 'basic'",
+            "SQLITE_DIR: '%s'" % directory,
+            'CACHE_TIME: 0',
+            'FLEET_REFRESH_INTERVAL: 0',
+            'ENABLE_METRICS: false',
+            '',
+        ]))
+    os.environ['PP_CFG'] = config_file
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'panopuppet.puppet.settings'
+    import django
+    django.setup()
+
+    from django.apps import apps
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.db import connection
+
+    call_command('migrate', verbosity=0, interactive=False)
+    # panopuppet does not ship migrations, its tables are created from the models.
+    tables = connection.introspection.table_names()
+    with connection.schema_editor() as editor:
+        for model in apps.get_app_config('pano').get_models():
+            if model._meta.db_table not in tables:
+                editor.create_model(model)
+    User.objects.create_user(USERNAME, password=PASSWORD)
+
+
+class FakePuppetDBProcess(object):
+    def __init__(self, nodes, port, resources=500):
+        self.url = 'http://127.0.0.1:%d' % port
+        self.process = subprocess.Popen([sys.executable, os.path.join(BENCHMARK_DIR, 'fakepuppetdb.py'),
+                                         '--nodes', str(nodes), '--port', str(port),
+                                         '--resources', str(resources)])
+        deadline = time.time() + 30
+        while True:
+            try:
+                self.stats()
+                break
+            except OSError:
+                if time.time() > deadline or self.process.poll() is not None:
+                    self.stop()
+                    raise RuntimeError('The fake PuppetDB did not start.')
+                time.sleep(0.1)
+
+    def get(self, path):
+        with urllib.request.urlopen(self.url + path) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def stats(self):
+        return self.get('/__stats')
+
+    def reset(self):
+        self.get('/__reset')
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def clear_caches():
+    from django.core.cache import cache
+    from panopuppet.pano.puppetdb.reportcache import report_cache
+    cache.clear()
+    report_cache.clear()
+
+
+def request(client, url):
+    clear_caches()
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError('%s answered %d' % (url, response.status_code))
+    if response.streaming:
+        return len(b''.join(response.streaming_content))
+    return len(response.content)
+
+
+def run_scenario(client, puppetdb, url, repeat):
+    """
+    :return: dict with the median seconds, round trips and peak memory of the scenario
+    """
+    # Warms up imports, templates and the detected PuppetDB version
+    request(client, url)
+
+    puppetdb.reset()
+    request(client, url)
+    round_trips = puppetdb.stats()['requests']
+
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        request(client, url)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    request(client, url)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'seconds': round(statistics.median(timings), 4),
+        'round_trips': round_trips,
+        'peak_mb': round(peak / 1024.0 / 1024.0, 2),
+    }
+
+
+def compare(results, baseline, max_slowdown):
+    """
+    :return: list of the regressions, results slower than max_slowdown times the baseline or with more round trips
+    """
+    regressions = []
+    for nodes, scenarios in results.items():
+        for name, result in scenarios.items():
+            before = baseline.get(nodes, {}).get(name)
+            if before is None:
+                continue
+            if result['seconds'] > before['seconds'] * max_slowdown:
+                regressions.append('%s@%s: %.3fs, was %.3fs' % (name, nodes, result['seconds'], before['seconds']))
+            if result['round_trips'] > before['round_trips']:
+                regressions.append('%s@%s: %d round trips, was %d' % (
+                    name, nodes, result['round_trips'], before['round_trips']))
+    return regressions
+
+
+def print_results(results, baseline):
+    print('%-26s %7s %10s %9s %11s %9s' % ('scenario', 'nodes', 'seconds', 'baseline', 'round trips', 'peak MB'))
+    for nodes, scenarios in results.items():
+        for name, result in scenarios.items():
+            before = baseline.get(nodes, {}).get(name)
+            change = ''
+            if before and before['seconds']:
+                change = '%+.0f%%' % ((result['seconds'] / before['seconds'] - 1) * 100)
+            print('%-26s %7s %10.4f %9s %11d %9.2f' % (
+                name, nodes, result['seconds'], change, result['round_trips'], result['peak_mb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks panopuppet views against a synthetic fleet.')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[1000], help='Fleet sizes to benchmark.')
+    parser.add_argument('--resources', type=int, default=500, help='Resources per catalogue.')
+    parser.add_argument('--scenario', action='append', choices=[name for name, url in SCENARIOS],
+                        help='Only run this scenario, can be given more than once.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed requests per scenario.')
+    parser.add_argument('--port', type=int, default=18081, help='Port of the fake PuppetDB.')
+    parser.add_argument('--compare', help='Baseline file to compare against.')
+    parser.add_argument('--max-slowdown', type=float, default=1.25,
+                        help='Exit with status 1 if a scenario is this many times slower than the baseline.')
+    parser.add_argument('--save', help='Add the results to this baseline file.')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='panopuppet-benchmark-')
+    configure(args.port, directory)
+    from django.test import Client
+    client = Client()
+    client.login(username=USERNAME, password=PASSWORD)
+
+    results = {}
+    for nodes in args.nodes:
+        puppetdb = FakePuppetDBProcess(nodes, args.port, args.resources)
+        try:
+            results[str(nodes)] = {}
+            for name, url in SCENARIOS:
+                if args.scenario and name not in args.scenario:
+                    continue
+                results[str(nodes)][name] = run_scenario(client, puppetdb, url, args.repeat)
+        finally:
+            puppetdb.stop()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+
+    if args.save:
+        saved = {}
+        if os.path.exists(args.save):
+            with open(args.save, 'r') as baseline_file:
+                saved = json.load(baseline_file)
+        for nodes, scenarios in results.items():
+            saved.setdefault(nodes, {}).update(scenarios)
+        with open(args.save, 'w') as baseline_file:
+            json.dump(saved, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+
+    regressions = compare(results, baseline, args.max_slowdown)
+    for regression in regressions:
+        print('Regression: %s' % regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
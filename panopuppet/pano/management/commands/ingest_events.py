@@ -0,0 +1,13 @@
+from panopuppet.pano.management.sources import SourcesCommand
+from panopuppet.pano.methods.eventrollup import ingest_events
+
+__author__ = 'etaklar'
+
+
+class Command(SourcesCommand):
+    help = 'Counts the events of every PuppetDB source by hour for the event analytics of a date range.'
+    once_help = 'Count the events of every source once and exit.'
+    failure_message = 'Failed to count the events of %s: %s'
+
+    def handle_source(self, source):
+        return 'Counted the events of %s: %d rows' % (source['url'], ingest_events(source))
@@ -0,0 +1,24 @@
+from django.core.management.base import CommandError
+
+from panopuppet.pano.management.sources import SourcesCommand
+from panopuppet.pano.methods.fleet import refresh_snapshot
+from panopuppet.pano.settings import CACHE_TIME, FLEET_REFRESH_INTERVAL
+
+__author__ = 'etaklar'
+
+
+class Command(SourcesCommand):
+    help = 'Rebuilds the cached dashboard data of every PuppetDB source on a fixed interval.'
+    default_interval = FLEET_REFRESH_INTERVAL or CACHE_TIME
+    interval_help = 'Seconds between refreshes, defaults to FLEET_REFRESH_INTERVAL or CACHE_TIME.'
+    once_help = 'Refresh every source once and exit.'
+    failure_message = 'Failed to refresh %s: %s'
+
+    def handle(self, *args, **options):
+        if CACHE_TIME <= 0:
+            raise CommandError('CACHE_TIME is 0, the dashboard data is not cached so there is nothing to refresh.')
+        super(Command, self).handle(*args, **options)
+
+    def handle_source(self, source):
+        snapshot = refresh_snapshot(source)
+        return 'Refreshed %s: %d nodes' % (source['url'], snapshot.population)
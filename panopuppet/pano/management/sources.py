@@ -0,0 +1,51 @@
+"""
+Base of the management commands which work through every PuppetDB source of
+AVAILABLE_SOURCES on a fixed interval.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from panopuppet.pano.methods.fleet import available_sources
+
+__author__ = 'etaklar'
+
+
+class SourcesCommand(BaseCommand):
+    """
+    Calls handle_source for every source, every --interval seconds or only once with --once.
+    A source which fails is written to stderr and retried the next round.
+    """
+    default_interval = 3600
+    interval_help = 'Seconds between runs, defaults to an hour.'
+    once_help = 'Run for every source once and exit.'
+    failure_message = 'Failed to handle %s: %s'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=self.default_interval, help=self.interval_help)
+        parser.add_argument('--once', action='store_true', default=False, help=self.once_help)
+
+    def handle_source(self, source):
+        """
+        :param source: dict from fleet.available_sources()
+        :return: description of what was done, written with verbosity 2
+        """
+        raise NotImplementedError('subclasses of SourcesCommand must provide a handle_source() method')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            started = time.time()
+            for source in available_sources():
+                source_started = time.time()
+                try:
+                    done = self.handle_source(source)
+                except Exception as e:
+                    self.stderr.write(self.failure_message % (source['url'], e))
+                    continue
+                if int(options['verbosity']) > 1:
+                    self.stdout.write('%s in %.2f seconds' % (done, time.time() - source_started))
+            if options['once']:
+                break
+            time.sleep(max(interval - (time.time() - started), 0))
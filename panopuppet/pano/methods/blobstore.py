@@ -0,0 +1,190 @@
+"""
+Local store of file contents keyed by their MD5 sum.
+
+Files in the puppetmaster filebucket are addressed by the MD5 sum of their
+content, so once fetched they never have to be fetched again. The store
+keeps them in files below FILEBUCKET_CACHE_DIR, or in memory if no
+directory is configured, optionally zlib compressed. The total size is
+capped at FILEBUCKET_CACHE_SIZE bytes by removing the least recently used
+contents. Processes sharing the directory find the contents stored by each
+other, every process keeps its own account of their sizes.
+
+Example:
+
+content = blob_store.get(md5sum)
+if content is None:
+    content = fetch(md5sum)
+    blob_store.set(md5sum, content)
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+from panopuppet.pano.methods import metrics
+from panopuppet.pano.settings import FILEBUCKET_CACHE_DIR, FILEBUCKET_CACHE_SIZE, FILEBUCKET_CACHE_COMPRESS
+
+__author__ = 'etaklar'
+
+_MD5_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def md5sum_of(content):
+    """
+    :param content: str or bytes
+    :return: hex MD5 sum of the content, str is hashed in its utf-8 encoding
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.md5(content).hexdigest()
+
+
+class BlobStore(object):
+    def __init__(self, directory=FILEBUCKET_CACHE_DIR, max_bytes=FILEBUCKET_CACHE_SIZE,
+                 compress=FILEBUCKET_CACHE_COMPRESS):
+        """
+        :param directory: directory to store the contents in, None keeps them in memory
+        :param max_bytes: maximum size of all stored contents, 0 disables the store
+        :param compress: zlib compress the stored contents
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._lock = threading.Lock()
+        # md5sum -> size of the stored data, least recently used first
+        self._sizes = OrderedDict()
+        self._blobs = {}
+        self._total = 0
+        self._scanned = directory is None
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            self._scan()
+            return self._total
+
+    def path(self, md5sum):
+        return os.path.join(self.directory, md5sum[:2], md5sum)
+
+    def get(self, md5sum):
+        """
+        :param md5sum: hex MD5 sum of the content
+        :return: the content as str or None if it is not stored
+        """
+        if not self.max_bytes or not _MD5_RE.match(md5sum or ''):
+            return None
+        content = self._lookup(md5sum)
+        metrics.CACHE_REQUESTS.inc(cache='filebucket', result='miss' if content is None else 'hit')
+        return content
+
+    def _lookup(self, md5sum):
+        with self._lock:
+            self._scan()
+            if md5sum in self._sizes:
+                self._sizes.move_to_end(md5sum)
+            elif self.directory is None:
+                return None
+            data = self._blobs.get(md5sum)
+        if data is None:
+            try:
+                with open(self.path(md5sum), 'rb') as blob_file:
+                    data = blob_file.read()
+                # The modification time orders the files on the next start
+                os.utime(self.path(md5sum))
+            except OSError:
+                self._forget(md5sum)
+                return None
+            with self._lock:
+                # The file may have been stored by another process
+                self._total += len(data) - self._sizes.pop(md5sum, 0)
+                self._sizes[md5sum] = len(data)
+                self._evict()
+        try:
+            if self.compress:
+                data = zlib.decompress(data)
+            return data.decode('utf-8')
+        except (zlib.error, UnicodeDecodeError):
+            self._forget(md5sum)
+            return None
+
+    def set(self, md5sum, content):
+        """
+        Stores the content if its MD5 sum matches.
+        :param md5sum: hex MD5 sum of the content
+        :param content: str or bytes
+        :return: True if the content was stored
+        """
+        if not self.max_bytes or not _MD5_RE.match(md5sum or ''):
+            return False
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        if md5sum_of(content) != md5sum:
+            return False
+        data = zlib.compress(content) if self.compress else content
+        if len(data) > self.max_bytes:
+            return False
+        if self.directory is not None:
+            path = self.path(md5sum)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write to a temporary file first so other processes never read a partial file.
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+                with os.fdopen(fd, 'wb') as blob_file:
+                    blob_file.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                return False
+        with self._lock:
+            self._scan()
+            self._total -= self._sizes.pop(md5sum, 0)
+            self._sizes[md5sum] = len(data)
+            self._total += len(data)
+            if self.directory is None:
+                self._blobs[md5sum] = data
+            self._evict()
+        return True
+
+    def _forget(self, md5sum):
+        with self._lock:
+            self._total -= self._sizes.pop(md5sum, 0)
+            self._blobs.pop(md5sum, None)
+
+    def _scan(self):
+        # Must be called with _lock held. Picks up the contents stored by earlier runs, oldest first.
+        if self._scanned:
+            return
+        self._scanned = True
+        found = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if not _MD5_RE.match(name):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, name, stat.st_size))
+        for mtime, md5sum, size in sorted(found):
+            self._sizes[md5sum] = size
+            self._total += size
+        self._evict()
+
+    def _evict(self):
+        # Must be called with _lock held.
+        while self._total > self.max_bytes and self._sizes:
+            md5sum, size = self._sizes.popitem(last=False)
+            self._total -= size
+            if self.directory is None:
+                del self._blobs[md5sum]
+            else:
+                try:
+                    os.remove(self.path(md5sum))
+                except OSError:
+                    pass
+
+
+blob_store = BlobStore()
@@ -0,0 +1,111 @@
+"""
+Comparison of the resources or edges of two catalogues.
+
+Resources are indexed by (type, title) and edges by their source,
+relationship and target. Every entry is hashed once from its canonical
+JSON form, entries found in both catalogues with the same hash are
+unchanged and never compared field by field. For changed resources the
+parameters which differ are listed.
+
+Example:
+
+diff = compare_catalogues(from_catalogue['resources']['data'], against_catalogue['resources']['data'],
+                          'resources')
+diff['changed_entries'][0]['changed_parameters']
+"""
+
+import hashlib
+import json
+
+__author__ = 'etaklar'
+
+EDGE_KEY_FIELDS = ('source_type', 'source_title', 'relationship', 'target_type', 'target_title')
+
+
+def resource_key(resource):
+    return resource['type'], resource['title']
+
+
+def edge_key(edge):
+    return tuple(edge[field] for field in EDGE_KEY_FIELDS)
+
+
+KEY_FUNCTIONS = {
+    'resources': resource_key,
+    'edges': edge_key,
+}
+
+
+def fingerprint(entry):
+    """
+    :param entry: resource or edge dict
+    :return: digest which is the same for equal entries regardless of the order of their keys
+    """
+    data = json.dumps(entry, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.md5(data.encode('utf-8')).digest()
+
+
+class CatalogueIndex(object):
+    def __init__(self, entries, kind='resources'):
+        """
+        :param entries: list of the resources or edges of a catalogue, the certname of each entry is removed
+        :param kind: 'resources' or 'edges'
+        """
+        key = KEY_FUNCTIONS[kind]
+        self.entries = {}
+        self.fingerprints = {}
+        for entry in entries:
+            entry.pop('certname', None)
+            entry_key = key(entry)
+            self.entries[entry_key] = entry
+            self.fingerprints[entry_key] = fingerprint(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def changed_parameters(from_resource, against_resource):
+    """
+    :return: dict of parameter name and {'from': value, 'against': value}, None for a missing parameter
+    """
+    from_parameters = from_resource.get('parameters') or {}
+    against_parameters = against_resource.get('parameters') or {}
+    changes = {}
+    for name in set(from_parameters) | set(against_parameters):
+        from_value = from_parameters.get(name)
+        against_value = against_parameters.get(name)
+        if from_value != against_value:
+            changes[name] = {'from': from_value, 'against': against_value}
+    return changes
+
+
+def compare_catalogues(from_entries, against_entries, kind='resources'):
+    """
+    :param from_entries: list of the resources or edges of the first catalogue
+    :param against_entries: list of the resources or edges of the catalogue compared against
+    :param kind: 'resources' or 'edges'
+    :return: dict with the added_entries, deleted_entries and changed_entries of the against catalogue
+    """
+    from_index = CatalogueIndex(from_entries, kind)
+    against_index = CatalogueIndex(against_entries, kind)
+
+    added_entries = [entry for key, entry in against_index.entries.items() if key not in from_index.entries]
+    deleted_entries = [entry for key, entry in from_index.entries.items() if key not in against_index.entries]
+    changed_entries = []
+    for key, entry in from_index.entries.items():
+        against_fingerprint = against_index.fingerprints.get(key)
+        if against_fingerprint is None or against_fingerprint == from_index.fingerprints[key]:
+            continue
+        change = {
+            'from': entry,
+            'against': against_index.entries[key],
+        }
+        if kind == 'resources':
+            change['changed_parameters'] = changed_parameters(entry, against_index.entries[key])
+        changed_entries.append(change)
+
+    return {
+        'added_entries': added_entries,
+        'deleted_entries': deleted_entries,
+        'changed_entries': changed_entries,
+    }
@@ -0,0 +1,166 @@
+"""
+Storage of saved catalogues.
+
+A catalogue is split in three zlib compressed sections: the metadata
+(everything but the resources and edges data), the edges and the list of
+resource digests. Each resource is stored once per host in CatalogResource
+and shared by every saved catalogue of that host containing it, so saving
+a catalogue which only changed a few resources only adds those. Reading a
+section only decompresses that section.
+
+Catalogues saved before the sections existed are read from their full
+JSON catalogue field.
+
+Example:
+
+saved = store_catalogue('node.example.com', catalogue, report_hash, catalogue['producer_timestamp'])
+resources = load_section(saved, 'resources')
+"""
+
+import json
+import zlib
+
+from django.db import transaction
+
+from panopuppet.pano.methods.catalogdiff import fingerprint
+from panopuppet.pano.models import SavedCatalogs, CatalogResource
+
+__author__ = 'etaklar'
+
+SECTIONS = ('metadata', 'edges', 'resources')
+SECTION_FIELDS = {
+    'metadata': 'metadata_blob',
+    'edges': 'edges_blob',
+    'resources': 'resources_blob',
+}
+# Columns needed to list saved catalogues
+LIST_FIELDS = ('id', 'hostname', 'catalogue_id', 'linked_report', 'timestamp')
+# Keeps the number of variables of a query below the SQLite limit of 999
+QUERY_CHUNK_SIZE = 500
+
+
+def compress(data):
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+
+def decompress(blob):
+    return json.loads(zlib.decompress(bytes(blob)).decode('utf-8'))
+
+
+def split_catalogue(catalogue):
+    """
+    :param catalogue: catalogue as returned by /catalogs/<certname>
+    :return: metadata dict, list of edges, list of resources
+    """
+    metadata = {}
+    edges = []
+    resources = []
+    for key, value in catalogue.items():
+        if key in ('edges', 'resources') and isinstance(value, dict):
+            metadata[key] = {k: v for k, v in value.items() if k != 'data'}
+            if key == 'edges':
+                edges = value.get('data') or []
+            else:
+                resources = value.get('data') or []
+        else:
+            metadata[key] = value
+    return metadata, edges, resources
+
+
+@transaction.atomic
+def store_catalogue(hostname, catalogue, linked_report, timestamp):
+    """
+    :param hostname: certname of the catalogue
+    :param catalogue: catalogue as returned by /catalogs/<certname>
+    :param linked_report: hash of the report of the catalogue
+    :param timestamp: producer_timestamp of the catalogue
+    :return: SavedCatalogs
+    """
+    metadata, edges, resources = split_catalogue(catalogue)
+    digests = []
+    new_resources = {}
+    for resource in resources:
+        digest = fingerprint(resource).hex()
+        digests.append(digest)
+        new_resources[digest] = resource
+    for i in range(0, len(digests), QUERY_CHUNK_SIZE):
+        existing = CatalogResource.objects.filter(
+            hostname=hostname, digest__in=digests[i:i + QUERY_CHUNK_SIZE]).values_list('digest', flat=True)
+        for digest in existing:
+            new_resources.pop(digest, None)
+    CatalogResource.objects.bulk_create(
+        [CatalogResource(hostname=hostname, digest=digest, data=compress(resource))
+         for digest, resource in new_resources.items()],
+        batch_size=QUERY_CHUNK_SIZE)
+    return SavedCatalogs.objects.create(hostname=hostname,
+                                        catalogue_id=catalogue['hash'],
+                                        linked_report=linked_report,
+                                        timestamp=timestamp,
+                                        metadata_blob=compress(metadata),
+                                        edges_blob=compress(edges),
+                                        resources_blob=compress(digests))
+
+
+def get_saved_catalogue(hostname, catalogue_id, sections=SECTIONS):
+    """
+    Fetches a saved catalogue without the columns of the sections that are not needed.
+    :param hostname: certname of the catalogue
+    :param catalogue_id: hash of the catalogue
+    :param sections: sections which will be loaded
+    :return: SavedCatalogs, raises SavedCatalogs.DoesNotExist
+    """
+    deferred = [SECTION_FIELDS[section] for section in SECTIONS if section not in sections]
+    # The full JSON catalogue is only loaded, on access, for catalogues saved in the old format.
+    deferred.append('catalogue')
+    return SavedCatalogs.objects.defer(*deferred).get(hostname=hostname, catalogue_id=catalogue_id)
+
+
+def list_saved_catalogues(hostname):
+    """
+    :return: queryset of the saved catalogues of the host with only the columns needed to list them
+    """
+    return SavedCatalogs.objects.filter(hostname=hostname).only(*LIST_FIELDS)
+
+
+def load_resources(saved_catalogue):
+    digests = decompress(saved_catalogue.resources_blob)
+    resources = {}
+    for i in range(0, len(digests), QUERY_CHUNK_SIZE):
+        rows = CatalogResource.objects.filter(
+            hostname=saved_catalogue.hostname,
+            digest__in=digests[i:i + QUERY_CHUNK_SIZE]).values_list('digest', 'data')
+        for digest, data in rows:
+            resources[digest] = decompress(data)
+    return [resources[digest] for digest in digests if digest in resources]
+
+
+def load_section(saved_catalogue, section):
+    """
+    :param saved_catalogue: SavedCatalogs
+    :param section: 'metadata', 'edges' or 'resources'
+    :return: the metadata dict or the list of edges or resources
+    """
+    if section not in SECTION_FIELDS:
+        raise ValueError('Unknown catalogue section: %s' % section)
+    if getattr(saved_catalogue, SECTION_FIELDS[section]) is None:
+        # Saved as a single JSON document
+        catalogue = json.loads(saved_catalogue.catalogue)
+        metadata, edges, resources = split_catalogue(catalogue)
+        return {'metadata': metadata, 'edges': edges, 'resources': resources}[section]
+    if section == 'resources':
+        return load_resources(saved_catalogue)
+    return decompress(getattr(saved_catalogue, SECTION_FIELDS[section]))
+
+
+def load_catalogue(saved_catalogue):
+    """
+    :param saved_catalogue: SavedCatalogs
+    :return: the whole catalogue as it was returned by /catalogs/<certname>
+    """
+    if saved_catalogue.metadata_blob is None:
+        return json.loads(saved_catalogue.catalogue)
+    catalogue = load_section(saved_catalogue, 'metadata')
+    for section in ('edges', 'resources'):
+        if section in catalogue:
+            catalogue[section]['data'] = load_section(saved_catalogue, section)
+    return catalogue
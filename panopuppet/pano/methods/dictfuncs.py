@@ -15,7 +15,7 @@ def sort_table(table, col=0, order=False):
 def dictstatus(node_list, reports_dict, status_dict, sort=True, sortby=None, asc=False, get_status="all",
                puppet_run_time=PUPPET_RUN_INTERVAL, format_time=True):
     """
-    :param node_list: dict
+    :param node_list: list of nodes, or an iterator of nodes such as iter_puppetdb_pages returns
     :param status_dict: dict
     :param sortby: Takes a field name to sort by 'certname', 'latestCatalog', 'latestReport', 'latestFacts', 'success', 'noop', 'failure', 'skipped'
     :param get_status: Status type to return. all, changed, failed, unreported, noops
@@ -0,0 +1,187 @@
+"""
+Unified diff of two files which stays fast for large files.
+
+Every distinct line is replaced by a small integer so lines are compared
+and hashed once. The lines both files start and end with are skipped
+before difflib.SequenceMatcher looks at the rest. If the part which
+differs is longer than DIFF_MAX_LINES, or matching the lines takes longer
+than DIFF_TIMEOUT seconds, a summary is shown instead of the diff. Hunks
+also stop being produced once DIFF_TIMEOUT seconds have passed. The diff
+lines and their colorized HTML are generated one at a time, so only the
+HTML of the page is held in memory besides the two files.
+
+Example:
+
+lines = unified_diff(from_text.split('\\n'), to_text.split('\\n'))
+html = ''.join(colorize(lines))
+"""
+
+import time
+from difflib import SequenceMatcher
+
+from django.utils.html import escape
+
+from panopuppet.pano.settings import DIFF_MAX_LINES, DIFF_TIMEOUT
+
+__author__ = 'etaklar'
+
+
+class DiffTimeout(Exception):
+    pass
+
+
+class BoundedSequenceMatcher(SequenceMatcher):
+    """
+    SequenceMatcher which raises DiffTimeout once the deadline has passed.
+    Matching calls find_longest_match once per block, the deadline is checked before each call.
+    """
+
+    def __init__(self, a, b, deadline):
+        self.deadline = deadline
+        super(BoundedSequenceMatcher, self).__init__(None, a, b)
+
+    def find_longest_match(self, *args, **kwargs):
+        if time.monotonic() > self.deadline:
+            raise DiffTimeout()
+        return super(BoundedSequenceMatcher, self).find_longest_match(*args, **kwargs)
+
+
+def line_ids(from_lines, to_lines):
+    """
+    :return: two lists with an integer per line, equal lines get the same integer
+    """
+    ids = {}
+    from_ids = [ids.setdefault(line, len(ids)) for line in from_lines]
+    to_ids = [ids.setdefault(line, len(ids)) for line in to_lines]
+    return from_ids, to_ids
+
+
+def common_ends(a, b):
+    """
+    :return: number of items a and b start with and end with, not overlapping
+    """
+    length = min(len(a), len(b))
+    prefix = 0
+    while prefix < length and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < length - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    return prefix, suffix
+
+
+def format_range(start, stop):
+    # Same format as difflib.unified_diff, lines are counted from 1
+    length = stop - start
+    if length == 1:
+        return '%d' % (start + 1)
+    if length == 0:
+        start -= 1
+    return '%d,%d' % (start + 1, length)
+
+
+def group_opcodes(opcodes, context=3):
+    """
+    Groups opcodes into hunks with up to context equal lines around the changes,
+    like SequenceMatcher.get_grouped_opcodes.
+    """
+    if opcodes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = opcodes[0]
+        opcodes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if opcodes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = opcodes[-1]
+        opcodes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+    group = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        # End the current hunk and start a new one if the equal lines between the changes are many
+        if tag == 'equal' and i2 - i1 > context * 2:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def unified_diff(from_lines, to_lines, context=3, max_lines=DIFF_MAX_LINES, timeout=DIFF_TIMEOUT):
+    """
+    :param from_lines: list of lines of the old file
+    :param to_lines: list of lines of the new file
+    :param context: number of unchanged lines shown around the changes
+    :param max_lines: largest number of differing lines to run the diff on, a summary is returned above it
+    :param timeout: seconds after which no more hunks are produced
+    :return: empty list if the files are equal, otherwise an iterator of diff lines
+    """
+    from_ids, to_ids = line_ids(from_lines, to_lines)
+    prefix, suffix = common_ends(from_ids, to_ids)
+    from_end = len(from_ids) - suffix
+    to_end = len(to_ids) - suffix
+    if prefix == from_end and prefix == to_end:
+        return []
+    if (from_end - prefix) + (to_end - prefix) > max_lines:
+        return iter(summary_lines(prefix, from_end, to_end))
+    return diff_lines(from_lines, to_lines, from_ids, to_ids, prefix, suffix, context, timeout)
+
+
+def summary_lines(prefix, from_end, to_end, reason='which is too large to show as a diff'):
+    return [
+        '--- ',
+        '+++ ',
+        '@@ -%s +%s @@' % (format_range(prefix, from_end), format_range(prefix, to_end)),
+        ' The files differ in %d old and %d new lines, %s.' % (from_end - prefix, to_end - prefix, reason),
+    ]
+
+
+def diff_lines(from_lines, to_lines, from_ids, to_ids, prefix, suffix, context, timeout):
+    started = time.monotonic()
+    from_end = len(from_ids) - suffix
+    to_end = len(to_ids) - suffix
+    matcher = BoundedSequenceMatcher(from_ids[prefix:from_end], to_ids[prefix:to_end], started + timeout)
+    try:
+        opcodes = [(tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix)
+                   for tag, i1, i2, j1, j2 in matcher.get_opcodes()]
+    except DiffTimeout:
+        for line in summary_lines(prefix, from_end, to_end,
+                                  'comparing them took more than %d seconds' % timeout):
+            yield line
+        return
+    # Add the skipped lines back so that they can be used as context
+    if prefix:
+        opcodes.insert(0, ('equal', 0, prefix, 0, prefix))
+    if suffix:
+        opcodes.append(('equal', from_end, len(from_ids), to_end, len(to_ids)))
+
+    yield '--- '
+    yield '+++ '
+    for group in group_opcodes(opcodes, context):
+        if time.monotonic() - started > timeout:
+            yield ' The diff took more than %d seconds, the remaining changes are not shown.' % timeout
+            return
+        yield '@@ -%s +%s @@' % (format_range(group[0][1], group[-1][2]), format_range(group[0][3], group[-1][4]))
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in from_lines[i1:i2]:
+                    yield ' ' + line
+                continue
+            if tag in ('replace', 'delete'):
+                for line in from_lines[i1:i2]:
+                    yield '-' + line
+            if tag in ('replace', 'insert'):
+                for line in to_lines[j1:j2]:
+                    yield '+' + line
+
+
+def colorize(lines):
+    """
+    :param lines: iterable of unified diff lines
+    :return: iterator of HTML escaped lines, removed lines in red and added lines in green
+    """
+    for line in lines:
+        line = escape(line.rstrip('\n'))
+        if line.startswith('-'):
+            yield '<br><span style="color:red">%s</span>' % line
+        elif line.startswith('+'):
+            yield '<br><span style="color:green">%s</span>' % line
+        else:
+            yield '<br>%s' % line
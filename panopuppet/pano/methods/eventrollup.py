@@ -0,0 +1,258 @@
+"""
+Hourly resource events for the event analytics of a date range.
+
+The ingest_events management command streams the events of each PuppetDB
+source from /events and stores, per hour, every resource of a node which
+had events of a status in EventRollup, with the number of its events.
+Every run fetches the events since the previous run again from
+EVENT_ROLLUP_RECOUNT hours before it, so reports received late are
+included. The first run fetches the last EVENT_ROLLUP_BACKFILL hours.
+The stored hours are only replaced once every event PuppetDB counted for
+the hours has been received, a run which fails halfway keeps the hours
+of the previous run.
+
+The summary of a date range counts, like /event-counts on the live path,
+the resources with events of each status, a resource once however many
+events it had in the range. The whole hours of the range up to the last
+run are read from the database, the part of the range before the first
+and after the last of them is fetched from /events. Only the resources of
+nodes which are not deactivated are counted. A range without a whole
+ingested hour is left to the live path.
+
+Example:
+
+ingest_events(available_sources()[0])
+summary = rollup_summary(source, '2016-09-18T10:00:00+02:00', '2016-09-20T10:00:00+02:00')
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+
+import arrow
+from django.db import transaction
+from django.utils import timezone
+
+from panopuppet.pano.methods.events import EVENT_STATUSES, new_summary, finish_summary
+from panopuppet.pano.models import EventRollup, EventRollupState
+from panopuppet.pano.puppetdb.pdbutils import iter_puppetdb_pages, get_executor
+from panopuppet.pano.puppetdb.puppetdb import api_get as pdb_api_get, mk_puppetdb_query
+from panopuppet.pano.settings import EVENT_ROLLUP_BACKFILL, EVENT_ROLLUP_RECOUNT
+
+__author__ = 'etaklar'
+
+# report and property are included because the pages of /events are ordered by them
+EVENT_FIELDS = ['certname', 'status', 'timestamp', 'resource_type', 'resource_title', 'containing_class',
+                'report', 'property']
+# The nodes counted by the live path of events.get_events_summary
+ACTIVE_NODES_QUERY = '["null?","deactivated",true]'
+
+
+def floor_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_hour(dt):
+    hour = floor_hour(dt)
+    if hour < dt:
+        hour += timedelta(hours=1)
+    return hour
+
+
+def event_hour(timestamp):
+    """
+    :param timestamp: timestamp of an event as returned by PuppetDB
+    :return: aware datetime of the start of the hour of the timestamp in UTC
+    """
+    if timestamp.endswith('Z'):
+        # PuppetDB returns UTC timestamps, parsing only the hour is much faster than a full parse
+        return datetime.strptime(timestamp[:13], '%Y-%m-%dT%H').replace(tzinfo=timezone.utc)
+    return floor_hour(arrow.get(timestamp).to('UTC').datetime)
+
+
+def resource_of(event):
+    """
+    :param event: event as returned by PuppetDB
+    :return: (certname, resource_type, resource_title, containing_class, status)
+    """
+    return (event['certname'], event['resource_type'], event['resource_title'], event['containing_class'],
+            event['status'])
+
+
+def count_events(events):
+    """
+    :param events: list or iterator of events, events are consumed one at a time
+    :return: Counter of (hour, certname, resource_type, resource_title, containing_class, status)
+    """
+    counts = Counter()
+    for event in events:
+        if event['status'] not in EVENT_STATUSES:
+            continue
+        counts[(event_hour(event['timestamp']),) + resource_of(event)] += 1
+    return counts
+
+
+def summary_of_resources(resources):
+    """
+    :param resources: iterable of distinct (certname, resource_type, resource_title, containing_class, status)
+    :return: dict in the format of events.summary_of_event_counts
+    """
+    summary = new_summary()
+    for certname, resource_type, resource_title, containing_class, status in resources:
+        summary['classes_%s' % status][containing_class] += 1
+        summary['nodes_%s' % status][certname] += 1
+        summary['resources_%s' % status][resource_title] += 1
+        summary['types_%s' % status][resource_type] += 1
+    return finish_summary(summary, 'resources')
+
+
+def number_of_events(source, query):
+    """
+    :param source: dict from fleet.available_sources()
+    :param query: query dict in the format accepted by mk_puppetdb_query
+    :return: number of events matching the query
+    :raises ValueError: if PuppetDB does not answer with a count
+    """
+    count_params = {
+        'query': dict(query, extract='["extract",[["function","count"]],%s]'),
+    }
+    result = pdb_api_get(
+        api_url=source['url'],
+        cert=source['certs'],
+        verify=source['verify'],
+        path='/events',
+        api_version='v4',
+        params=mk_puppetdb_query(count_params),
+    )
+    if type(result) is not list or len(result) != 1 or 'count' not in result[0]:
+        raise ValueError('PuppetDB did not count the events of %s: %s' % (source['url'], result))
+    return result[0]['count']
+
+
+def ingest_events(source, now=None):
+    """
+    Counts the events of a source since the previous run.
+    :param source: dict from fleet.available_sources()
+    :param now: events are counted up to this time, defaults to the current time
+    :return: number of EventRollup rows written
+    :raises ValueError: if the events could not all be fetched, the stored hours are left as they were
+    """
+    now = now or timezone.now()
+    state = EventRollupState.objects.filter(source=source['url']).first()
+    if state is None:
+        first_hour = floor_hour(now - timedelta(hours=EVENT_ROLLUP_BACKFILL))
+        start = first_hour
+    else:
+        first_hour = state.first_hour
+        start = max(first_hour, floor_hour(state.until - timedelta(hours=EVENT_ROLLUP_RECOUNT)))
+
+    query = {
+        1: '[">=","timestamp","' + start.isoformat() + '"]',
+        2: '["<","timestamp","' + now.isoformat() + '"]',
+    }
+    # Events are only ever added to the hours, a complete fetch has at least as many.
+    expected = number_of_events(source, query)
+    events_params = {
+        'query': dict(query, operator='and'),
+        'fields': EVENT_FIELDS,
+    }
+    events = iter_puppetdb_pages(
+        '/events',
+        params=events_params,
+        url=source['url'],
+        certs=source['certs'],
+        verify=source['verify'],
+        api_version='v4')
+    counts = count_events(events)
+    fetched = sum(counts.values())
+    if fetched < expected:
+        raise ValueError('Only %d of the %d events of %s were fetched' % (fetched, expected, source['url']))
+
+    with transaction.atomic():
+        EventRollup.objects.filter(source=source['url'], hour__gte=start).delete()
+        EventRollup.objects.bulk_create(
+            [EventRollup(source=source['url'], hour=hour, certname=certname, resource_type=resource_type,
+                         resource_title=resource_title, containing_class=containing_class, status=status,
+                         count=count)
+             for (hour, certname, resource_type, resource_title, containing_class, status), count in counts.items()],
+            batch_size=500)
+        EventRollupState.objects.update_or_create(source=source['url'],
+                                                  defaults={'first_hour': first_hour, 'until': now})
+    return len(counts)
+
+
+def active_certnames(source):
+    """
+    :param source: dict from fleet.available_sources()
+    :return: set of the certnames of the nodes which are not deactivated
+    """
+    nodes = iter_puppetdb_pages(
+        '/nodes',
+        params={'query': {1: ACTIVE_NODES_QUERY}, 'fields': ['certname']},
+        url=source['url'],
+        certs=source['certs'],
+        verify=source['verify'],
+        api_version='v4')
+    return set(node['certname'] for node in nodes)
+
+
+def live_resources(source, after, dt_from, dt_to):
+    """
+    Fetches the resources with events of the active nodes from PuppetDB.
+    :param source: dict from fleet.available_sources()
+    :param after: '>' to leave out or '>=' to include the events at dt_from
+    :param dt_from: aware datetime of the start of the range
+    :param dt_to: aware datetime of the end of the range, its events are left out
+    :return: set of (certname, resource_type, resource_title, containing_class, status)
+    """
+    events_params = {
+        'query': {
+            'operator': 'and',
+            1: '["%s","timestamp","%s"]' % (after, dt_from.isoformat()),
+            2: '["<","timestamp","%s"]' % dt_to.isoformat(),
+            3: '["in","certname",["extract","certname",["select_nodes",%s]]]' % ACTIVE_NODES_QUERY,
+        },
+        'fields': EVENT_FIELDS,
+    }
+    events = iter_puppetdb_pages(
+        '/events',
+        params=events_params,
+        url=source['url'],
+        certs=source['certs'],
+        verify=source['verify'],
+        api_version='v4')
+    return set(resource_of(event) for event in events if event['status'] in EVENT_STATUSES)
+
+
+def rollup_summary(source, dt_from, dt_to):
+    """
+    :param source: dict with the url, certs and verify of the PuppetDB source
+    :param dt_from: start of the range as an ISO 8601 string, its events are left out like on the live path
+    :param dt_to: end of the range as an ISO 8601 string, its events are left out like on the live path
+    :return: dict in the format of events.summary_of_event_counts or None if
+        no whole hour of the range has been ingested
+    :raises ValueError: if PuppetDB answers a query for the rest of the range with an error
+    """
+    dt_from = arrow.get(dt_from).to('UTC').datetime
+    dt_to = arrow.get(dt_to).to('UTC').datetime
+    state = EventRollupState.objects.filter(source=source['url']).first()
+    if state is None:
+        return None
+    # Hours are complete up to the last run, the rest of the range is fetched from PuppetDB.
+    start = ceil_hour(dt_from)
+    end = min(floor_hour(dt_to), floor_hour(state.until))
+    if start < state.first_hour or end <= start:
+        return None
+
+    executor = get_executor()
+    active = executor.submit(active_certnames, source)
+    edges = [executor.submit(live_resources, source, '>', dt_from, start)] if dt_from < start else []
+    if end < dt_to:
+        edges.append(executor.submit(live_resources, source, '>=', end, dt_to))
+
+    rows = EventRollup.objects.filter(source=source['url'], hour__gte=start, hour__lt=end).values_list(
+        'certname', 'resource_type', 'resource_title', 'containing_class', 'status').distinct().order_by()
+    certnames = active.result()
+    resources = set(row for row in rows.iterator() if row[0] in certnames)
+    for edge in edges:
+        resources.update(edge.result())
+    return summary_of_resources(resources)
@@ -1,170 +1,119 @@
-import queue
-from threading import Thread
+"""
+Summary of the events of the event analytics page.
 
-from panopuppet.pano.puppetdb.puppetdb import api_get as pdb_api_get, mk_puppetdb_query, get_server
+The summary is counted by PuppetDB with /event-counts, summarized by
+containing class, certname and resource, the three queries run
+concurrently. The counts of the resource types are added up from the
+counts of the resources. If PuppetDB answers /event-counts with an error
+the events are streamed from /events and counted locally.
 
-__author__ = 'etaklar'
+/event-counts and the hourly resources of eventrollup count the resources
+with an event of each status, while the events counted locally count
+every event, so a resource with several changed properties is counted
+more than once. summary['counted'] is 'resources' or 'events' accordingly.
 
+The whole hours of a date range which the ingest_events management command
+has fetched are answered from the hourly resources in the database, see
+eventrollup. Users with a permission filter always get the summary from
+PuppetDB.
 
-def summary_of_events(events_hash):
-    summary = {
-        'classes_failure': {},
-        'classes_noop': {},
-        'classes_success': {},
-        'classes_skipped': {},
-        'classes_total': 0,
-
-        'nodes_failure': {},
-        'nodes_noop': {},
-        'nodes_success': {},
-        'nodes_skipped': {},
-        'nodes_total': 0,
-
-        'resources_failure': {},
-        'resources_noop': {},
-        'resources_success': {},
-        'resources_skipped': {},
-        'resources_total': 0,
-
-        'types_failure': {},
-        'types_noop': {},
-        'types_success': {},
-        'types_skipped': {},
-        'types_total': 0,
-    }
+Example:
+
+summary = get_events_summary(request, timespan='latest')
+summary['nodes_failure']
+"""
 
-    def sort_events(all_events, threads=2):
-        if type(threads) != int:
-            threads = 6
-        jobs_q = queue.Queue()
-        out_q = queue.Queue()
-
-        def db_threaded_requests(i, q):
-            while True:
-                t_event = q.get()
-                if t_event['status'] == 'success':
-                    # Classes
-                    if not t_event['containing_class'] in summary['classes_success']:
-                        summary['classes_success'][t_event['containing_class']] = 1
-                    else:
-                        summary['classes_success'][t_event['containing_class']] += 1
-                    # Nodes
-                    if not t_event['certname'] in summary['nodes_success']:
-                        summary['nodes_success'][t_event['certname']] = 1
-                    else:
-                        summary['nodes_success'][t_event['certname']] += 1
-                    # Resources
-                    if not t_event['resource_title'] in summary['resources_success']:
-                        summary['resources_success'][t_event['resource_title']] = 1
-                    else:
-                        summary['resources_success'][t_event['resource_title']] += 1
-                    # Types
-                    if not t_event['resource_type'] in summary['types_success']:
-                        summary['types_success'][t_event['resource_type']] = 1
-                    else:
-                        summary['types_success'][t_event['resource_type']] += 1
-
-                if t_event['status'] == 'noop':
-                    # Classes
-                    if not t_event['containing_class'] in summary['classes_noop']:
-                        summary['classes_noop'][t_event['containing_class']] = 1
-                    else:
-                        summary['classes_noop'][t_event['containing_class']] += 1
-                    # Nodes
-                    if not t_event['certname'] in summary['nodes_noop']:
-                        summary['nodes_noop'][t_event['certname']] = 1
-                    else:
-                        summary['nodes_noop'][t_event['certname']] += 1
-                    # Resources
-                    if not t_event['resource_title'] in summary['resources_noop']:
-                        summary['resources_noop'][t_event['resource_title']] = 1
-                    else:
-                        summary['resources_noop'][t_event['resource_title']] += 1
-                    # Types
-                    if not t_event['resource_type'] in summary['types_noop']:
-                        summary['types_noop'][t_event['resource_type']] = 1
-                    else:
-                        summary['types_noop'][t_event['resource_type']] += 1
-
-                if t_event['status'] == 'failure':
-                    # Classes
-                    if not t_event['containing_class'] in summary['classes_failure']:
-                        summary['classes_failure'][t_event['containing_class']] = 1
-                    else:
-                        summary['classes_failure'][t_event['containing_class']] += 1
-                    # Nodes
-                    if not t_event['certname'] in summary['nodes_failure']:
-                        summary['nodes_failure'][t_event['certname']] = 1
-                    else:
-                        summary['nodes_failure'][t_event['certname']] += 1
-                    # Resources
-                    if not t_event['resource_title'] in summary['resources_failure']:
-                        summary['resources_failure'][t_event['resource_title']] = 1
-                    else:
-                        summary['resources_failure'][t_event['resource_title']] += 1
-                    # Types
-                    if not t_event['resource_type'] in summary['types_failure']:
-                        summary['types_failure'][t_event['resource_type']] = 1
-                    else:
-                        summary['types_failure'][t_event['resource_type']] += 1
-
-                if t_event['status'] == 'skipped':
-                    # Classes
-                    if not t_event['containing_class'] in summary['classes_skipped']:
-                        summary['classes_skipped'][t_event['containing_class']] = 1
-                    else:
-                        summary['classes_skipped'][t_event['containing_class']] += 1
-                    # Nodes
-                    if not t_event['certname'] in summary['nodes_skipped']:
-                        summary['nodes_skipped'][t_event['certname']] = 1
-                    else:
-                        summary['nodes_skipped'][t_event['certname']] += 1
-                    # Resources
-                    if not t_event['resource_title'] in summary['resources_skipped']:
-                        summary['resources_skipped'][t_event['resource_title']] = 1
-                    else:
-                        summary['resources_skipped'][t_event['resource_title']] += 1
-                    # Types
-                    if not t_event['resource_type'] in summary['types_skipped']:
-                        summary['types_skipped'][t_event['resource_type']] = 1
-                    else:
-                        summary['types_skipped'][t_event['resource_type']] += 1
-                out_q.put(i)
-                q.task_done()
-
-        for i in range(threads):
-            worker = Thread(target=db_threaded_requests, args=(i, jobs_q))
-            worker.setDaemon(True)
-            worker.start()
-
-        for single_event in all_events:
-            jobs_q.put(single_event)
-        jobs_q.join()
-
-        while True:
-            try:
-                out_q.get_nowait()
-            except queue.Empty:
-                break
-
-    sort_events(events_hash)
-    # count totals
-    # Classes
-    summary['classes_total'] = len(summary['classes_success']) + len(summary['classes_noop']) + len(
-        summary['classes_failure']) + len(summary['classes_skipped'])
-    # Nodes
-    summary['nodes_total'] = len(summary['nodes_success']) + len(summary['nodes_noop']) + len(
-        summary['nodes_failure']) + len(summary['nodes_skipped'])
-    # resource
-    summary['resources_total'] = len(summary['resources_success']) + len(summary['resources_noop']) + len(
-        summary['resources_failure']) + len(summary['resources_skipped'])
-    # types
-    summary['types_total'] = len(summary['types_success']) + len(summary['types_noop']) + len(
-        summary['types_failure']) + len(summary['types_skipped'])
+import logging
+from collections import Counter
+
+from panopuppet.pano.methods.fleet import permission_filter
+from panopuppet.pano.puppetdb.pdbutils import iter_puppetdb_pages, run_puppetdb_jobs
+from panopuppet.pano.puppetdb.puppetdb import api_get as pdb_api_get, mk_puppetdb_query, get_server
+
+__author__ = 'etaklar'
 
+logger = logging.getLogger(__name__)
+
+EVENT_STATUSES = ('success', 'noop', 'failure', 'skipped')
+# Summary group and the field of an event it is counted by
+SUMMARY_GROUPS = (
+    ('classes', 'containing_class'),
+    ('nodes', 'certname'),
+    ('resources', 'resource_title'),
+    ('types', 'resource_type'),
+)
+# Field of an /event-counts result and the status it counts
+EVENT_COUNT_FIELDS = (
+    ('successes', 'success'),
+    ('noops', 'noop'),
+    ('failures', 'failure'),
+    ('skips', 'skipped'),
+)
+EVENT_COUNT_JOBS = (
+    ('classes', 'containing_class'),
+    ('nodes', 'certname'),
+    ('resources', 'resource'),
+)
+
+
+def new_summary():
+    return {'%s_%s' % (group, status): Counter() for group, field in SUMMARY_GROUPS for status in EVENT_STATUSES}
+
+
+def finish_summary(summary, counted):
+    """
+    Converts the counters of the summary to dicts and adds the totals.
+    :param summary: dict returned by new_summary
+    :param counted: 'events' or 'resources', what the counts of the summary are a number of
+    :return: dict
+    """
+    for group, field in SUMMARY_GROUPS:
+        total = 0
+        for status in EVENT_STATUSES:
+            key = '%s_%s' % (group, status)
+            summary[key] = dict(summary[key])
+            total += len(summary[key])
+        summary['%s_total' % group] = total
+    summary['counted'] = counted
     return summary
 
 
+def summary_of_events(events_hash):
+    """
+    Counts the events locally.
+    :param events_hash: list or iterator of events, events are consumed one at a time
+    :return: dict
+    """
+    summary = new_summary()
+    for event in events_hash:
+        status = event['status']
+        if status not in EVENT_STATUSES:
+            continue
+        for group, field in SUMMARY_GROUPS:
+            summary['%s_%s' % (group, status)][event[field]] += 1
+    return finish_summary(summary, 'events')
+
+
+def summary_of_event_counts(event_counts):
+    """
+    :param event_counts: dict of summary group ('classes', 'nodes', 'resources') and
+        the results of /event-counts summarized by containing_class, certname and resource
+    :return: dict
+    """
+    summary = new_summary()
+    for group, summarize_by in EVENT_COUNT_JOBS:
+        for result in event_counts[group]:
+            subject = result['subject']
+            for count_field, status in EVENT_COUNT_FIELDS:
+                count = result.get(count_field, 0)
+                if not count:
+                    continue
+                summary['%s_%s' % (group, status)][subject['title']] += count
+                if group == 'resources':
+                    summary['types_%s' % status][subject['type']] += count
+    return finish_summary(summary, 'resources')
+
+
 def get_events_summary(request, timespan='latest', environment=None):
     events_params = {
         'query':
@@ -180,15 +129,45 @@ def get_events_summary(request, timespan='latest', environment=None):
             1] + '"]]'
 
     source_url, source_certs, source_verify = get_server(request)
-    events = pdb_api_get(
-        api_url=source_url,
-        cert=source_certs,
+    if timespan != 'latest' and not permission_filter(request):
+        # Imported here because eventrollup uses the summary functions of this module
+        from panopuppet.pano.methods.eventrollup import rollup_summary
+        source = {'url': source_url, 'certs': source_certs, 'verify': source_verify}
+        summary = rollup_summary(source, timespan[0], timespan[1])
+        if summary is not None:
+            return summary
+
+    jobs = {}
+    for group, summarize_by in EVENT_COUNT_JOBS:
+        jobs[group] = {
+            'url': source_url,
+            'certs': source_certs,
+            'verify': source_verify,
+            'id': group,
+            'path': '/event-counts',
+            'api_version': 'v4',
+            'params': {
+                'query': events_params['query'],
+                'summarize_by': summarize_by,
+            },
+            'request': request,
+        }
+    event_counts = run_puppetdb_jobs(jobs)
+    errors = [event_counts[group] for group in jobs if type(event_counts[group]) is not list]
+    if not errors:
+        return summary_of_event_counts(event_counts)
+
+    # PuppetDB could not count the events, count them while they are streamed.
+    logger.warning('PuppetDB %s could not count the events, counting them locally: %s', source_url, errors[0])
+    events = iter_puppetdb_pages(
+        '/events',
+        params=events_params,
+        request=request,
+        url=source_url,
+        certs=source_certs,
         verify=source_verify,
-        path='/events',
-        api_version='v4',
-        params=mk_puppetdb_query(events_params, request))
-    summary = summary_of_events(events)
-    return summary
+        api_version='v4')
+    return summary_of_events(events)
 
 
 def get_report(key, value, request, timespan='latest', environment=None):
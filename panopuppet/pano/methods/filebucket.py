@@ -1,13 +1,20 @@
 import requests
 import hashlib
-import difflib
+from concurrent.futures import as_completed, wait
 
+from panopuppet.pano.methods.blobstore import blob_store
+from panopuppet.pano.methods.diffengine import unified_diff
+from panopuppet.pano.puppetdb.connections import pooled_session
+from panopuppet.pano.puppetdb.pdbutils import get_executor
 from panopuppet.pano.puppetdb.puppetdb import api_get as pdb_api_get, get_server, mk_puppetdb_query
 
 __author__ = 'takeshi'
 
 requests.packages.urllib3.disable_warnings()
 
+# Seconds the filebucket has to answer before the new file of a diff is also looked up in PuppetDB
+RESOURCE_FALLBACK_DELAY = 0.25
+
 
 def get_hash(data):
     m = hashlib.md5()
@@ -15,6 +22,25 @@ def get_hash(data):
     return m.hexdigest()
 
 
+def first_found(futures):
+    """
+    :param futures: futures of lookups returning the content or False
+    :return: the first content found, False if none of them found it
+    """
+    error = None
+    for future in as_completed(futures):
+        try:
+            result = future.result()
+        except Exception as e:
+            error = error or e
+            continue
+        if result is not False:
+            return result
+    if error is not None:
+        raise error
+    return False
+
+
 def get_file(request, certname, environment, rtitle, rtype, md5sum_from=None, md5sum_to=None, diff=False,
              file_status='from'):
     puppetdb_source, puppetdb_certs, puppetdb_verify = get_server(request=request)
@@ -24,38 +50,47 @@ def get_file(request, certname, environment, rtitle, rtype, md5sum_from=None, md
                                                                                          type='fileserver')
     # If Clientbucket is enabled continue else return False
 
-    def fetch_filebucket(url, method):
+    def fetch_filebucket(md5sum):
+        # Filebucket files never change, use the stored copy if there is one.
+        content = blob_store.get(md5sum)
+        if content is not None:
+            return content
+        url = filebucket_source + environment + '/file_bucket_file/md5/' + md5sum
         headers = {
             'Accept': 's',
         }
-        methods = {'get': requests.get,
-                   'head': requests.head,
-                   }
-        if method not in methods:
-            print('No can has method: %s' % method)
-            return False
-        resp = methods[method](url,
+        with pooled_session(url, cert=filebucket_certs, verify=filebucket_verify) as session:
+            resp = session.get(url,
                                headers=headers,
                                verify=filebucket_verify,
                                cert=filebucket_certs)
         if resp.status_code != 200:
             return False
         else:
+            blob_store.set(md5sum, resp.content)
             return resp.text
 
-    def fetch_fileserver(url, method):
-        methods = {'get': requests.get,
-                   }
-
-        if method not in methods:
-            print('No can has method: %s' % method)
-            return False
-        resp = methods[method](url,
-                               verify=fileserver_verify,
-                               cert=fileserver_certs)
+    def fetch_fileserver(url, method, md5sum=None):
+        # Files on the fileserver can change, the stored copy is only used if it has the MD5 sum we look for.
+        if md5sum:
+            content = blob_store.get(md5sum)
+            if content is not None:
+                return content
+        with pooled_session(url, cert=fileserver_certs, verify=fileserver_verify) as session:
+            methods = {'get': session.get,
+                       }
+
+            if method not in methods:
+                print('No can has method: %s' % method)
+                return False
+            resp = methods[method](url,
+                                   verify=fileserver_verify,
+                                   cert=fileserver_certs)
         if resp.status_code != 200:
             return False
         else:
+            if md5sum:
+                blob_store.set(md5sum, resp.content)
             return resp.text
 
     def get_resource(certname, rtype, rtitle):
@@ -80,60 +115,57 @@ def get_resource(certname, rtype, rtitle):
         else:
             return data
 
+    def fetch_resource_content(md5sum):
+        # Content of the file resource from PuppetDB or, for files with a source, from the fileserver.
+        resource = get_resource(certname=certname, rtype=rtype, rtitle=rtitle)
+        if resource is False:
+            return False
+        parameters = resource[0]['parameters']
+        if 'content' in parameters:
+            return parameters['content']
+        # Solve the viewing of source files by retrieving it from Puppetmaster
+        elif 'source' in parameters and fileserver_show is True:
+            source_path = parameters['source']
+            if source_path.startswith('puppet://'):
+                # extract the path for the file
+                source_path = source_path.split('/')  # ['puppet:', '', '', 'files', 'autofs', 'auto.home']
+                source_path = '/'.join(source_path[3:])  # Skip first 3 entries since they are not needed
+                # https://puppetmaster.example.com:8140/production/file_content/files/autofs/auto.home
+                url = fileserver_source + environment + '/file_content/' + source_path
+                return fetch_fileserver(url, 'get', md5sum)
+        return False
+
     if not filebucket_show or not fileserver_source:
         return False
     if file_status == 'both':
         if md5sum_to and md5sum_from and certname and rtitle and rtype:
             if diff:
-                # is the hash from puppetdb resource same as md5sum_to
-                hash_matches = False
-
                 md5sum_from = md5sum_from.replace('{md5}', '')
                 md5sum_to = md5sum_to.replace('{md5}', '')
 
-                from_url = filebucket_source + environment + '/file_bucket_file/md5/' + md5sum_from
-                to_url = filebucket_source + environment + '/file_bucket_file/md5/' + md5sum_to
-
-                if fetch_filebucket(from_url, 'head') is not False:
-                    resource_from = fetch_filebucket(from_url, 'get')
+                # Fetch both files from the filebucket at the same time. The new file is also looked up in
+                # PuppetDB resources or on the fileserver, concurrently, if it is missing from the filebucket
+                # or the filebucket has not answered within RESOURCE_FALLBACK_DELAY. The first found is used.
+                executor = get_executor()
+                future_from = executor.submit(fetch_filebucket, md5sum_from)
+                future_to = executor.submit(fetch_filebucket, md5sum_to)
+                wait([future_to], timeout=RESOURCE_FALLBACK_DELAY)
+                if future_to.done() and future_to.exception() is None and future_to.result() is not False:
+                    resource_to = future_to.result()
                 else:
+                    resource_to = first_found([future_to, executor.submit(fetch_resource_content, md5sum_to)])
+                resource_from = future_from.result()
+                if resource_from is False:
                     # Could not find old MD5 in Filebucket
                     return False
-                if fetch_filebucket(to_url, 'head') is not False:
-                    resource_to = fetch_filebucket(to_url, 'get')
-                # Try puppetdb resources if not found in filebucket.
-                else:
-                    resource_to = get_resource(certname=certname, rtype=rtype, rtitle=rtitle)
-                    if resource_to is False:
-                        # Could not find new file in Filebucket or as a PuppetDB Resource
-                        return False
-                    else:
-                        resource_to = resource_to[0]
-                    if 'content' in resource_to['parameters']:
-                        resource_to = resource_to['parameters']['content']
-                        hash_of_resource = get_hash(resource_to)
-                        if hash_of_resource == md5sum_to:
-                            # file from resource matches filebucket md5 hash
-                            hash_matches = True
-                    # Solve the viewing of source files by retrieving it from Puppetmaster
-                    elif 'source' in resource_to['parameters'] and fileserver_show is True:
-                        source_path = resource_to['parameters']['source']
-                        if source_path.startswith('puppet://'):
-                            # extract the path for the file
-                            source_path = source_path.split('/')  # ['puppet:', '', '', 'files', 'autofs', 'auto.home']
-                            source_path = '/'.join(source_path[3:])  # Skip first 3 entries since they are not needed
-                            # https://puppetmaster.example.com:8140/production/file_content/files/autofs/auto.home
-                            url = fileserver_source + environment + '/file_content/' + source_path
-                            resource_to = fetch_fileserver(url, 'get')
-                    else:
-                        return False
+                if resource_to is False:
+                    # Could not find new file in Filebucket or as a PuppetDB Resource
+                    return False
                 # now that we have come this far, we have both files.
                 # Lets differentiate the shit out of these files.
                 from_split_lines = resource_from.split('\n')
                 to_split_lines = resource_to.split('\n')
-                diff = difflib.unified_diff(from_split_lines, to_split_lines)
-                diff = ('\n'.join(list(diff))).split('\n')
-                return diff
+                return unified_diff(from_split_lines, to_split_lines)
             else:
                 return False
         else:
@@ -147,8 +179,8 @@ def get_resource(certname, rtype, rtitle):
         return False
     # Creates headers and url from the data we got
 
-    url_clientbucket = filebucket_source + environment + '/file_bucket_file/md5/' + md5sum
-    if fetch_filebucket(url_clientbucket, 'head') is False:
+    filebucket_results = fetch_filebucket(md5sum)
+    if filebucket_results is False:
         # Check if theres a resource available for the latest file available
         if file_status == 'to':
             resp_pdb = get_resource(certname=certname, rtype=rtype, rtitle=rtitle)
@@ -167,7 +199,7 @@ def get_resource(certname, rtype, rtitle):
                         source_path = '/'.join(source_path[3:])  # Skip first 3 entries since they are not needed
                         # https://puppetmaster.example.com:8140/production/file_content/files/autofs/auto.home
                         url = fileserver_source + environment + '/file_content/' + source_path
-                        source_content = fetch_fileserver(url, 'get')
+                        source_content = fetch_fileserver(url, 'get', md5sum)
                         prepend_text = 'This file with MD5 %s was retrieved from the PuppetMaster Fileserver.\n\n' % (
                             get_hash(source_content))
                         return prepend_text + source_content
@@ -182,6 +214,5 @@ def get_resource(certname, rtype, rtitle):
         else:
             return False
     else:
-        filebucket_results = fetch_filebucket(url_clientbucket, 'get')
         prepend_text = 'This file with MD5 %s was found in Filebucket.\n\n' % (md5sum)
         return prepend_text + filebucket_results
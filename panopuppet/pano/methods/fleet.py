@@ -0,0 +1,397 @@
+"""
+Fleet wide PuppetDB data shared by the dashboard endpoints.
+
+The dashboard, dashboard status and dashboard nodes endpoints all need every
+active node, the status of every latest report, the event counts of every
+latest report and the resource metrics of PuppetDB. A FleetSnapshot holds
+that data for one source and permission filter, the nodes are kept in a
+FleetTable.
+
+Snapshots are kept in the Django cache. A snapshot younger than CACHE_TIME
+seconds is fresh. An older one is still served for up to
+FLEET_SNAPSHOT_MAX_AGE seconds while a single background thread rebuilds it,
+so only the first request after a restart waits for PuppetDB. Only one
+request builds a missing snapshot, the others wait for it instead of sending
+the same queries to PuppetDB.
+
+The snapshots of all sources can also be rebuilt on a fixed interval, either
+by a thread in the web server (FLEET_REFRESH_INTERVAL) or with the
+refresh_dashboard management command. The command needs a cache backend
+shared between processes, such as memcached or the database cache.
+
+The snapshots are built by coroutines, build_snapshot and
+get_fleet_snapshot run them to completion for synchronous callers such as
+the refresher.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from threading import Lock, Thread
+
+from django.core.cache import cache
+
+from panopuppet.pano.methods import metrics
+from panopuppet.pano.methods.fleettable import FleetTable
+from panopuppet.pano.puppetdb import aio
+from panopuppet.pano.puppetdb.puppetdb import get_server, pdb_version, REPORT_STATUS_FIELDS
+from panopuppet.pano.settings import CACHE_TIME, AUTH_METHOD, ENABLE_PERMISSIONS, PUPPETDB_JOB_TIMEOUT, \
+    AVAILABLE_SOURCES, PUPPETDB_HOST, PUPPETDB_CERTIFICATES, PUPPETDB_VERIFY_SSL, PUPPET_RUN_INTERVAL, \
+    FLEET_REFRESH_INTERVAL, FLEET_SNAPSHOT_MAX_AGE
+
+__author__ = 'etaklar'
+
+logger = logging.getLogger(__name__)
+
+LATEST_REPORTS_QUERY = '["and",["=","latest_report?",true],' \
+                       '["in", "certname",["extract", "certname",["select_nodes",["null?","deactivated",true]]]]]'
+# Seconds between checks while waiting for another request to build the snapshot.
+WAIT_INTERVAL = 0.1
+
+_refresher = None
+_refresher_lock = Lock()
+
+
+class FleetSnapshot(object):
+    """
+    table: FleetTable of every active node with its latest report status and event counts
+    resources: dict with the 'total' and 'average' resource metrics of PuppetDB
+    built_at: epoch time the snapshot was built
+    """
+
+    def __init__(self, table, resources=None, built_at=None):
+        self.table = table
+        self.resources = resources or {}
+        self.built_at = built_at or time.time()
+        self._status_counts = {}
+
+    @property
+    def population(self):
+        return len(self.table)
+
+    @property
+    def age(self):
+        return time.time() - self.built_at
+
+    @classmethod
+    def from_results(cls, results):
+        """
+        :param results: job results of the jobs from snapshot_jobs()
+        :return: FleetSnapshot
+        """
+        reports = {item['certname']: {'status': item['status']} for item in results['snapshot_reports']}
+        event_counts = {item['subject']['title']: item for item in results['snapshot_event_counts']}
+        table = FleetTable.from_data(results['snapshot_nodes'], reports, event_counts)
+        resources = {}
+        if 'snapshot_tot_resource' in results:
+            resources['total'] = results['snapshot_tot_resource'].get('value', results['snapshot_tot_resource'])
+            resources['average'] = results['snapshot_avg_resource'].get('value', results['snapshot_avg_resource'])
+        return cls(table, resources)
+
+    def status_list(self, bucket, puppet_run_time=PUPPET_RUN_INTERVAL, format_time=True):
+        """
+        :param bucket: failed, changed, unreported, mismatch or pending
+        :return: rows of the nodes in the dashboard list, sorted by the report timestamp
+        """
+        indexes = self.table.classify(puppet_run_time)[bucket]
+        return self.table.rows(self.table.argsort('report_timestamp', indexes=indexes),
+                               format_time=format_time,
+                               unknown_without_events=False)
+
+    def status_counts(self, puppet_run_time=PUPPET_RUN_INTERVAL):
+        """
+        Number of nodes in each dashboard list, remembered per run interval.
+        :return: dict with the keys failed, changed, unreported, mismatch and pending
+        """
+        if puppet_run_time not in self._status_counts:
+            buckets = self.table.classify(puppet_run_time)
+            self._status_counts[puppet_run_time] = {key: len(value) for key, value in buckets.items()}
+        return self._status_counts[puppet_run_time]
+
+    def recent(self, limit=25, format_time=True):
+        """
+        :return: rows of the limit nodes which reported last, as dictstatus(get_status='all') returns them
+        """
+        indexes = self.table.argsort('report_timestamp', reverse=True)[:limit]
+        return self.table.rows(indexes, format_time=format_time)
+
+
+class DetachedRequest(object):
+    """
+    Carries the permission filter of a request to a thread which outlives the request.
+    mk_puppetdb_query only reads the permission filter from the session of a request.
+    """
+
+    def __init__(self, request):
+        self.session = {'permission_filter': request.session.get('permission_filter', False)}
+
+
+def permission_filter(request):
+    """
+    Users without a permission filter share the snapshots built by the refresher.
+    :return: str identifying the permission filter applied to the queries of the request,
+        an empty string if the queries are not filtered
+    """
+    if request is None or AUTH_METHOD != 'ldap' or not ENABLE_PERMISSIONS:
+        return ''
+    p_filter = request.session.get('permission_filter', False)
+    if p_filter is None:
+        # Users without any permission, mk_puppetdb_query does not query PuppetDB for them.
+        return 'None'
+    if p_filter and isinstance(p_filter, str):
+        return p_filter
+    return ''
+
+
+def snapshot_key(source_url, p_filter=''):
+    """
+    :param source_url: URL of the PuppetDB source
+    :param p_filter: permission filter of the user
+    :return: cache key of the snapshot
+    """
+    digest = hashlib.md5(('%s|%s' % (source_url, p_filter)).encode('utf-8')).hexdigest()
+    return 'pano_fleet_snapshot_%s' % digest
+
+
+def request_source(request):
+    """
+    :return: dict describing the PuppetDB source selected by the request
+    """
+    source_url, source_certs, source_verify = get_server(request)
+    return {
+        'url': source_url,
+        'certs': source_certs,
+        'verify': source_verify,
+        'puppetdb_vers': get_server(request, type='puppetdb_vers'),
+        'run_time': get_server(request, type='run_time'),
+    }
+
+
+def available_sources():
+    """
+    :return: list of dicts describing each PuppetDB source in AVAILABLE_SOURCES
+    """
+    if type(AVAILABLE_SOURCES) is not dict:
+        return [{
+            'url': PUPPETDB_HOST,
+            'certs': PUPPETDB_CERTIFICATES,
+            'verify': PUPPETDB_VERIFY_SSL,
+            'run_time': PUPPET_RUN_INTERVAL,
+        }]
+    sources = []
+    for source, data in AVAILABLE_SOURCES.items():
+        sources.append({
+            'url': data.get('PUPPETDB_HOST', None),
+            'certs': tuple(data.get('PUPPETDB_CERTIFICATES', [None, None])),
+            'verify': data.get('PUPPETDB_VERIFY_SSL', False),
+            'run_time': data.get('PUPPET_RUN_INTERVAL', 30),
+        })
+    return sources
+
+
+def snapshot_jobs(source, request=None):
+    """
+    :param source: dict from request_source() or available_sources()
+    :return: dict of jobs for run_puppetdb_jobs which fetch the data of a snapshot
+    """
+    if source.get('puppetdb_vers') == 4:
+        tot_res_path = 'mbeans/puppetlabs.puppetdb.population:name=num-resources'
+        avg_res_path = 'mbeans/puppetlabs.puppetdb.population:name=avg-resources-per-node'
+    else:
+        tot_res_path = 'mbeans/puppetlabs.puppetdb.query.population:type=default,name=num-resources'
+        avg_res_path = 'mbeans/puppetlabs.puppetdb.query.population:type=default,name=avg-resources-per-node'
+
+    return {
+        'snapshot_nodes': {
+            'url': source['url'],
+            'certs': source['certs'],
+            'verify': source['verify'],
+            'api_version': 'v4',
+            'id': 'snapshot_nodes',
+            'path': '/nodes',
+            'paged': True,
+            'request': request
+        },
+        'snapshot_reports': {
+            'url': source['url'],
+            'certs': source['certs'],
+            'verify': source['verify'],
+            'api_version': 'v4',
+            'id': 'snapshot_reports',
+            'path': '/reports',
+            'params': {'query': {1: LATEST_REPORTS_QUERY}, 'fields': REPORT_STATUS_FIELDS},
+            'request': request
+        },
+        'snapshot_event_counts': {
+            'url': source['url'],
+            'certs': source['certs'],
+            'verify': source['verify'],
+            'api_version': 'v4',
+            'id': 'snapshot_event_counts',
+            'path': '/event-counts',
+            'params': {'query': {1: LATEST_REPORTS_QUERY}, 'summarize_by': 'certname'},
+            'request': request
+        },
+        'snapshot_tot_resource': {
+            'url': source['url'],
+            'certs': source['certs'],
+            'verify': source['verify'],
+            'id': 'snapshot_tot_resource',
+            'path': tot_res_path,
+        },
+        'snapshot_avg_resource': {
+            'url': source['url'],
+            'certs': source['certs'],
+            'verify': source['verify'],
+            'id': 'snapshot_avg_resource',
+            'path': avg_res_path,
+        },
+    }
+
+
+def store_snapshot(key, snapshot, puppet_run_time):
+    """
+    Counts the dashboard lists before caching, so readers of the cached snapshot get them for free.
+    """
+    snapshot.status_counts(puppet_run_time)
+    cache.set(key, snapshot, max(FLEET_SNAPSHOT_MAX_AGE, CACHE_TIME))
+
+
+async def build_snapshot_async(source, request=None):
+    """
+    Queries PuppetDB and caches a new snapshot of the source.
+    :param source: dict from request_source() or available_sources()
+    :param request: user request, its permission filter is applied to the queries
+    :return: FleetSnapshot
+    """
+    return finish_snapshot(await aio.run_puppetdb_jobs(snapshot_jobs(source, request)), source, request)
+
+
+def build_snapshot(source, request=None):
+    """
+    Synchronous version of build_snapshot_async.
+    :return: FleetSnapshot
+    """
+    return aio.run(build_snapshot_async(source, request))
+
+
+def finish_snapshot(results, source, request=None):
+    snapshot = FleetSnapshot.from_results(results)
+    if CACHE_TIME > 0:
+        store_snapshot(snapshot_key(source['url'], permission_filter(request)), snapshot, source['run_time'])
+    return snapshot
+
+
+def refresh_snapshot(source):
+    """
+    Rebuilds the snapshot of a source from AVAILABLE_SOURCES, as seen by users without a permission filter.
+    :return: FleetSnapshot
+    """
+    if 'puppetdb_vers' not in source:
+        source = dict(source, puppetdb_vers=pdb_version(source_url=source['url'],
+                                                        source_certs=source['certs'],
+                                                        source_verify=source['verify']))
+    return build_snapshot(source)
+
+
+def refresh_in_background(key, source, request=None):
+    """
+    Rebuilds a stale snapshot in a thread unless another request is already doing so.
+    """
+    if not cache.add(key + '_lock', True, PUPPETDB_JOB_TIMEOUT):
+        return
+    if request is not None:
+        request = DetachedRequest(request)
+
+    def rebuild():
+        try:
+            build_snapshot(source, request)
+        except Exception:
+            # The stale snapshot is served until a later request manages to rebuild it.
+            logger.exception('Could not rebuild the dashboard data of %s', source['url'])
+        finally:
+            cache.delete(key + '_lock')
+
+    Thread(target=rebuild, daemon=True).start()
+
+
+def refresh_forever(interval=FLEET_REFRESH_INTERVAL):
+    """
+    Rebuilds the snapshots of all sources every interval seconds.
+    """
+    while True:
+        started = time.time()
+        for source in available_sources():
+            try:
+                refresh_snapshot(source)
+            except Exception:
+                # Keep refreshing the other sources, an unreachable PuppetDB is retried next round.
+                logger.exception('Could not refresh the dashboard data of %s', source['url'])
+        time.sleep(max(interval - (time.time() - started), 0))
+
+
+def start_refresher():
+    """
+    Starts the refresher thread of this process once, if FLEET_REFRESH_INTERVAL is set.
+    """
+    global _refresher
+    if FLEET_REFRESH_INTERVAL <= 0 or CACHE_TIME <= 0 or _refresher is not None:
+        return
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = Thread(target=refresh_forever, args=(FLEET_REFRESH_INTERVAL,), daemon=True)
+            _refresher.start()
+
+
+def cached_snapshot(key, source, request=None):
+    """
+    :return: the cached snapshot, a stale one triggers a rebuild in the background. None if nothing is cached.
+    """
+    snapshot = cache.get(key)
+    if snapshot is not None and snapshot.age > CACHE_TIME:
+        metrics.CACHE_REQUESTS.inc(cache='fleet', result='stale')
+        refresh_in_background(key, source, request)
+    elif snapshot is not None:
+        metrics.CACHE_REQUESTS.inc(cache='fleet', result='hit')
+    return snapshot
+
+
+async def get_fleet_snapshot_async(request):
+    """
+    Returns the cached snapshot for the source of the request, building it if needed.
+    :param request: user request, used for the source and the permission filter
+    :return: FleetSnapshot
+    """
+    source = request_source(request)
+    if CACHE_TIME <= 0:
+        return await build_snapshot_async(source, request)
+
+    start_refresher()
+    key = snapshot_key(source['url'], permission_filter(request))
+    deadline = time.time() + PUPPETDB_JOB_TIMEOUT
+    locked = False
+    while not locked:
+        snapshot = cached_snapshot(key, source, request)
+        if snapshot is not None:
+            return snapshot
+        locked = cache.add(key + '_lock', True, PUPPETDB_JOB_TIMEOUT)
+        if not locked:
+            if time.time() > deadline:
+                break
+            await asyncio.sleep(WAIT_INTERVAL)
+    # Nothing cached, this request builds the snapshot
+    metrics.CACHE_REQUESTS.inc(cache='fleet', result='miss')
+    try:
+        return await build_snapshot_async(source, request)
+    finally:
+        if locked:
+            cache.delete(key + '_lock')
+
+
+def get_fleet_snapshot(request):
+    """
+    Synchronous version of get_fleet_snapshot_async.
+    :return: FleetSnapshot
+    """
+    return aio.run(get_fleet_snapshot_async(request))
@@ -0,0 +1,270 @@
+"""
+Columnar status table of the nodes in a fleet.
+
+dictstatus() builds a tuple per node and looks every node up in dicts keyed by
+certname. For large fleets a FleetTable keeps the same data in one column per
+field instead: certnames are interned strings, timestamps are epoch
+microseconds in array('q') and the event counts and report status are small
+integers in arrays. Nodes are referred to by their row index, sorting returns
+a list of indexes which can be sliced for pagination, and rows() turns
+indexes into the same tuples dictstatus() returns.
+
+Example:
+
+table = FleetTable.from_data(node_list, reports_dict, event_dict)
+indexes = table.argsort('failures', reverse=True)[offset:offset + limit]
+rows = table.rows(indexes, format_time=False)
+"""
+
+import datetime
+import sys
+from array import array
+
+from django.template import defaultfilters as filters
+from django.utils.timezone import localtime
+
+from panopuppet.pano.puppetdb.pdbutils import json_to_datetime, _UTC
+from panopuppet.pano.settings import PUPPET_RUN_INTERVAL
+
+__author__ = 'etaklar'
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=_UTC)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+# Stored for missing timestamps, sorts before every real timestamp like '' does in dictstatus.
+MISSING = -1
+
+STATUSES = (None, 'unknown', 'unchanged', 'changed', 'failed', 'pending')
+# Same column numbers as the sortables of dictstatus and the tuples it returns.
+COLUMNS = (
+    'certname',
+    'catalog_timestamp',
+    'report_timestamp',
+    'facts_timestamp',
+    'successes',
+    'noops',
+    'failures',
+    'skips',
+)
+COLUMN_ATTRIBUTES = {
+    'certname': 'certnames',
+    'catalog_timestamp': 'catalog_timestamps',
+    'report_timestamp': 'report_timestamps',
+    'facts_timestamp': 'facts_timestamps',
+    'successes': 'successes',
+    'noops': 'noops',
+    'failures': 'failures',
+    'skips': 'skips',
+}
+BUCKETS = ('failed', 'changed', 'unreported', 'mismatch', 'pending')
+
+
+def to_epoch(timestamp):
+    """
+    :param timestamp: PuppetDB timestamp or None
+    :return: int microseconds since epoch, MISSING for None or ''
+    """
+    if not timestamp:
+        return MISSING
+    return (json_to_datetime(timestamp) - _EPOCH) // _MICROSECOND
+
+
+def from_epoch(value):
+    """
+    :return: timezone aware datetime of the epoch microseconds, None for MISSING
+    """
+    if value == MISSING:
+        return None
+    return _EPOCH + datetime.timedelta(microseconds=value)
+
+
+def to_timestamp(value):
+    """
+    :return: PuppetDB style timestamp string of the epoch microseconds, '' for MISSING
+    """
+    time = from_epoch(value)
+    if time is None:
+        return ''
+    if time.microsecond % 1000 == 0:
+        fraction = '%03d' % (time.microsecond // 1000)
+    else:
+        fraction = '%06d' % time.microsecond
+    return '%s.%sZ' % (time.strftime('%Y-%m-%dT%H:%M:%S'), fraction)
+
+
+class FleetTable(object):
+    def __init__(self):
+        self.certnames = []
+        self.catalog_timestamps = array('q')
+        self.report_timestamps = array('q')
+        self.facts_timestamps = array('q')
+        self.successes = array('l')
+        self.noops = array('l')
+        self.failures = array('l')
+        self.skips = array('l')
+        # 1 if the latest report of the node has event counts
+        self.has_events = array('b')
+        self.statuses = array('b')
+        self.status_names = list(STATUSES)
+        self._status_codes = {name: code for code, name in enumerate(STATUSES)}
+        self._index = None
+
+    def __len__(self):
+        return len(self.certnames)
+
+    @classmethod
+    def from_data(cls, node_list, reports_dict, status_dict):
+        """
+        Takes the same input as dictstatus().
+        :param node_list: list or iterator of nodes as returned by /nodes
+        :param reports_dict: dict of certname and {'status': <status>}, or None to use latest_report_status of the nodes
+        :param status_dict: dict of certname and the event-counts of its latest report
+        :return: FleetTable
+        """
+        table = cls()
+        seen = set()
+        for node in node_list:
+            certname = node['certname']
+            if certname in seen:
+                continue
+            seen.add(certname)
+            if reports_dict is None:
+                report_status = node.get('latest_report_status', 'unknown')
+            elif certname in reports_dict:
+                report_status = reports_dict[certname]['status']
+            else:
+                report_status = None
+            table.append(node, status_dict.get(certname), report_status)
+        return table
+
+    def append(self, node, events, report_status):
+        """
+        :param node: node dict as returned by /nodes
+        :param events: event-counts of the latest report of the node, None if it has none
+        :param report_status: status of the latest report of the node
+        """
+        if events and report_status == 'unchanged' and events['noops'] > 0:
+            report_status = 'pending'
+        self.has_events.append(0 if events is None else 1)
+        events = events or {}
+        self.certnames.append(sys.intern(node['certname']))
+        self.catalog_timestamps.append(to_epoch(node.get('catalog_timestamp')))
+        self.report_timestamps.append(to_epoch(node.get('report_timestamp')))
+        self.facts_timestamps.append(to_epoch(node.get('facts_timestamp')))
+        self.successes.append(events.get('successes', 0))
+        self.noops.append(events.get('noops', 0))
+        self.failures.append(events.get('failures', 0))
+        self.skips.append(events.get('skips', 0))
+        self.statuses.append(self.status_code(report_status))
+        self._index = None
+
+    def status_code(self, status):
+        if status not in self._status_codes:
+            self._status_codes[status] = len(self.status_names)
+            self.status_names.append(status)
+        return self._status_codes[status]
+
+    def column(self, name):
+        """
+        :param name: one of COLUMNS
+        :return: the sequence holding the column
+        """
+        return getattr(self, COLUMN_ATTRIBUTES[name])
+
+    def index(self, certname):
+        """
+        :return: row index of the certname or None
+        """
+        if self._index is None:
+            self._index = {certname: i for i, certname in enumerate(self.certnames)}
+        return self._index.get(certname)
+
+    def with_events(self):
+        """
+        :return: indexes of the nodes whose latest report has event counts
+        """
+        return [i for i, value in enumerate(self.has_events) if value]
+
+    def argsort(self, sortby='report_timestamp', reverse=False, indexes=None):
+        """
+        :param sortby: column name, unknown names sort by report_timestamp like dictstatus does
+        :param reverse: sort descending
+        :param indexes: only sort these indexes, defaults to all nodes
+        :return: list of indexes
+        """
+        if sortby not in COLUMNS:
+            sortby = 'report_timestamp'
+        column = self.column(sortby)
+        if indexes is None:
+            indexes = range(len(self))
+        return sorted(indexes, key=column.__getitem__, reverse=reverse)
+
+    def classify(self, puppet_run_time=PUPPET_RUN_INTERVAL, now=None):
+        """
+        Puts every node with a report in exactly one of the failed, changed, unreported and pending buckets,
+        an unreported node is only in the unreported bucket. Nodes can also be in the mismatch bucket.
+        :param puppet_run_time: minutes between puppet runs
+        :param now: datetime to compare the report timestamps with, defaults to the current time
+        :return: dict of bucket name and list of indexes
+        """
+        now = now or datetime.datetime.now(_UTC)
+        unreported_border = (now - _EPOCH) // _MICROSECOND - puppet_run_time * 60 * 1000000
+        max_difference = puppet_run_time / 2 * 60 * 1000000
+        codes = self._status_codes
+        none_code = codes[None]
+        bucket_codes = {codes['failed']: 'failed', codes['changed']: 'changed', codes['pending']: 'pending'}
+        buckets = {bucket: [] for bucket in BUCKETS}
+        unreported_list = buckets['unreported']
+        mismatch_list = buckets['mismatch']
+
+        for i, (status, report, catalog, facts) in enumerate(
+                zip(self.statuses, self.report_timestamps, self.catalog_timestamps, self.facts_timestamps)):
+            if status == none_code:
+                continue
+            if report == MISSING or catalog == MISSING or facts == MISSING:
+                mismatch_list.append(i)
+            elif max(report, catalog, facts) - min(report, catalog, facts) > max_difference:
+                mismatch_list.append(i)
+            if report == MISSING or report < unreported_border:
+                unreported_list.append(i)
+            elif status in bucket_codes:
+                buckets[bucket_codes[status]].append(i)
+        return buckets
+
+    def status(self, i, unknown_without_events=True):
+        """
+        :param unknown_without_events: nodes without event counts are 'unknown', as in dictstatus(get_status='all')
+        :return: report status of the node
+        """
+        if unknown_without_events and not self.has_events[i]:
+            return 'unknown'
+        return self.status_names[self.statuses[i]]
+
+    def rows(self, indexes=None, format_time=True, unknown_without_events=True):
+        """
+        :param indexes: indexes of the rows, defaults to all nodes
+        :param format_time: format the timestamps in the current timezone as dictstatus does
+        :param unknown_without_events: see status()
+        :return: list of tuples as returned by dictstatus()
+        """
+        if indexes is None:
+            indexes = range(len(self))
+        if format_time:
+            def timestamp(value):
+                time = from_epoch(value)
+                return '' if time is None else filters.date(localtime(time), 'Y-m-d H:i:s')
+        else:
+            timestamp = to_timestamp
+        rows = []
+        for i in indexes:
+            rows.append((
+                self.certnames[i],
+                timestamp(self.catalog_timestamps[i]),
+                timestamp(self.report_timestamps[i]),
+                timestamp(self.facts_timestamps[i]),
+                self.successes[i],
+                self.noops[i],
+                self.failures[i],
+                self.skips[i],
+                self.status(i, unknown_without_events),
+            ))
+        return rows
@@ -0,0 +1,207 @@
+"""
+Metrics of the PuppetDB requests, views and caches of this process.
+
+The metrics are kept in memory by each process and are exposed in the
+Prometheus text format on /pano/metrics. With several worker processes each
+scrape only sees the metrics of the worker which answered it.
+
+PuppetDB requests are labelled by endpoint (the first part of the path,
+e.g. nodes or catalogs) and views by their URL name so that the number of
+label values stays small.
+
+Example:
+
+PUPPETDB_REQUEST_SECONDS.observe(0.2, endpoint='nodes')
+CACHE_REQUESTS.inc(cache='report', result='hit')
+text = registry.render()
+"""
+
+from bisect import bisect_left
+from threading import Lock
+
+__author__ = 'etaklar'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 1 KB to 256 MB
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))
+RECORD_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        """
+        :param name: name of the metric
+        :param help_text: description shown in the HELP line
+        :param labels: names of the labels of the metric
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = Lock()
+
+    def label_values(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def format_labels(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (name, escape_label(value)) for name, value in pairs)
+
+    def samples(self):
+        return []
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s %s' % (self.name, self.kind)]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+    def clear(self):
+        with self._lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self.label_values(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def get(self, **labels):
+        return self.values.get(self.label_values(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self.values.items())
+        return ['%s%s %s' % (self.name, self.format_labels(key), format_value(value)) for key, value in values]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: sorted upper bounds of the buckets, +Inf is added
+        """
+        super(Histogram, self).__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self.values:
+                # count per bucket, +Inf included, sum and count of the observations
+                self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry = self.values[key]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def get(self, **labels):
+        """
+        :return: number of observations and their sum
+        """
+        entry = self.values.get(self.label_values(labels))
+        if entry is None:
+            return 0, 0.0
+        return entry[2], entry[1]
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self.values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket%s %d' % (self.name, self.format_labels(key, [('le', format_value(bound))]),
+                                                 cumulative))
+            lines.append('%s_sum%s %s' % (self.name, self.format_labels(key), format_value(total)))
+            lines.append('%s_count%s %d' % (self.name, self.format_labels(key), count))
+        return lines
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        :return: all metrics in the Prometheus text format
+        """
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+
+registry = Registry()
+
+PUPPETDB_REQUEST_SECONDS = registry.register(Histogram(
+    'panopuppet_puppetdb_request_seconds',
+    'Seconds until PuppetDB answered a request, streamed responses until the headers were received.',
+    ['endpoint']))
+PUPPETDB_RESPONSE_BYTES = registry.register(Histogram(
+    'panopuppet_puppetdb_response_bytes',
+    'Size of the PuppetDB responses which were not streamed.',
+    ['endpoint'], SIZE_BUCKETS))
+PUPPETDB_RECORDS = registry.register(Histogram(
+    'panopuppet_puppetdb_records',
+    'Total number of records reported by PuppetDB in the X-Records header.',
+    ['endpoint'], RECORD_BUCKETS))
+PUPPETDB_ERRORS = registry.register(Counter(
+    'panopuppet_puppetdb_errors_total',
+    'PuppetDB requests which failed, by reason: connection, an HTTP status code or invalid_json.',
+    ['endpoint', 'reason']))
+PUPPETDB_JOB_SECONDS = registry.register(Histogram(
+    'panopuppet_puppetdb_job_seconds',
+    'Seconds a PuppetDB job took once started, including all pages of paged jobs.',
+    ['endpoint']))
+PUPPETDB_JOB_WAIT_SECONDS = registry.register(Histogram(
+    'panopuppet_puppetdb_job_wait_seconds',
+    'Seconds a PuppetDB job waited for a worker thread of the shared executor.'))
+PUPPETDB_JOB_ERRORS = registry.register(Counter(
+    'panopuppet_puppetdb_job_errors_total',
+    'PuppetDB jobs which raised an exception.',
+    ['endpoint']))
+VIEW_SECONDS = registry.register(Histogram(
+    'panopuppet_view_seconds',
+    'Seconds taken to answer a request, by URL name.',
+    ['view']))
+VIEW_RESPONSES = registry.register(Counter(
+    'panopuppet_view_responses_total',
+    'Responses by URL name and HTTP status code.',
+    ['view', 'status']))
+CACHE_REQUESTS = registry.register(Counter(
+    'panopuppet_cache_requests_total',
+    'Cache lookups by cache and result: hit, miss or stale.',
+    ['cache', 'result']))
+
+
+def puppetdb_endpoint(path):
+    """
+    :param path: path passed to api_get
+    :return: the endpoint of the path, without the certnames or hashes following it
+    """
+    return path.lstrip('/').split('/')[0].split('?')[0] or 'root'
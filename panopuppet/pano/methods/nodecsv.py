@@ -0,0 +1,196 @@
+"""
+Streaming CSV export of the nodes list.
+
+The header is sent before PuppetDB is queried. The event counts of the
+latest reports are then fetched and kept as one small tuple per node. The
+nodes are paged from PuppetDB in the order the user sorted them by, the
+requested facts of the nodes of a page are fetched once the page arrives
+and every page is written out as soon as it has been joined with the
+counts and facts, so neither the nodes, their facts nor the rows of the
+export are ever held in memory at once.
+
+Nodes sorted by their event counts are sorted locally, their rows are
+built from the FleetTable of nodes_json and only joined with the facts
+while they are written.
+
+An error from PuppetDB is raised while the rows are generated, after the
+response status has been sent, see csv_response of the node_data views.
+
+Example:
+
+facts = parse_facts('kernel,osfamily')
+for row in export_rows(source, node_params, facts, request):
+    writer.writerow(row)
+"""
+
+import itertools
+import json
+
+from panopuppet.pano.methods.fleettable import FleetTable
+from panopuppet.pano.puppetdb.pdbutils import iter_puppetdb_pages, run_puppetdb_jobs
+from panopuppet.pano.puppetdb.puppetdb import api_get, mk_puppetdb_query
+from panopuppet.pano.settings import PUPPETDB_PAGE_SIZE
+
+__author__ = 'etaklar'
+
+CSV_HEADERS = ['Certname',
+               'Latest Catalog',
+               'Latest Report',
+               'Latest Facts',
+               'Success',
+               'Noop',
+               'Failure',
+               'Skipped',
+               'Run Status']
+EVENT_COUNT_FIELDS = ('successes', 'noops', 'failures', 'skips')
+LATEST_EVENT_COUNTS_QUERY = '["and",["=","latest_report?",true],' \
+                            '["in","certname",["extract","certname",["select_nodes",["null?","deactivated",true]]]]]'
+# Nodes per /facts query, keeps the query string of a request short
+FACT_QUERY_CERTNAMES = 100
+
+
+def parse_facts(include_facts):
+    """
+    :param include_facts: comma separated fact names from the request
+    :return: list of the fact names
+    """
+    if not include_facts:
+        return []
+    return [fact.strip() for fact in include_facts.split(',') if fact.strip()]
+
+
+def csv_headers(facts):
+    return CSV_HEADERS + list(facts)
+
+
+def latest_event_counts(source, request=None):
+    """
+    :param source: dict with the url, certs and verify of the PuppetDB source
+    :return: dict of certname and a tuple of its successes, noops, failures and skips
+    :raises ValueError: if PuppetDB answers with an error
+    """
+    params = {
+        'query': {1: LATEST_EVENT_COUNTS_QUERY},
+        'summarize_by': 'certname',
+    }
+    results = api_get(
+        api_url=source['url'],
+        cert=source['certs'],
+        verify=source['verify'],
+        path='/event-counts',
+        params=mk_puppetdb_query(params, request),
+        api_version='v4',
+    )
+    if type(results) is not list:
+        raise ValueError('PuppetDB could not count the events of the latest reports: %s' % results)
+    return {item['subject']['title']: tuple(item[field] for field in EVENT_COUNT_FIELDS) for item in results}
+
+
+def fact_values(source, facts, certnames, request=None):
+    """
+    Fetches the facts of some nodes, FACT_QUERY_CERTNAMES nodes per query, the queries run concurrently.
+    :param facts: list of fact names
+    :param certnames: list of the certnames of the nodes
+    :return: dict of certname and a tuple of the values of the facts, None for a missing fact
+    """
+    if not facts or not certnames:
+        return {}
+    names_query = '["or",%s]' % ','.join('["=","name",%s]' % json.dumps(fact) for fact in facts)
+    jobs = {}
+    for i in range(0, len(certnames), FACT_QUERY_CERTNAMES):
+        certnames_query = '["or",%s]' % ','.join(
+            '["=","certname",%s]' % json.dumps(certname) for certname in certnames[i:i + FACT_QUERY_CERTNAMES])
+        jobs[i] = {
+            'id': i,
+            'url': source['url'],
+            'certs': source['certs'],
+            'verify': source['verify'],
+            'path': '/facts',
+            'api_version': 'v4',
+            'params': {
+                'query': {
+                    'operator': 'and',
+                    1: names_query,
+                    2: certnames_query,
+                },
+            },
+            'request': request,
+            'paged': True,
+        }
+    positions = {fact: i for i, fact in enumerate(facts)}
+    values = {}
+    for items in run_puppetdb_jobs(jobs).values():
+        for item in items:
+            if item['name'] not in positions:
+                continue
+            node_values = values.get(item['certname'])
+            if node_values is None:
+                node_values = values[item['certname']] = [None] * len(facts)
+            node_values[positions[item['name']]] = item['value']
+    return {certname: tuple(node_values) for certname, node_values in values.items()}
+
+
+def with_facts(rows, facts, values):
+    """
+    :param rows: iterable of node rows, the first column is the certname
+    :param facts: list of fact names
+    :param values: dict returned by fact_values
+    :return: generator of the rows with a column per fact, empty if the node does not have the fact
+    """
+    missing = (None,) * len(facts)
+    for row in rows:
+        yield tuple(row) + tuple('' if value is None else value for value in values.get(row[0], missing))
+
+
+def paged_with_facts(source, rows, facts, request=None):
+    """
+    Joins the rows with their facts PUPPETDB_PAGE_SIZE rows at a time.
+    :param rows: iterable of node rows, the first column is the certname
+    :param facts: list of fact names
+    :return: generator of the rows with a column per fact
+    """
+    rows = iter(rows)
+    while True:
+        page = list(itertools.islice(rows, PUPPETDB_PAGE_SIZE))
+        if not page:
+            break
+        values = fact_values(source, facts, [row[0] for row in page], request)
+        for row in with_facts(page, facts, values):
+            yield row
+
+
+def paged_rows(source, node_params, event_counts, request=None):
+    """
+    :param node_params: params of the /nodes query in the format accepted by mk_puppetdb_query
+    :param event_counts: dict returned by latest_event_counts
+    :return: generator of the rows of the nodes in the order of the query
+    """
+    nodes = iter_puppetdb_pages('/nodes', params=node_params, request=request, url=source['url'],
+                                certs=source['certs'], verify=source['verify'], api_version='v4')
+    while True:
+        page = list(itertools.islice(nodes, PUPPETDB_PAGE_SIZE))
+        if not page:
+            break
+        page_counts = {}
+        for node in page:
+            counts = event_counts.get(node['certname'])
+            if counts is not None:
+                page_counts[node['certname']] = dict(zip(EVENT_COUNT_FIELDS, counts))
+        for row in FleetTable.from_data(page, None, page_counts).rows(format_time=False):
+            yield row
+
+
+def export_rows(source, node_params, facts, request=None, rows=None):
+    """
+    Generator of the rows of the export, nothing is fetched before the first row is asked for.
+    :param source: dict with the url, certs and verify of the PuppetDB source
+    :param node_params: params of the /nodes query, used if rows is None
+    :param facts: list of fact names to add to the rows
+    :param rows: rows which are already sorted, instead of paging the nodes
+    :return: generator of tuples
+    """
+    if rows is None:
+        rows = paged_rows(source, node_params, latest_event_counts(source, request), request)
+    for row in paged_with_facts(source, rows, facts, request):
+        yield row
+
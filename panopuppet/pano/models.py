@@ -17,7 +17,7 @@ def __str__(self):
 @python_2_unicode_compatible
 class SavedQueries(models.Model):
     id = models.AutoField(primary_key=True)
-    username = models.CharField(max_length=24)
+    username = models.CharField(max_length=24, db_index=True)
     identifier = models.CharField(max_length=32, default='Saved Query')
     filter = models.TextField()
 
@@ -29,4 +29,72 @@ class SavedCatalogs(models.Model):
     catalogue_id = models.CharField(max_length=50)
     linked_report = models.CharField(max_length=50)
     timestamp = models.DateTimeField()
-    catalogue = models.TextField()
+    # Full catalogue as JSON, only used by catalogues saved before the sections below existed.
+    catalogue = models.TextField(blank=True, default='')
+    # zlib compressed JSON of the catalogue without the resources and edges data
+    metadata_blob = models.BinaryField(null=True)
+    # zlib compressed JSON of the edges
+    edges_blob = models.BinaryField(null=True)
+    # zlib compressed JSON list of the digests of the resources, the resources are stored in CatalogResource
+    resources_blob = models.BinaryField(null=True)
+
+    class Meta:
+        # Also the index used for listing the saved catalogues of a host
+        unique_together = ('hostname', 'catalogue_id')
+
+
+@python_2_unicode_compatible
+class CatalogResource(models.Model):
+    """
+    A resource of a saved catalogue, shared by all saved catalogues of the host containing the same resource.
+    """
+    id = models.AutoField(primary_key=True)
+    hostname = models.CharField(max_length=255)
+    digest = models.CharField(max_length=32)
+    # zlib compressed JSON of the resource
+    data = models.BinaryField()
+
+    class Meta:
+        unique_together = ('hostname', 'digest')
+
+    def __str__(self):
+        return '%s %s' % (self.hostname, self.digest)
+
+
+@python_2_unicode_compatible
+class EventRollup(models.Model):
+    """
+    A resource of a node which had events of a status in an hour.
+    """
+    id = models.AutoField(primary_key=True)
+    source = models.CharField(max_length=255)
+    # Start of the hour in UTC
+    hour = models.DateTimeField()
+    certname = models.CharField(max_length=255)
+    resource_type = models.CharField(max_length=255)
+    resource_title = models.TextField()
+    # Resources without a containing class have none
+    containing_class = models.TextField(null=True)
+    status = models.CharField(max_length=10)
+    # Number of events of the resource with the status in the hour
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = ('source', 'hour')
+
+    def __str__(self):
+        return '%s %s %s[%s] %s' % (self.hour, self.certname, self.resource_type, self.resource_title, self.status)
+
+
+@python_2_unicode_compatible
+class EventRollupState(models.Model):
+    """
+    The hours of a source for which EventRollup holds the events.
+    """
+    source = models.CharField(max_length=255, primary_key=True)
+    first_hour = models.DateTimeField()
+    # Events are counted up to this time
+    until = models.DateTimeField()
+
+    def __str__(self):
+        return self.source
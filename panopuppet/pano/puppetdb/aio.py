@@ -0,0 +1,97 @@
+"""
+asyncio interface to PuppetDB.
+
+The coroutines mirror puppetdb.api_get and pdbutils.run_puppetdb_jobs: the
+same path rewriting to pdb/query/v4 and metrics/v1 is applied and responses
+with an X-Records header are returned as (results, headers).
+
+requests is a blocking library, so each HTTP call is handed to the shared
+PuppetDB executor and the event loop awaits it. This keeps the connection
+pools, the per source request limit and the job timeouts in one place.
+
+Under WSGI a view runs its coroutine with run(), which blocks the thread of
+the request until the coroutine is done just like JobGroup does, the
+queries are concurrent but the request still needs its own thread. Only an
+async server running the coroutines on its own event loop serves many users
+from one thread.
+
+Examples:
+
+async def population(request):
+    source_url, source_certs, source_verify = get_server(request)
+    nodes = await api_get(api_url=source_url, cert=source_certs, verify=source_verify, path='/nodes')
+    return len(nodes)
+
+run(population(request))
+"""
+
+import asyncio
+import time
+from functools import partial
+
+from panopuppet.pano.puppetdb import puppetdb
+from panopuppet.pano.puppetdb.pdbutils import get_executor, run_job
+from panopuppet.pano.settings import PUPPETDB_HOST, PUPPETDB_VERIFY_SSL, PUPPETDB_CERTIFICATES, PUPPETDB_JOB_TIMEOUT
+
+__author__ = 'etaklar'
+
+
+async def api_get(api_url=PUPPETDB_HOST,
+                  api_version='v4',
+                  path='',
+                  method='get',
+                  params=None,
+                  verify=PUPPETDB_VERIFY_SSL,
+                  cert=PUPPETDB_CERTIFICATES,
+                  timeout=None):
+    """
+    Coroutine version of puppetdb.api_get, takes the same arguments.
+    :return: dict, list or tuple(list, headers) if the response has a X-Records header
+    """
+    loop = asyncio.get_running_loop()
+    call = partial(puppetdb.api_get,
+                   api_url=api_url,
+                   api_version=api_version,
+                   path=path,
+                   method=method,
+                   params=params,
+                   verify=verify,
+                   cert=cert,
+                   timeout=timeout)
+    return await loop.run_in_executor(get_executor(), call)
+
+
+async def run_puppetdb_job(job, timeout=PUPPETDB_JOB_TIMEOUT):
+    """
+    :param job: dict describing the job, see pdbutils.run_puppetdb_jobs
+    :param timeout: seconds to wait for the job unless the job has its own 'timeout'
+    :return: the result of the job
+    """
+    loop = asyncio.get_running_loop()
+    job_timeout = job.get('timeout', timeout)
+    future = loop.run_in_executor(get_executor(), run_job, job, job_timeout, time.time())
+    return await asyncio.wait_for(future, job_timeout)
+
+
+async def run_puppetdb_jobs(jobs, timeout=PUPPETDB_JOB_TIMEOUT):
+    """
+    Coroutine version of pdbutils.run_puppetdb_jobs, all jobs are gathered concurrently.
+    :param jobs: dict of jobs
+    :param timeout: seconds to wait for each job unless the job has its own 'timeout'
+    :return: dict of job id and job result
+    """
+    job_list = list(jobs.values())
+    results = await asyncio.gather(*[run_puppetdb_job(job, timeout) for job in job_list])
+    return {job['id']: result for job, result in zip(job_list, results)}
+
+
+def run(coro):
+    """
+    Runs a coroutine to completion on a new event loop and returns its result.
+    Used by the synchronous Django views.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
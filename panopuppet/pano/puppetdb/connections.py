@@ -0,0 +1,120 @@
+"""
+Process wide pool of keep-alive HTTP sessions.
+
+Every PuppetDB and Puppetmaster request goes through a requests.Session
+which is shared by all threads in the worker. Sessions are keyed on the
+base URL, the client certificates and the SSL verify setting of the source
+so each source in AVAILABLE_SOURCES gets its own pool and the TCP/TLS
+handshake is only paid when a new connection is opened.
+
+A session is in use from checkout_session until its release_session, a
+streamed response keeps it in use until the response is closed. Sessions
+in use are never closed as idle.
+
+Example:
+
+with pooled_session('https://puppetdb.example.com:8081/', cert=('cert.pem', 'key.pem'), verify='ca.pem') as session:
+    session.get('https://puppetdb.example.com:8081/pdb/query/v4/nodes')
+"""
+
+import threading
+import time
+import urllib.parse as urlparse
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from panopuppet.pano.settings import POOL_SIZE, POOL_IDLE_TIMEOUT
+
+__author__ = 'etaklar'
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def pool_key(url, cert=None, verify=False):
+    """
+    :param url: URL of the source, only the scheme and host part is used.
+    :param cert: list or tuple of cert and key used for client authentication
+    :param verify: True/False/CA_File_Name
+    :return: tuple usable as a dict key
+    """
+    parsed = urlparse.urlsplit(url)
+    if isinstance(cert, list):
+        cert = tuple(cert)
+    return parsed.scheme, parsed.netloc, cert, verify
+
+
+def _new_session(cert, verify):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.cert = cert
+    session.verify = verify
+    return session
+
+
+def _evict_idle(now):
+    # Must be called with _sessions_lock held.
+    for key, (session, last_used, users) in list(_sessions.items()):
+        if not users and now - last_used > POOL_IDLE_TIMEOUT:
+            del _sessions[key]
+            session.close()
+
+
+def checkout_session(url, cert=None, verify=False):
+    """
+    Returns the shared session for the source, creating it if needed, and marks it in use.
+    Sessions which are not in use and have not been used for POOL_IDLE_TIMEOUT seconds
+    are closed so that idle sources do not hold sockets open forever.
+    :param url: URL of the source
+    :param cert: list or tuple of cert and key to use for client authentication
+    :param verify: True/False/CA_File_Name to perform SSL Verification of CA Chain
+    :return: pool key and requests.Session, the key has to be passed to release_session
+    """
+    key = pool_key(url, cert, verify)
+    now = time.time()
+    with _sessions_lock:
+        _evict_idle(now)
+        if key in _sessions:
+            session, last_used, users = _sessions[key]
+        else:
+            session, users = _new_session(key[2], verify), 0
+        _sessions[key] = [session, now, users + 1]
+    return key, session
+
+
+def release_session(key, session):
+    """
+    Marks a session returned by checkout_session as no longer in use by the caller.
+    """
+    with _sessions_lock:
+        entry = _sessions.get(key)
+        # The session may have been replaced after close_sessions
+        if entry is not None and entry[0] is session and entry[2] > 0:
+            entry[1] = time.time()
+            entry[2] -= 1
+
+
+@contextmanager
+def pooled_session(url, cert=None, verify=False):
+    """
+    The shared session of the source, in use until the block ends. See checkout_session.
+    """
+    key, session = checkout_session(url, cert, verify)
+    try:
+        yield session
+    finally:
+        release_session(key, session)
+
+
+def close_sessions():
+    """
+    Closes all pooled sessions and their connections.
+    """
+    with _sessions_lock:
+        for session, last_used, users in _sessions.values():
+            session.close()
+        _sessions.clear()
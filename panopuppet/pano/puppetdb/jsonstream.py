@@ -0,0 +1,107 @@
+"""
+Incremental decoding of JSON arrays.
+
+PuppetDB answers most queries with a single JSON array of records. For
+large fleets that array can be tens of megabytes, so instead of holding the
+raw response, the decoded string and the object tree at once the records
+can be decoded one at a time as the chunks arrive from the socket.
+
+Example:
+
+for node in iter_json_array(['[{"certname": "a"}, {"cert', 'name": "b"}]']):
+    print(node['certname'])
+"""
+
+import json
+
+__author__ = 'etaklar'
+
+WHITESPACE = ' \t\n\r'
+# Drop consumed data from the buffer once this many characters have been decoded.
+COMPACT_AFTER = 65536
+
+
+def iter_json_array(chunks):
+    """
+    Yields each element of a JSON array read from an iterable of str chunks.
+    :param chunks: iterable of str
+    :return: generator of decoded elements
+    :raises ValueError: if the document is not a well formed JSON array
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    exhausted = False
+
+    def read_more():
+        for chunk in chunks:
+            if chunk:
+                return chunk
+        return None
+
+    def skip(buf, pos, chars):
+        while pos < len(buf) and buf[pos] in chars:
+            pos += 1
+        return pos
+
+    # Locate the opening bracket of the array.
+    while True:
+        pos = skip(buf, pos, WHITESPACE)
+        if pos < len(buf):
+            break
+        chunk = read_more()
+        if chunk is None:
+            raise ValueError('Empty JSON document.')
+        buf, pos = chunk, 0
+    if buf[pos] != '[':
+        raise ValueError('JSON document is not an array.')
+    pos += 1
+    expect_value = True
+    first = True
+
+    while True:
+        pos = skip(buf, pos, WHITESPACE)
+        if pos < len(buf):
+            char = buf[pos]
+            if not expect_value:
+                # Elements are separated by commas, the array ends after an element.
+                if char == ']':
+                    return
+                if char != ',':
+                    raise ValueError('Expected , or ] in JSON array.')
+                pos += 1
+                expect_value = True
+                continue
+            if char == ']' and first:
+                return
+            if char in ',]':
+                raise ValueError('Expected a value in JSON array.')
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                obj, end = None, None
+            # A scalar which ends at the end of the buffer may continue in the next chunk.
+            if end is not None and (end < len(buf) or exhausted or isinstance(obj, (dict, list))):
+                yield obj
+                pos = end
+                expect_value = False
+                first = False
+                if pos > COMPACT_AFTER:
+                    buf, pos = buf[pos:], 0
+                continue
+        if exhausted:
+            raise ValueError('Truncated JSON array.')
+        # Read at least as much as is left undecoded before decoding again, so an element spanning
+        # many chunks is only decoded a logarithmic number of times instead of once per chunk.
+        pending = [buf[pos:]]
+        wanted = max(len(pending[0]), 1)
+        while wanted > 0:
+            chunk = read_more()
+            if chunk is None:
+                exhausted = True
+                break
+            pending.append(chunk)
+            wanted -= len(chunk)
+        buf = ''.join(pending)
+        pos = 0
@@ -1,9 +1,35 @@
 import datetime
-import queue
+import json
+import re
+import time
 
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from threading import BoundedSemaphore, Lock, Thread
 
+from panopuppet.pano.methods import metrics
 from panopuppet.pano.puppetdb import puppetdb
+from panopuppet.pano.puppetdb.connections import pool_key
+from panopuppet.pano.settings import PUPPETDB_PAGE_SIZE, PUPPETDB_MAX_WORKERS, PUPPETDB_MAX_REQUESTS_PER_SOURCE, \
+    PUPPETDB_JOB_TIMEOUT
+
+_executor = None
+_executor_lock = Lock()
+_source_semaphores = {}
+
+# Fields which together give each endpoint a stable order so that
+# limit/offset pages neither skip nor repeat records.
+PAGE_ORDER_FIELDS = {
+    'nodes': ['certname'],
+    'factsets': ['certname'],
+    'facts': ['certname', 'name'],
+    'fact-contents': ['certname', 'path'],
+    'catalogs': ['certname'],
+    'resources': ['certname', 'type', 'title'],
+    'edges': ['certname', 'source_type', 'source_title', 'relationship', 'target_type', 'target_title'],
+    'reports': ['hash'],
+    'events': ['report', 'resource_type', 'resource_title', 'property'],
+}
 
 
 class UTC(datetime.tzinfo):
@@ -28,18 +54,34 @@ def __unicode__(self):
         return 'UTC'
 
 
+_UTC = UTC()
+# PuppetDB timestamps, e.g. 2016-09-18T10:04:15.123Z
+_TIMESTAMP_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})\.(\d{1,6})Z\Z', re.ASCII)
+# Number of parsed timestamps remembered by json_to_datetime
+TIMESTAMP_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=TIMESTAMP_CACHE_SIZE)
 def json_to_datetime(date):
     """Tranforms a JSON datetime string into a timezone aware datetime
     object with a UTC tzinfo object.
 
+    The same timestamps are parsed many times per request, the results
+    are remembered and share a single UTC tzinfo object.
+
     :param date: The datetime representation.
     :type date: :obj:`string`
 
     :returns: A timezone aware datetime object.
     :rtype: :class:`datetime.datetime`
     """
-    return datetime.datetime.strptime(date, '%Y-%m-%dT%H:%M:%S.%fZ').replace(
-        tzinfo=UTC())
+    match = _TIMESTAMP_RE.match(date)
+    if match is None:
+        # Let strptime deal with anything unusual, it raises ValueError for invalid timestamps.
+        return datetime.datetime.strptime(date, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=_UTC)
+    year, month, day, hour, minute, second, fraction = match.groups()
+    return datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second),
+                             int(fraction.ljust(6, '0')), tzinfo=_UTC)
 
 
 def is_unreported(node_report_timestamp, unreported=120):
@@ -58,104 +100,255 @@ def is_unreported(node_report_timestamp, unreported=120):
     return False
 
 
-def run_puppetdb_jobs(jobs, threads=6):
-    if type(threads) != int:
-        threads = 6
-    if len(jobs) < threads:
-        threads = len(jobs)
-    jobs_q = queue.Queue()
-    out_q = queue.Queue()
+def iter_puppetdb_pages(path, params=None, request=None, url=None, certs=None, verify=None, api_version='v4',
+                        page_size=PUPPETDB_PAGE_SIZE, prefetch=True, timeout=None):
+    """
+    Generator yielding every record of a PuppetDB query, fetched page_size
+    records at a time with limit/offset. The order_by of the params is kept
+    and the endpoint's PAGE_ORDER_FIELDS are appended so the order is stable.
+    Pages are decoded with api_get(stream=True). If prefetch is True the next
+    page is requested and decoded on a background thread while the records of
+    the current page are consumed, otherwise the records of each page are
+    yielded one by one as they arrive from PuppetDB.
+    Every page request takes a slot of the source_semaphore of the url while
+    it is in flight, a page which is not prefetched keeps it until all of its
+    records have been consumed.
+    An error while fetching any page, on the background thread too, is raised
+    to the consumer so that an incomplete result is never mistaken for the
+    whole result.
+    :param path: Path to request
+    :param params: dict in the format accepted by mk_puppetdb_query
+    :param request: user request, used to apply the permission filter
+    :param page_size: Number of records per request
+    :param prefetch: Fetch the next page in the background
+    :param timeout: seconds to wait for PuppetDB to answer each page
+    :return: generator of dicts
+    :raises ValueError: if PuppetDB answers a page with an error
+    """
+    params = dict(params or {})
+    for key in ('limit', 'offset', 'include_total'):
+        params.pop(key, None)
+    order_by = params.pop('order_by', None)
+    query = puppetdb.mk_puppetdb_query(params, request)
 
-    def db_threaded_requests(i, q):
-        while True:
-            t_job = q.get()
-            t_path = t_job['path']
-            t_url = t_job.get('url')
-            t_certs = t_job.get('certs')
-            t_verify = t_job.get('verify')
-            t_params = t_job.get('params', {})
-            t_api_v = t_job.get('api_version', 'v3')
-            t_request = t_job.get('request')
-            results = puppetdb.api_get(
-                api_url=t_url,
-                verify=t_verify,
-                cert=t_certs,
-                path=t_path,
-                params=puppetdb.mk_puppetdb_query(t_params, t_request),
-                api_version=t_api_v,
-            )
-            out_q.put({t_job['id']: results})
-            q.task_done()
-
-    for i in range(threads):
-        worker = Thread(target=db_threaded_requests, args=(i, jobs_q))
-        worker.setDaemon(True)
-        worker.start()
+    order_fields = []
+    if order_by and 'order_field' in order_by:
+        order_fields.append({'field': order_by['order_field']['field'],
+                             'order': order_by['order_field'].get('order', 'asc')})
+    endpoint = path.lstrip('/').split('/')[0]
+    for field in PAGE_ORDER_FIELDS.get(endpoint, ['certname']):
+        if field not in [order_field['field'] for order_field in order_fields]:
+            order_fields.append({'field': field, 'order': 'asc'})
+    query['order_by'] = json.dumps(order_fields)
 
-    for job in jobs:
-        jobs_q.put(jobs[job])
-    jobs_q.join()
-    job_results = {}
-    while True:
-        try:
-            msg = (out_q.get_nowait())
-            job_results = dict(
-                list(job_results.items()) + list(msg.items()))
-        except queue.Empty:
-            break
+    def fetch(offset):
+        page_query = dict(query)
+        page_query['limit'] = page_size
+        page_query['offset'] = offset
+        # An error response from PuppetDB is not a JSON array, decoding it raises ValueError.
+        return puppetdb.api_get(
+            api_url=url,
+            verify=verify,
+            cert=certs,
+            path=path,
+            params=page_query,
+            api_version=api_version,
+            stream=True,
+            timeout=timeout,
+        )
 
-    return job_results
+    def stream_page(offset):
+        with source_semaphore(url):
+            for record in fetch(offset):
+                yield record
 
+    def fetch_page(offset):
+        with source_semaphore(url):
+            return list(fetch(offset))
 
-def generate_csv(jobs, threads=6):
-    if type(threads) != int:
-        threads = 6
-    if len(jobs) < threads:
-        threads = len(jobs)
-    jobs_q = queue.Queue()
-    out_q = queue.Queue()
+    def fetch_into(offset, holder):
+        try:
+            holder['page'] = fetch_page(offset)
+        except Exception as e:
+            holder['error'] = e
 
-    def db_threaded_requests(i, q):
+    offset = 0
+    if not prefetch:
         while True:
-            # Get the job
-            t_job = q.get()
-            # Start assigning variables from the data in the dict we received above.
-            t_id = t_job['id']
-            t_include_facts = t_job['include_facts']
-            t_node = t_job['node']
-            t_facts = t_job['facts']
-            # Convert tuple to list
-            t_node = list(t_node)
-            # End of assigning variables
-            # For each fact the user requested, locate the fact result for each node
-            # and append it to the t_node list.
-            # If the node does not have a value for the fact add an empty column.
-            for fact in t_include_facts:
-                fact = fact.strip()
-                if t_node[0] in t_facts[fact]:
-                    t_node.append(t_facts[fact][t_node[0]]['value'])
-                else:
-                    t_node.append('')
-            # package the above results and put into a dict with the key name corresponding to the ID.
-            t_result = dict()
-            t_result[t_id] = tuple(t_node)
-            out_q.put(t_result)
-            q.task_done()
-
-    for i in range(threads):
-        worker = Thread(target=db_threaded_requests, args=(i, jobs_q))
-        worker.setDaemon(True)
-        worker.start()
+            count = 0
+            for record in stream_page(offset):
+                count += 1
+                yield record
+            if count < page_size:
+                return
+            offset += page_size
 
-    for job in jobs:
-        jobs_q.put(jobs[job])
-    jobs_q.join()
-    job_results = {}
+    page = fetch_page(offset)
     while True:
+        next_page = {}
+        worker = None
+        if len(page) == page_size:
+            worker = Thread(target=fetch_into, args=(offset + page_size, next_page), daemon=True)
+            worker.start()
+        for record in page:
+            yield record
+        if worker is None:
+            return
+        offset += page_size
+        worker.join()
+        if 'error' in next_page:
+            raise next_page['error']
+        page = next_page['page']
+
+
+def get_executor():
+    """
+    Returns the process wide executor used for PuppetDB jobs.
+    It is created on first use and shared by all requests in the worker.
+    :return: concurrent.futures.ThreadPoolExecutor
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PUPPETDB_MAX_WORKERS)
+    return _executor
+
+
+def source_semaphore(url):
+    """
+    Returns the semaphore limiting concurrent requests to a PuppetDB source.
+    :param url: URL of the PuppetDB source
+    :return: threading.BoundedSemaphore
+    """
+    key = pool_key(url or '')[:2]
+    with _executor_lock:
+        if key not in _source_semaphores:
+            _source_semaphores[key] = BoundedSemaphore(PUPPETDB_MAX_REQUESTS_PER_SOURCE)
+        return _source_semaphores[key]
+
+
+def run_job(job, timeout=None, submitted=None):
+    """
+    Runs a single PuppetDB job in the calling thread.
+    :param job: dict describing the job, see run_puppetdb_jobs
+    :param timeout: seconds to wait for PuppetDB to answer
+    :param submitted: time the job was submitted to the executor
+    :return: the result of api_get or the list of records if the job is paged
+    """
+    started = time.time()
+    if submitted is not None:
+        metrics.PUPPETDB_JOB_WAIT_SECONDS.observe(started - submitted)
+    endpoint = metrics.puppetdb_endpoint(job['path'])
+    try:
+        return _run_job(job, timeout)
+    except Exception:
+        metrics.PUPPETDB_JOB_ERRORS.inc(endpoint=endpoint)
+        raise
+    finally:
+        metrics.PUPPETDB_JOB_SECONDS.observe(time.time() - started, endpoint=endpoint)
+
+
+def _run_job(job, timeout):
+    t_path = job['path']
+    t_url = job.get('url')
+    t_certs = job.get('certs')
+    t_verify = job.get('verify')
+    t_params = job.get('params', {})
+    t_api_v = job.get('api_version', 'v3')
+    t_request = job.get('request')
+    if job.get('paged', False):
+        # Each page takes its own slot of the source_semaphore.
+        return list(iter_puppetdb_pages(
+            t_path,
+            params=t_params,
+            request=t_request,
+            url=t_url,
+            certs=t_certs,
+            verify=t_verify,
+            api_version=t_api_v,
+            prefetch=False,
+            timeout=timeout,
+        ))
+    with source_semaphore(t_url):
+        return puppetdb.api_get(
+            api_url=t_url,
+            verify=t_verify,
+            cert=t_certs,
+            path=t_path,
+            params=puppetdb.mk_puppetdb_query(t_params, t_request),
+            api_version=t_api_v,
+            timeout=timeout,
+        )
+
+
+class JobGroup(object):
+    """
+    The PuppetDB jobs of a single request.
+    Jobs are submitted to the shared executor and their futures are kept by job id.
+
+    group = JobGroup(timeout=30)
+    group.submit({'id': 'all_nodes', 'path': '/nodes', 'url': source_url})
+    results = group.results()
+    """
+
+    def __init__(self, timeout=PUPPETDB_JOB_TIMEOUT):
+        self.timeout = timeout
+        self.futures = {}
+        self.timeouts = {}
+        self.started = time.time()
+
+    def submit(self, job):
+        """
+        :param job: dict describing the job, may contain a 'timeout' in seconds overriding the group timeout
+        :return: concurrent.futures.Future
+        """
+        job_timeout = job.get('timeout', self.timeout)
+        future = get_executor().submit(run_job, job, job_timeout, time.time())
+        self.futures[job['id']] = future
+        self.timeouts[job['id']] = job_timeout
+        return future
+
+    def cancel(self):
+        """
+        Cancels the jobs which have not started yet.
+        """
+        for future in self.futures.values():
+            future.cancel()
+
+    def results(self):
+        """
+        Waits for all jobs of the group.
+        If a job fails or does not finish within its timeout the remaining
+        jobs are cancelled and the exception is raised. A running job can not
+        be stopped, one which timed out keeps its worker thread and its slot
+        of the source_semaphore until its request returns. The timeout is
+        passed on to requests, so that happens at the latest when connecting
+        or reading from PuppetDB takes longer than the timeout.
+        :return: dict of job id and job result
+        """
+        job_results = {}
         try:
-            msg = (out_q.get_nowait())
-            job_results = dict(
-                list(job_results.items()) + list(msg.items()))
-        except queue.Empty:
-            break
-    return job_results
+            for job_id, future in self.futures.items():
+                job_timeout = self.timeouts[job_id]
+                if job_timeout is not None:
+                    job_timeout = max(0, job_timeout - (time.time() - self.started))
+                job_results[job_id] = future.result(timeout=job_timeout)
+        except Exception:
+            self.cancel()
+            raise
+        return job_results
+
+
+def run_puppetdb_jobs(jobs):
+    """
+    Runs the jobs concurrently on the shared executor and waits for them.
+    Concurrency is limited by PUPPETDB_MAX_WORKERS and PUPPETDB_MAX_REQUESTS_PER_SOURCE.
+    :param jobs: dict of jobs, each job is a dict with the keys
+        id, path, url, certs, verify, params, api_version, request and optionally paged and timeout
+    :return: dict of job id and job result
+    """
+    group = JobGroup()
+    for job in jobs:
+        group.submit(jobs[job])
+    return group.results()
+
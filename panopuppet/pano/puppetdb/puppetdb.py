@@ -14,24 +14,45 @@
 """
 
 import json
-import requests
+import threading
+import time
 import urllib.parse as urlparse
 
+from panopuppet.pano.methods import metrics
+from panopuppet.pano.puppetdb.connections import checkout_session, release_session, pool_key
+from panopuppet.pano.puppetdb.jsonstream import iter_json_array
 from panopuppet.pano.settings import PUPPETDB_HOST, PUPPETDB_VERIFY_SSL, PUPPETDB_CERTIFICATES, AVAILABLE_SOURCES, \
     PUPPETMASTER_CLIENTBUCKET_CERTIFICATES, PUPPETMASTER_CLIENTBUCKET_HOST, PUPPETMASTER_CLIENTBUCKET_SHOW, \
     PUPPETMASTER_CLIENTBUCKET_VERIFY_SSL, PUPPETMASTER_FILESERVER_CERTIFICATES, PUPPETMASTER_FILESERVER_HOST, \
     PUPPETMASTER_FILESERVER_SHOW, PUPPETMASTER_FILESERVER_VERIFY_SSL, PUPPET_RUN_INTERVAL, AUTH_METHOD, \
-    ENABLE_PERMISSIONS
+    ENABLE_PERMISSIONS, PUPPETDB_VERSION_TTL
 
 __author__ = 'etaklar'
 
+# Field projections for the 'fields' param of mk_puppetdb_query. A full report
+# carries its logs, metrics and resource events, most views only need a few fields.
+# Fields used in order_by must be part of the projection.
+REPORT_STATUS_FIELDS = ['certname', 'status']
+REPORT_LIST_FIELDS = ['certname', 'hash', 'environment', 'status', 'noop', 'start_time', 'end_time',
+                      'configuration_version']
+REPORT_RUN_TIME_FIELDS = ['certname', 'start_time', 'end_time', 'receive_time']
+
+# Detected PuppetDB versions, pool_key of the source -> (version, time of the check, check failed)
+_pdb_versions = {}
+_pdb_versions_lock = threading.Lock()
+# pool_key of the source -> Event set once its running check is done
+_pdb_versions_probing = {}
+# Seconds before a source that could not be reached is checked again
+PDB_VERSION_RETRY = 60
+# Seconds to wait for the version of a source
+PDB_VERSION_TIMEOUT = 10
+
 
 def get_server(request, type='puppetdb'):
     """
     :param request:
     :return: three variables in order: url, url certificates, ssl verify, (show status)
     """
-    from panopuppet.pano.settings import PUPPETDB_VERS
     if 'PUPPETDB_HOST' in request.session:
         if type == 'puppetdb':
             return \
@@ -39,8 +60,9 @@ def get_server(request, type='puppetdb'):
                 request.session['PUPPETDB_CERTIFICATES'], \
                 request.session['PUPPETDB_VERIFY_SSL']
         elif type == 'puppetdb_vers':
-            return \
-                request.session['PUPPETDB_VERS']
+            return pdb_version(request.session['PUPPETDB_HOST'],
+                               request.session['PUPPETDB_CERTIFICATES'],
+                               request.session['PUPPETDB_VERIFY_SSL'])
 
         elif type == 'filebucket':
             return \
@@ -60,7 +82,7 @@ def get_server(request, type='puppetdb'):
         if type == 'puppetdb':
             return PUPPETDB_HOST, PUPPETDB_CERTIFICATES, PUPPETDB_VERIFY_SSL
         elif type == 'puppetdb_vers':
-            return PUPPETDB_VERS
+            return pdb_version(PUPPETDB_HOST, PUPPETDB_CERTIFICATES, PUPPETDB_VERIFY_SSL)
         elif type == 'filebucket':
             return \
                 PUPPETMASTER_CLIENTBUCKET_HOST, \
@@ -101,10 +123,9 @@ def set_server(request, source):
         source.get('PUPPETMASTER_FILESERVER_CERTIFICATES', [None, None]))
     request.session['PUPPETMASTER_FILESERVER_VERIFY_SSL'] = source.get('PUPPETMASTER_FILESERVER_VERIFY_SSL', False)
     request.session['PUPPET_RUN_INTERVAL'] = source.get('PUPPET_RUN_INTERVAL', False)
-    request.session['PUPPETDB_VERS'] = ident_pdb_vers(request)
 
 
-def ident_pdb_vers(request=None, source_url=None, source_verify=None, source_certs=None):
+def ident_pdb_vers(request=None, source_url=None, source_verify=None, source_certs=None, timeout=None):
     if request:
         source_url, source_certs, source_verify = get_server(request)
     vers = api_get(
@@ -114,19 +135,99 @@ def ident_pdb_vers(request=None, source_url=None, source_verify=None, source_cer
         cert=source_certs,
         path='/pdb/meta/v1/version',
         api_version='v4',
+        timeout=timeout,
     )
     if 'version' in vers:
         return int(vers['version'][0])
     return None
 
 
+def _begin_pdb_version_check(key):
+    """
+    :return: Event set once the check of the source is done, True if the caller has to run the check
+    """
+    with _pdb_versions_lock:
+        if key in _pdb_versions_probing:
+            return _pdb_versions_probing[key], False
+        done = _pdb_versions_probing[key] = threading.Event()
+        return done, True
+
+
+def _check_pdb_version(key, source_url, source_certs, source_verify):
+    try:
+        version = ident_pdb_vers(source_url=source_url, source_certs=source_certs, source_verify=source_verify,
+                                 timeout=PDB_VERSION_TIMEOUT)
+    except Exception:
+        version = None
+    # An error answered by PuppetDB also gives no version, so it is retried like an unreachable source.
+    entry = (version, time.time(), version is None)
+    with _pdb_versions_lock:
+        _pdb_versions[key] = entry
+        _pdb_versions_probing.pop(key).set()
+    return version
+
+
+def _probe_pdb_version(key, source_url, source_certs, source_verify):
+    # Starts a background check of the version unless one is already running.
+    done, start = _begin_pdb_version_check(key)
+    if not start:
+        return
+    thread = threading.Thread(target=_check_pdb_version,
+                              args=(key, source_url, source_certs, source_verify),
+                              name='pdb-version-probe')
+    thread.daemon = True
+    thread.start()
+
+
+def pdb_version(source_url=PUPPETDB_HOST, source_certs=PUPPETDB_CERTIFICATES, source_verify=PUPPETDB_VERIFY_SSL):
+    """
+    Memoized ident_pdb_vers. Only the first lookup of a source waits for PuppetDB, at most PDB_VERSION_TIMEOUT
+    seconds, a version older than PUPPETDB_VERSION_TTL is returned while it is checked again in the background.
+    :return: int major version, None for versions without the version endpoint or unreachable sources
+    """
+    key = pool_key(source_url or '', cert=source_certs, verify=source_verify)
+    with _pdb_versions_lock:
+        entry = _pdb_versions.get(key)
+    if entry is None:
+        done, start = _begin_pdb_version_check(key)
+        if start:
+            return _check_pdb_version(key, source_url, source_certs, source_verify)
+        # Already being checked, such as by probe_pdb_versions at startup
+        done.wait(PDB_VERSION_TIMEOUT)
+        with _pdb_versions_lock:
+            entry = _pdb_versions.get(key)
+        return entry[0] if entry else None
+    version, checked_at, failed = entry
+    if time.time() - checked_at > (PDB_VERSION_RETRY if failed else PUPPETDB_VERSION_TTL):
+        _probe_pdb_version(key, source_url, source_certs, source_verify)
+    return version
+
+
+def probe_pdb_versions():
+    """
+    Detects the version of every source in AVAILABLE_SOURCES in the background.
+    """
+    if type(AVAILABLE_SOURCES) is dict:
+        sources = [(data.get('PUPPETDB_HOST', None),
+                    tuple(data.get('PUPPETDB_CERTIFICATES', [None, None])),
+                    data.get('PUPPETDB_VERIFY_SSL', False)) for data in AVAILABLE_SOURCES.values()]
+    else:
+        sources = [(PUPPETDB_HOST, PUPPETDB_CERTIFICATES, PUPPETDB_VERIFY_SSL)]
+    for source_url, source_certs, source_verify in sources:
+        if source_url:
+            _probe_pdb_version(pool_key(source_url, cert=source_certs, verify=source_verify),
+                               source_url, source_certs, source_verify)
+
+
 def api_get(api_url=PUPPETDB_HOST,
             api_version='v4',
             path='',
             method='get',
             params=None,
             verify=PUPPETDB_VERIFY_SSL,
-            cert=PUPPETDB_CERTIFICATES
+            cert=PUPPETDB_CERTIFICATES,
+            stream=False,
+            timeout=None
             ):
     """
     Wrapper function for requests
@@ -136,6 +237,8 @@ def api_get(api_url=PUPPETDB_HOST,
     :param params: Dict of key, value query params
     :param verify: True/False/CA_File_Name to perform SSL Verification of CA Chain
     :param cert: list of cert and key to use for client authentication
+    :param stream: Decode the JSON array incrementally and return an iterator of records
+    :param timeout: seconds to wait for the server, None waits forever
     :return: dict
     """
 
@@ -149,15 +252,12 @@ def api_get(api_url=PUPPETDB_HOST,
         'Accept': 'application/json',
         'Content-type': 'application/json',
     }
-    methods = {
-        'get': requests.get,
-    }
-
     if api_url[-1] != '/':
         api_url = '{0}/'.format(api_url)
 
     if path[0] == '/':
         path = path.lstrip('/')
+    endpoint = metrics.puppetdb_endpoint(path)
 
     if path.split('/')[0] in query_paths:
         path = 'pdb/query/v4/%s' % path
@@ -171,19 +271,75 @@ def api_get(api_url=PUPPETDB_HOST,
         return list(), list()
 
     url = '{0}{1}'.format(api_url, path)
-    resp = methods[method](url,
-                           headers=headers,
-                           verify=verify,
-                           cert=cert)
+    started = time.time()
+    # The session stays in use until the body has been read, for a stream until the records are consumed.
+    pool, session = checkout_session(api_url, cert=cert, verify=verify)
+    methods = {
+        'get': session.get,
+    }
+    try:
+        resp = methods[method](url,
+                               headers=headers,
+                               verify=verify,
+                               cert=cert,
+                               stream=stream,
+                               timeout=timeout)
+        if not stream:
+            # Reading the body is part of the request
+            body = resp.content
+    except Exception:
+        release_session(pool, session)
+        metrics.PUPPETDB_ERRORS.inc(endpoint=endpoint, reason='connection')
+        raise
+    if not stream:
+        release_session(pool, session)
+    if resp.status_code >= 400:
+        metrics.PUPPETDB_ERRORS.inc(endpoint=endpoint, reason=resp.status_code)
+    if 'X-records' in resp.headers:
+        try:
+            metrics.PUPPETDB_RECORDS.observe(int(resp.headers['X-records']), endpoint=endpoint)
+        except ValueError:
+            pass
+    if stream:
+        metrics.PUPPETDB_REQUEST_SECONDS.observe(time.time() - started, endpoint=endpoint)
+        records = stream_records(resp, release=lambda: release_session(pool, session))
+        if 'X-records' in resp.headers:
+            return records, resp.headers
+        return records
+    metrics.PUPPETDB_RESPONSE_BYTES.observe(len(body), endpoint=endpoint)
+    metrics.PUPPETDB_REQUEST_SECONDS.observe(time.time() - started, endpoint=endpoint)
     if 'X-records' in resp.headers:
         return json.loads(resp.text), resp.headers
     else:
         try:
             return json.loads(resp.text)
         except:
+            metrics.PUPPETDB_ERRORS.inc(endpoint=endpoint, reason='invalid_json')
             return []
 
 
+def stream_records(resp, chunk_size=65536, release=None):
+    """
+    Generator decoding the records of a streamed response one by one.
+    Unlike api_get, a response which is not a JSON array, such as an error
+    from PuppetDB, or which is cut off halfway raises ValueError so that it
+    can not be mistaken for a complete result.
+    :param resp: requests.Response opened with stream=True
+    :param chunk_size: Number of bytes to read from the socket at a time
+    :param release: called once the response has been closed
+    :return: generator of dicts
+    """
+    if resp.encoding is None:
+        resp.encoding = 'utf-8'
+    try:
+        for record in iter_json_array(resp.iter_content(chunk_size=chunk_size, decode_unicode=True)):
+            yield record
+    finally:
+        resp.close()
+        if release is not None:
+            release()
+
+
 def mk_puppetdb_query(params, request=None):
     """
     formats the dict into a query string for puppetdb
@@ -219,6 +375,13 @@ def mk_puppetdb_query(params, request=None):
                                                                             {"field": "value", "order": "desc"},
                                                                             {"field": "name"}
                                                                             ]'
+
+    # Api query returning only some fields of each record
+        params = {
+            'query': {1: '["=","latest_report?",true]'},
+            'fields': ['certname', 'status'],
+        }
+    Equal to: query='["extract",["certname","status"],["and",["=","latest_report?",true]]]'
     """
 
     def query_build(q_dict, user_request):
@@ -288,12 +451,22 @@ def order_by_build(ob_dict):
                                                       ob_dict['order_field']['order'])
         return ob_query
 
+    def fields_build(fields, query):
+        # Wraps the query in an extract so that PuppetDB only returns the listed fields.
+        if query is None or type(query) is not str:
+            return query
+        if query:
+            return '["extract",%s,%s]' % (json.dumps(fields, separators=(',', ':')), query)
+        return '["extract",%s]' % json.dumps(fields, separators=(',', ':'))
+
     if type(params) is dict:
         query_dict = {}
         if 'query' in params:
             query_dict['query'] = query_build(params['query'], request)
         elif 'query' not in params and request:
             query_dict['query'] = query_build({}, request)
+        if params.get('fields'):
+            query_dict['query'] = fields_build(params['fields'], query_dict.get('query', ''))
         if 'summarize_by' in params:
             query_dict['summarize_by'] = params.get('summarize_by', 'certname')
         if 'limit' in params:
@@ -0,0 +1,187 @@
+"""
+Cache of report data keyed by report hash.
+
+A report stored in PuppetDB never changes, so its events, agent logs and
+event counts can be kept for as long as there is room for them. Entries
+live in a size bounded LRU in memory and, if REPORT_CACHE_DIR is set, in
+JSON files below that directory so they survive restarts and are shared by
+all processes of the web server. The files are named by the SHA-1 of their
+key and their total size is capped at REPORT_CACHE_DIR_SIZE bytes by
+removing the least recently used files. Files in the directory can be
+removed at any time.
+
+Example:
+
+events = report_cache.get(source_url, report_hash, 'events')
+if events is None:
+    events = puppetdb.api_get(...)
+    report_cache.set(source_url, report_hash, 'events', events)
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+from panopuppet.pano.methods import metrics
+from panopuppet.pano.settings import REPORT_CACHE_SIZE, REPORT_CACHE_DIR, REPORT_CACHE_DIR_SIZE
+
+__author__ = 'etaklar'
+
+_FILE_RE = re.compile(r'^[0-9a-f]{40}\.json$')
+
+
+class ReportCache(object):
+    def __init__(self, max_entries=REPORT_CACHE_SIZE, directory=REPORT_CACHE_DIR, max_bytes=REPORT_CACHE_DIR_SIZE):
+        """
+        :param max_entries: number of entries kept in memory, 0 disables the memory tier
+        :param directory: directory of the disk tier, None disables it
+        :param max_bytes: maximum size of all files of the disk tier
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # file name -> size of the file, least recently used first
+        self._sizes = OrderedDict()
+        self._total = 0
+        self._scanned = directory is None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(source_url, report_hash, kind):
+        """
+        :param source_url: url of the PuppetDB source the report belongs to
+        :param report_hash: hash of the report
+        :param kind: kind of data, i.e. 'events', 'logs' or 'event_counts'
+        :return: str
+        """
+        source = hashlib.md5(str(source_url).encode('utf-8')).hexdigest()
+        return '%s-%s-%s' % (kind, source, report_hash)
+
+    @staticmethod
+    def file_name(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'
+
+    def path(self, name):
+        """
+        :param name: file name returned by file_name()
+        """
+        return os.path.join(self.directory, name[:2], name)
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            self._scan()
+            return self._total
+
+    def get(self, source_url, report_hash, kind):
+        """
+        :return: the cached data or None
+        """
+        value = self._lookup(self.key(source_url, report_hash, kind))
+        metrics.CACHE_REQUESTS.inc(cache='report', result='miss' if value is None else 'hit')
+        return value
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        if self.directory is None:
+            return None
+        name = self.file_name(key)
+        try:
+            with open(self.path(name), 'r') as cache_file:
+                value = json.load(cache_file)
+            # The modification time orders the files on the next start
+            os.utime(self.path(name))
+            size = os.path.getsize(self.path(name))
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._scan()
+            # The file may have been written by another process
+            self._total += size - self._sizes.pop(name, 0)
+            self._sizes[name] = size
+            self._evict()
+        self._remember(key, value)
+        return value
+
+    def set(self, source_url, report_hash, kind, value):
+        """
+        :param value: JSON serializable data of the report
+        """
+        key = self.key(source_url, report_hash, kind)
+        self._remember(key, value)
+        if self.directory is None:
+            return
+        name = self.file_name(key)
+        path = self.path(name)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so other processes never read a partial file.
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(value, cache_file)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        with self._lock:
+            self._scan()
+            self._total += size - self._sizes.pop(name, 0)
+            self._sizes[name] = size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _scan(self):
+        # Must be called with _lock held. Picks up the files written by earlier runs, oldest first.
+        if self._scanned:
+            return
+        self._scanned = True
+        found = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if not _FILE_RE.match(name):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, name, stat.st_size))
+        for mtime, name, size in sorted(found):
+            self._sizes[name] = size
+            self._total += size
+        self._evict()
+
+    def _evict(self):
+        # Must be called with _lock held.
+        while self._total > self.max_bytes and self._sizes:
+            name, size = self._sizes.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                pass
+
+    def _remember(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+report_cache = ReportCache()
@@ -110,8 +110,60 @@
 # Set cache time to 0 to disable caching
 CACHE_TIME = cfg.get('CACHE_TIME', 30)
 
-from panopuppet.pano.puppetdb.puppetdb import ident_pdb_vers
-
-PUPPETDB_VERS = ident_pdb_vers(source_url=PUPPETDB_HOST,
-                               source_verify=PUPPETDB_VERIFY_SSL,
-                               source_certs=PUPPETDB_CERTIFICATES)
\ No newline at end of file
+# Connection pool settings for PuppetDB and Puppetmaster sources
+# Number of keep-alive connections kept open per source
+POOL_SIZE = cfg.get('POOL_SIZE', 10)
+# Close the connections of a source that has not been used for this many seconds
+POOL_IDLE_TIMEOUT = cfg.get('POOL_IDLE_TIMEOUT', 300)
+
+# Number of records fetched per request when walking large PuppetDB result sets
+PUPPETDB_PAGE_SIZE = cfg.get('PUPPETDB_PAGE_SIZE', 5000)
+
+# Threads shared by all requests for running PuppetDB queries concurrently
+PUPPETDB_MAX_WORKERS = cfg.get('PUPPETDB_MAX_WORKERS', 20)
+# Maximum number of concurrent queries sent to a single PuppetDB source
+PUPPETDB_MAX_REQUESTS_PER_SOURCE = cfg.get('PUPPETDB_MAX_REQUESTS_PER_SOURCE', 6)
+# Seconds to wait for a PuppetDB query before giving up
+PUPPETDB_JOB_TIMEOUT = cfg.get('PUPPETDB_JOB_TIMEOUT', 120)
+
+# Dashboard data older than CACHE_TIME is served for up to this many seconds while it is rebuilt
+FLEET_SNAPSHOT_MAX_AGE = cfg.get('FLEET_SNAPSHOT_MAX_AGE', 600)
+# Rebuild the dashboard data of every source in the background every this many seconds, 0 disables it
+FLEET_REFRESH_INTERVAL = cfg.get('FLEET_REFRESH_INTERVAL', 0)
+
+# Number of report events, logs and event counts kept in memory, reports never change once stored
+REPORT_CACHE_SIZE = cfg.get('REPORT_CACHE_SIZE', 500)
+# Also keep report data in files below this directory, None disables it
+REPORT_CACHE_DIR = cfg.get('REPORT_CACHE_DIR', None)
+# Maximum size in bytes of the report data files in REPORT_CACHE_DIR
+REPORT_CACHE_DIR_SIZE = cfg.get('REPORT_CACHE_DIR_SIZE', 256 * 1024 * 1024)
+
+# Filebucket contents are stored by MD5 sum in this directory, None keeps them in memory
+FILEBUCKET_CACHE_DIR = cfg.get('FILEBUCKET_CACHE_DIR', None)
+# Maximum size in bytes of the stored filebucket contents, 0 disables the store
+FILEBUCKET_CACHE_SIZE = cfg.get('FILEBUCKET_CACHE_SIZE', 64 * 1024 * 1024)
+# Compress the stored filebucket contents
+FILEBUCKET_CACHE_COMPRESS = cfg.get('FILEBUCKET_CACHE_COMPRESS', True)
+
+# Show a summary instead of a diff if more than this many lines differ between two files
+DIFF_MAX_LINES = cfg.get('DIFF_MAX_LINES', 20000)
+# Stop adding changes to a diff after this many seconds
+DIFF_TIMEOUT = cfg.get('DIFF_TIMEOUT', 5)
+
+# Seconds the detected version of a PuppetDB source is used before it is checked again in the background
+PUPPETDB_VERSION_TTL = cfg.get('PUPPETDB_VERSION_TTL', 3600)
+
+# Hours of events counted by the first run of the ingest_events management command
+EVENT_ROLLUP_BACKFILL = cfg.get('EVENT_ROLLUP_BACKFILL', 168)
+# Hours before the last ingested event which are counted again, for reports received late
+EVENT_ROLLUP_RECOUNT = cfg.get('EVENT_ROLLUP_RECOUNT', 2)
+
+# Expose the metrics of PuppetDB requests, views and caches on /pano/metrics without login
+ENABLE_METRICS = cfg.get('ENABLE_METRICS', False)
+# Bearer token required to read /pano/metrics, no token is required if empty
+METRICS_TOKEN = cfg.get('METRICS_TOKEN', '')
+
+from panopuppet.pano.puppetdb.puppetdb import probe_pdb_versions
+
+# Detect the PuppetDB versions in the background so that starting a worker does not wait for PuppetDB.
+probe_pdb_versions()
\ No newline at end of file
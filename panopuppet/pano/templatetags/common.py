@@ -1,8 +1,11 @@
 import json
 
 from django import template
+from django.utils.safestring import mark_safe
 from urllib import parse
 
+from panopuppet.pano.methods.diffengine import colorize
+
 __author__ = 'etaklar'
 
 register = template.Library()
@@ -151,21 +154,11 @@ def render(self, context):
 
 @register.filter
 def colorizediff(content):
-    color_diff = []
-
-    for line in content:
-        if line.startswith(' '):
-            # Nothing has changed
-            color_diff.append('<br>' + line.rstrip('\n'))
-        elif line.startswith('-'):
-            # Line has been removed
-            color_diff.append('<br>' + '<span style="color:red">' + line.rstrip('\n') + '</span>')
-        elif line.startswith('+'):
-            # Line has been added
-            color_diff.append('<br>' + '<span style="color:green">' + line.rstrip('\n') + '</span>')
-        else:
-            color_diff.append('<br>' + line.rstrip('\n'))
-    return ''.join(color_diff)
+    """
+    :param content: iterable of unified diff lines
+    :return: HTML with removed lines in red and added lines in green
+    """
+    return mark_safe(''.join(colorize(content)))
 
 
 @register.filter
@@ -1,35 +1,12 @@
-import datetime
-
 from django import template
 
+from panopuppet.pano.puppetdb import pdbutils
+
 __author__ = 'etaklar'
 
 register = template.Library()
 
 
-# used for json_to_datetime filter
-class UTC(datetime.tzinfo):
-    """UTC"""
-
-    def utcoffset(self, dt):
-        return datetime.timedelta(0)
-
-    def tzname(self, dt):
-        return str('UTC')
-
-    def dst(self, dt):
-        return datetime.timedelta(0)
-
-    def __repr__(self):
-        return str('<UTC>')
-
-    def __str__(self):
-        return str('UTC')
-
-    def __unicode__(self):
-        return 'UTC'
-
-
 @register.simple_tag
 def dictKeyLookup(the_dict, key):
     # Try to fetch from the dict, and if it's not found return an empty string.
@@ -46,7 +23,7 @@ def json_to_datetime(date):
     :rtype: basestring
     """
     try:
-        time = datetime.datetime.strptime(date, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=UTC())
+        time = pdbutils.json_to_datetime(date)
         return time
     except:
         if date is None:
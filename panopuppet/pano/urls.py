@@ -6,6 +6,7 @@
 from panopuppet.pano.views.event_analytics import event_analytics
 from panopuppet.pano.views.filebucket import filebucket
 from panopuppet.pano.views.logout import logout_view
+from panopuppet.pano.views.metrics import metrics
 from panopuppet.pano.views.node_facts import facts
 from panopuppet.pano.views.nodes import nodes
 from panopuppet.pano.views.radiator import radiator
@@ -41,6 +42,7 @@
                        url(r'^facts/(?P<certname>[\w\.-]+)/$', facts, name='facts'),
                        url(r'^radiator/$', radiator, name='radiator'),
                        url(r'^catalog/$', catalog, name='catalog'),
+                       url(r'^metrics$', metrics, name='metrics'),
                        # API URLS
                        url(r'^api/nodes/$', nodes_json, name='api_nodes'),
                        url(r'^api/nodes/search/$', search_nodes_json, name='api_search_nodes'),
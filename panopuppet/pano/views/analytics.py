@@ -5,7 +5,7 @@
 from django.views.decorators.cache import cache_page
 
 from panopuppet.pano.puppetdb.pdbutils import run_puppetdb_jobs, json_to_datetime
-from panopuppet.pano.puppetdb.puppetdb import set_server, get_server
+from panopuppet.pano.puppetdb.puppetdb import set_server, get_server, REPORT_RUN_TIME_FIELDS
 from panopuppet.pano.settings import AVAILABLE_SOURCES, CACHE_TIME
 
 __author__ = 'etaklar'
@@ -48,6 +48,7 @@ def analytics(request):
     }
     reports_runavg_params = {
         'limit': 100,
+        'fields': REPORT_RUN_TIME_FIELDS,
         'order_by': {
             'order_field': {
                 'field': 'receive_time',
@@ -99,7 +100,7 @@ def analytics(request):
         },
     }
 
-    job_results = run_puppetdb_jobs(jobs, 4)
+    job_results = run_puppetdb_jobs(jobs)
 
     reports_run_avg = job_results['reports_run_avg']
     events_class_list = job_results['events_class_list']
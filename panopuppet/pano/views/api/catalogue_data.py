@@ -6,7 +6,9 @@
 from django.template import defaultfilters as filters
 from django.utils.timezone import localtime
 
-from panopuppet.pano.methods.dictfuncs import DictDiffer
+from panopuppet.pano.methods.catalogdiff import compare_catalogues
+from panopuppet.pano.methods.catalogstore import store_catalogue, load_section, load_catalogue, get_saved_catalogue, \
+    list_saved_catalogues, LIST_FIELDS
 from panopuppet.pano.models import SavedCatalogs
 from panopuppet.pano.puppetdb import puppetdb
 from panopuppet.pano.puppetdb.puppetdb import get_server
@@ -46,7 +48,8 @@ def catalogue_json(request, certname=None):
                     'operator': 'and',
                     1: '["=","latest_report?",true]',
                     2: '["=","certname","%s"]' % certname
-                }
+                },
+            'fields': ['hash'],
         }
         report_url = '/reports'
         latest_report = puppetdb.api_get(
@@ -63,7 +66,8 @@ def catalogue_json(request, certname=None):
         catalogue_timestamp = catalogue['producer_timestamp']
 
         try:
-            saved_catalogue = SavedCatalogs.objects.get(hostname=certname, catalogue_id=catalogue_hash)
+            saved_catalogue = SavedCatalogs.objects.only(*LIST_FIELDS).get(hostname=certname,
+                                                                           catalogue_id=catalogue_hash)
 
             if saved_catalogue.linked_report != report_hash:
                 # Grab the linked report from the result set.
@@ -90,11 +94,10 @@ def catalogue_json(request, certname=None):
 
         except SavedCatalogs.DoesNotExist:
             # since we couldnt find it in the db its safe to asusme that we can create it!
-            SavedCatalogs.objects.create(hostname=certname,
-                                         catalogue_id=catalogue_hash,
-                                         linked_report=report_hash,
-                                         timestamp=catalogue_timestamp,
-                                         catalogue=json.dumps(catalogue))
+            store_catalogue(hostname=certname,
+                            catalogue=catalogue,
+                            linked_report=report_hash,
+                            timestamp=catalogue_timestamp)
             data['success'] = 'Saved catalogue.'
             data['certname'] = certname
             data['catalogue_hash'] = catalogue_hash
@@ -116,6 +119,9 @@ def catalogue_compare_json(request, certname1=None, certname2=None):
     source_url, source_certs, source_verify = get_server(request)
     show = request.GET.get('show', 'edges')
     data = dict()
+    if show not in ('edges', 'resources'):
+        data['error'] = 'Can only compare edges or resources.'
+        return HttpResponseBadRequest(json.dumps(data, indent=2), content_type="application/json")
     certname1_hash = request.GET.get('certname1_hash', False)
     certname2_hash = request.GET.get('certname2_hash', False)
 
@@ -123,8 +129,8 @@ def catalogue_compare_json(request, certname1=None, certname2=None):
 
     if certname1_hash:
         try:
-            certname1_result = SavedCatalogs.objects.get(hostname=certname1, catalogue_id=certname1_hash)
-            certname1_data = json.loads(certname1_result.catalogue)[show]['data']
+            certname1_result = get_saved_catalogue(certname1, certname1_hash, (show,))
+            certname1_data = load_section(certname1_result, show)
         except SavedCatalogs.DoesNotExist:
             data['error'] = 'Catalogue hash not found in DB.'
             data['hash_not_found'] = certname1_hash
@@ -140,8 +146,8 @@ def catalogue_compare_json(request, certname1=None, certname2=None):
         certname1_data = certname1_result[show]['data']
     if certname2_hash:
         try:
-            certname2_result = SavedCatalogs.objects.get(hostname=certname2, catalogue_id=certname2_hash)
-            certname2_data = json.loads(certname2_result.catalogue)[show]['data']
+            certname2_result = get_saved_catalogue(certname2, certname2_hash, (show,))
+            certname2_data = load_section(certname2_result, show)
         except SavedCatalogs.DoesNotExist:
             data['error'] = 'Catalogue hash not found in DB.'
             data['hash_not_found'] = certname2_hash
@@ -156,89 +162,15 @@ def catalogue_compare_json(request, certname1=None, certname2=None):
         )
         certname2_data = certname2_result[show]['data']
 
-    node_for = dict()
-    node_agn = dict()
+    output = compare_catalogues(certname1_data, certname2_data, show)
 
-    if show == "edges":
-        for edge in certname1_data:
-            # remove the certname tag.
-            try:
-                edge.pop('certname')
-            except:
-                pass
-            source_type = edge['source_type']
-            source_title = edge['source_title']
-            relationship = edge['relationship']
-            target_type = edge['target_type']
-            target_title = edge['target_title']
-            node_for['%s-%s-%s-%s-%s' % (source_type, source_title, relationship, target_type, target_title)] = edge
-
-        for edge in certname2_data:
-            # remove the certname tag.
-            try:
-                edge.pop('certname')
-            except:
-                pass
-            source_type = edge['source_type']
-            source_title = edge['source_title']
-            relationship = edge['relationship']
-            target_type = edge['target_type']
-            target_title = edge['target_title']
-            node_agn['%s-%s-%s-%s-%s' % (source_type, source_title, relationship, target_type, target_title)] = edge
-
-    elif show == "resources":
-        for resource in certname1_data:
-            # remove the certname tag.
-            try:
-                resource.pop('certname')
-            except:
-                pass
-            resource_title = resource['title']
-            node_for[resource_title] = resource
-
-        for resource in certname2_data:
-            try:
-                # remove the certname tag.
-                resource.pop('certname')
-            except:
-                pass
-            resource_title = resource['title']
-            node_agn[resource_title] = resource
-
-    diff = DictDiffer(node_agn, node_for)
-
-    new_entries = list()
-    rem_entries = list()
-    cha_entries = list()
-
-    # List of new entries
-    for new_entry in diff.added():
-        new_entries.append(node_agn[new_entry])
-
-    for rem_entry in diff.removed():
-        rem_entries.append(node_for[rem_entry])
-
-    for cha_entry in diff.changed():
-        for_entry = node_for[cha_entry]
-        agn_entry = node_agn[cha_entry]
-        cha_entries.append({
-            'from': for_entry,
-            'against': agn_entry
-        })
-
-    output = {
-        'added_entries': new_entries,
-        'deleted_entries': rem_entries,
-        'changed_entries': cha_entries
-    }
-
-    return HttpResponse(json.dumps(output, indent=2), content_type="application/json")
+    return HttpResponse(json.dumps(output), content_type="application/json")
 
 
 @login_required
 def catalogue_history_list(request, certname=None):
     data = dict()
-    catalogues = SavedCatalogs.objects.filter(hostname=certname)
+    catalogues = list_saved_catalogues(certname)
     if not catalogues:
         data['error'] = 'No saved catalogues available'
         data['certname'] = certname
@@ -260,7 +192,10 @@ def catalogue_history_fetch(request, certname=None, catalogue_hash=None):
     data = dict()
     show = request.GET.get('show', None)
     try:
-        catalogue = SavedCatalogs.objects.get(hostname=certname, catalogue_id=catalogue_hash)
+        if show in ('edges', 'resources'):
+            catalogue = get_saved_catalogue(certname, catalogue_hash, (show,))
+        else:
+            catalogue = get_saved_catalogue(certname, catalogue_hash)
         data['catalogue'] = {
             'hostname': catalogue.hostname,
             'catalogue_id': catalogue.catalogue_id,
@@ -268,11 +203,11 @@ def catalogue_history_fetch(request, certname=None, catalogue_hash=None):
             'catalogue_timestamp': filters.date(localtime(catalogue.timestamp), 'Y-m-d H:i:s'),
         }
         if show == 'edges':
-            data['data'] = json.loads(catalogue.catalogue)['edges']['data']
+            data['data'] = load_section(catalogue, 'edges')
         elif show == 'resources':
-            data['data'] = json.loads(catalogue.catalogue)['resources']['data']
+            data['data'] = load_section(catalogue, 'resources')
         else:
-            data['data'] = json.loads(catalogue.catalogue)
+            data['data'] = load_catalogue(catalogue)
 
     except SavedCatalogs.DoesNotExist:
         data['error'] = "Could not find catalogue with specfied certname and report hash."
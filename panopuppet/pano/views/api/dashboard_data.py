@@ -4,8 +4,9 @@
 from django.shortcuts import HttpResponse, redirect
 from django.views.decorators.cache import cache_page
 
-from panopuppet.pano.methods.dictfuncs import dictstatus as dictstatus
-from panopuppet.pano.puppetdb.pdbutils import run_puppetdb_jobs
+from panopuppet.pano.methods.fleet import get_fleet_snapshot_async
+from panopuppet.pano.methods.fleettable import BUCKETS
+from panopuppet.pano.puppetdb.aio import run
 from panopuppet.pano.puppetdb.puppetdb import set_server, get_server
 from panopuppet.pano.settings import CACHE_TIME
 
@@ -14,7 +15,6 @@
 
 @cache_page(CACHE_TIME)
 def dashboard_status_json(request):
-    context = {}
     if request.method == 'GET':
         if 'source' in request.GET:
             source = request.GET.get('source')
@@ -23,136 +23,48 @@ def dashboard_status_json(request):
         request.session['django_timezone'] = request.POST['timezone']
         return redirect(request.POST['return_url'])
 
-    source_url, source_certs, source_verify = get_server(request)
-    pdb_vers = get_server(request, type='puppetdb_vers')
+    context = run(dashboard_status_json_async(request))
+    return HttpResponse(json.dumps(context, indent=2), content_type="application/json")
+
 
+async def dashboard_status_json_async(request):
+    """
+    Coroutine gathering the population, resource metrics and node status counters.
+    :param request: user request, used for the source and permission filter
+    :return: dict
+    """
+    context = {}
     puppet_run_time = get_server(request, type='run_time')
 
-    events_params = {
-        'query':
-            {
-                1: '["and",["=","latest_report?",true],["in", "certname",["extract", "certname",["select_nodes",["null?","deactivated",true]]]]]'
-            },
-        'summarize_by': 'certname',
-    }
-    reports_params = {
-        'query':
-            {
-                1: '["and",["=","latest_report?",true],["in", "certname",["extract", "certname",["select_nodes",["null?","deactivated",true]]]]]'
-            }
-    }
-
-    if pdb_vers == 4:
-        tot_res_path = 'mbeans/puppetlabs.puppetdb.population:name=num-resources'
-        avg_res_path = 'mbeans/puppetlabs.puppetdb.population:name=avg-resources-per-node'
-    else:
-        tot_res_path = 'mbeans/puppetlabs.puppetdb.query.population:type=default,name=num-resources'
-        avg_res_path = 'mbeans/puppetlabs.puppetdb.query.population:type=default,name=avg-resources-per-node'
-
-    jobs = {
-        'tot_resource': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'id': 'tot_resource',
-            'path': tot_res_path,
-        },
-        'avg_resource': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'id': 'avg_resource',
-            'path': avg_res_path,
-        },
-        'all_nodes': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'api_version': 'v4',
-            'id': 'all_nodes',
-            'path': '/nodes',
-            'request': request
-        },
-        'reports': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'api_version': 'v4',
-            'id': 'reports',
-            'path': '/reports',
-            'params': reports_params,
-            'request': request
-        },
-        'events': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'id': 'event_counts',
-            'path': 'event-counts',
-            'api_version': 'v4',
-            'params': events_params,
-            'request': request
-        },
-    }
-    puppetdb_results = run_puppetdb_jobs(jobs)
-
-    # Assign vars from the completed jobs
-    # Number of results from all_nodes is our population.
-    puppet_population = len(puppetdb_results['all_nodes'])
+    snapshot = await get_fleet_snapshot_async(request)
+
+    # Number of active nodes in the fleet snapshot is our population.
+    puppet_population = snapshot.population
 
     # Total resources managed by puppet metric
-    total_resources = puppetdb_results['tot_resource'].get('value', puppetdb_results['tot_resource'])
+    total_resources = snapshot.resources['total']
 
     # Average resource per node metric
-    avg_resource_node = puppetdb_results['avg_resource'].get('value', puppetdb_results['avg_resource'])
-
-    # Information about all active nodes in puppet
-    all_nodes_list = puppetdb_results['all_nodes']
-
-    # All available events for the latest puppet reports
-    event_list = puppetdb_results['event_counts']
-    event_dict = {item['subject']['title']: item for item in event_list}
-    # All of the latest reports
-    reports_list = puppetdb_results['reports']
-    reports_dict = {item['certname']: item for item in reports_list}
-
-    failed_list, changed_list, unreported_list, mismatch_list, pending_list = dictstatus(
-        all_nodes_list,
-        reports_dict,
-        event_dict,
-        sort=True,
-        sortby='latestReport',
-        get_status='notall',
-        puppet_run_time=puppet_run_time)
-
-    pending_list = [x for x in pending_list if x not in unreported_list]
-    changed_list = [x for x in changed_list if
-                    x not in unreported_list and x not in failed_list and x not in pending_list]
-    failed_list = [x for x in failed_list if x not in unreported_list]
-    unreported_list = [x for x in unreported_list if x not in failed_list]
-
-    node_unreported_count = len(unreported_list)
-    node_fail_count = len(failed_list)
-    node_change_count = len(changed_list)
-    node_off_timestamps_count = len(mismatch_list)
-    node_pending_count = len(pending_list)
+    avg_resource_node = snapshot.resources['average']
+
+    # Counted when the snapshot was built
+    status_counts = snapshot.status_counts(puppet_run_time)
 
     context['population'] = puppet_population
     context['total_resource'] = total_resources['Value']
     context['avg_resource'] = "{:.2f}".format(avg_resource_node['Value'])
-    context['failed_nodes'] = node_fail_count
-    context['changed_nodes'] = node_change_count
-    context['unreported_nodes'] = node_unreported_count
-    context['mismatching_timestamps'] = node_off_timestamps_count
-    context['pending_nodes'] = node_pending_count
+    context['failed_nodes'] = status_counts['failed']
+    context['changed_nodes'] = status_counts['changed']
+    context['unreported_nodes'] = status_counts['unreported']
+    context['mismatching_timestamps'] = status_counts['mismatch']
+    context['pending_nodes'] = status_counts['pending']
 
-    return HttpResponse(json.dumps(context, indent=2), content_type="application/json")
+    return context
 
 
 @login_required
 @cache_page(CACHE_TIME)
 def dashboard_nodes_json(request):
-    context = {}
     if request.method == 'GET':
         if 'source' in request.GET:
             source = request.GET.get('source')
@@ -161,138 +73,38 @@ def dashboard_nodes_json(request):
         request.session['django_timezone'] = request.POST['timezone']
         return redirect(request.POST['return_url'])
 
-    source_url, source_certs, source_verify = get_server(request)
+    context = run(dashboard_nodes_json_async(request))
+    return HttpResponse(json.dumps(context, indent=2), content_type="application/json")
+
 
+async def dashboard_nodes_json_async(request):
+    """
+    Coroutine gathering the node list for the selected dashboard view.
+    :param request: user request, used for the source and permission filter
+    :return: dict
+    """
+    context = {}
     puppet_run_time = get_server(request, type='run_time')
 
     # Dashboard to show nodes of "recent, failed, unreported or changed"
     dashboard_show = request.GET.get('show', 'recent')
-    events_params = {
-        'query':
-            {
-                1: '["and",["=","latest_report?",true],["in", "certname",["extract", "certname",["select_nodes",["null?","deactivated",true]]]]]'
-            },
-        'summarize_by': 'certname',
-    }
-    all_nodes_params = {
-        'query':
-            {
-                1: '["and",["=","latest_report?",true],["in", "certname",["extract", "certname",["select_nodes",["null?","deactivated",true]]]]]'
-            },
-    }
-    reports_params = {
-        'query':
-            {
-                1: '["and",["=","latest_report?",true],["in", "certname",["extract", "certname",["select_nodes",["null?","deactivated",true]]]]]'
-            }
-    }
-    nodes_params = {
-        'limit': 25,
-        'order_by': {
-            'order_field': {
-                'field': 'report_timestamp',
-                'order': 'desc',
-            },
-            'query_field': {'field': 'certname'},
-        },
-    }
-
-    jobs = {
-        'all_nodes': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'api_version': 'v4',
-            'id': 'all_nodes',
-            'path': '/nodes',
-            'request': request
-        },
-        'events': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'id': 'event_counts',
-            'path': 'event-counts',
-            'api_version': 'v4',
-            'params': events_params,
-            'request': request
-        },
-        'nodes': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'api_version': 'v4',
-            'id': 'nodes',
-            'path': '/nodes',
-            'params': nodes_params,
-            'request': request
-        },
-        'reports': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'api_version': 'v4',
-            'id': 'reports',
-            'path': '/reports',
-            'params': reports_params,
-            'request': request
-        },
-    }
-
-    puppetdb_results = run_puppetdb_jobs(jobs)
-    # Information about all active nodes in puppet
-    all_nodes_list = puppetdb_results['all_nodes']
-    # All available events for the latest puppet reports
-    event_list = puppetdb_results['event_counts']
-    event_dict = {item['subject']['title']: item for item in event_list}
-    # All of the latest reports
-    reports_list = puppetdb_results['reports']
-    reports_dict = {item['certname']: item for item in reports_list}
-    # 25 Nodes
-    node_list = puppetdb_results['nodes']
-
-    failed_list, changed_list, unreported_list, mismatch_list, pending_list = dictstatus(
-        all_nodes_list,
-        reports_dict,
-        event_dict,
-        sort=True,
-        sortby='latestReport',
-        get_status='notall',
-        puppet_run_time=puppet_run_time)
-
-    pending_list = [x for x in pending_list if x not in unreported_list]
-    changed_list = [x for x in changed_list if
-                    x not in unreported_list and x not in failed_list and x not in pending_list]
-    failed_list = [x for x in failed_list if x not in unreported_list]
-    unreported_list = [x for x in unreported_list if x not in failed_list]
-
-    if dashboard_show == 'recent':
-        merged_nodes_list = dictstatus(
-            node_list, reports_dict, event_dict, sort=False, get_status="all", puppet_run_time=puppet_run_time)
-    elif dashboard_show == 'failed':
-        merged_nodes_list = failed_list
-    elif dashboard_show == 'unreported':
-        merged_nodes_list = unreported_list
-    elif dashboard_show == 'changed':
-        merged_nodes_list = changed_list
-    elif dashboard_show == 'mismatch':
-        merged_nodes_list = mismatch_list
-    elif dashboard_show == 'pending':
-        merged_nodes_list = pending_list
+    snapshot = await get_fleet_snapshot_async(request)
+
+    if dashboard_show in BUCKETS:
+        merged_nodes_list = snapshot.status_list(dashboard_show, puppet_run_time)
     else:
-        merged_nodes_list = dictstatus(
-            node_list, reports_dict, event_dict, sort=False, get_status="all", puppet_run_time=puppet_run_time)
+        # The 25 nodes which reported last
+        merged_nodes_list = snapshot.recent(25)
 
     context['node_list'] = merged_nodes_list
     context['selected_view'] = dashboard_show
 
-    return HttpResponse(json.dumps(context, indent=2), content_type="application/json")
+    return context
 
 
 @login_required
 @cache_page(CACHE_TIME)
 def dashboard_json(request):
-    context = {}
     if request.method == 'GET':
         if 'source' in request.GET:
             source = request.GET.get('source')
@@ -301,173 +113,46 @@ def dashboard_json(request):
         request.session['django_timezone'] = request.POST['timezone']
         return redirect(request.POST['return_url'])
 
-    source_url, source_certs, source_verify = get_server(request)
-    pdb_vers = get_server(request, type='puppetdb_vers')
+    context = run(dashboard_json_async(request))
+    return HttpResponse(json.dumps(context, indent=2), content_type="application/json")
+
+
+async def dashboard_json_async(request):
+    """
+    Coroutine gathering the status counters and the node list of the dashboard.
+    :param request: user request, used for the source and permission filter
+    :return: dict
+    """
+    context = {}
     puppet_run_time = get_server(request, type='run_time')
     dashboard_show = request.GET.get('show', 'recent')
-    events_params = {
-        'query':
-            {
-                1: '["and",["=","latest_report?",true],["in", "certname",["extract", "certname",["select_nodes",["null?","deactivated",true]]]]]'
-            },
-        'summarize_by': 'certname',
-    }
-    reports_params = {
-        'query':
-            {
-                1: '["and",["=","latest_report?",true],["in", "certname",["extract", "certname",["select_nodes",["null?","deactivated",true]]]]]'
-            }
-    }
-    nodes_params = {
-        'limit': 25,
-        'order_by': {
-            'order_field': {
-                'field': 'report_timestamp',
-                'order': 'desc',
-            },
-            'query_field': {'field': 'certname'},
-        },
-    }
-
-    if pdb_vers == 4:
-        tot_res_path = 'mbeans/puppetlabs.puppetdb.population:name=num-resources'
-        avg_res_path = 'mbeans/puppetlabs.puppetdb.population:name=avg-resources-per-node'
-    else:
-        tot_res_path = 'mbeans/puppetlabs.puppetdb.query.population:type=default,name=num-resources'
-        avg_res_path = 'mbeans/puppetlabs.puppetdb.query.population:type=default,name=avg-resources-per-node'
-
-    jobs = {
-        'tot_resource': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'id': 'tot_resource',
-            'path': tot_res_path,
-        },
-        'avg_resource': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'id': 'avg_resource',
-            'path': avg_res_path,
-        },
-        'all_nodes': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'api_version': 'v4',
-            'id': 'all_nodes',
-            'path': '/nodes',
-            'request': request
-        },
-        'events': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'id': 'event_counts',
-            'path': '/event-counts',
-            'api_version': 'v4',
-            'params': events_params,
-            'request': request
-        },
-        'reports': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'api_version': 'v4',
-            'id': 'reports',
-            'path': '/reports',
-            'params': reports_params,
-            'request': request
-        },
-        'nodes': {
-            'url': source_url,
-            'certs': source_certs,
-            'verify': source_verify,
-            'api_version': 'v4',
-            'id': 'nodes',
-            'path': '/nodes',
-            'params': nodes_params,
-            'request': request
-        },
-    }
-    puppetdb_results = run_puppetdb_jobs(jobs)
-
-    # Assign vars from the completed jobs
-    # Number of results from all_nodes is our population.
-    puppet_population = len(puppetdb_results['all_nodes'])
+    snapshot = await get_fleet_snapshot_async(request)
+
+    # Number of active nodes in the fleet snapshot is our population.
+    puppet_population = snapshot.population
     # Total resources managed by puppet metric
-    total_resources = puppetdb_results['tot_resource']#.get('value', puppetdb_results['tot_resource'])
+    total_resources = snapshot.resources['total']
 
     # Average resource per node metric
-    avg_resource_node = puppetdb_results['avg_resource']#.get('value', puppetdb_results['avg_resource'])
-
-    # Information about all active nodes in puppet
-    all_nodes_list = puppetdb_results['all_nodes']
-    # All available events for the latest puppet reports
-    event_list = puppetdb_results['event_counts']
-    event_dict = {item['subject']['title']: item for item in event_list}
-    # All of the latest reports
-    reports_list = puppetdb_results['reports']
-    reports_dict = {item['certname']: item for item in reports_list}
-    # 25 Nodes
-    node_list = puppetdb_results['nodes']
-
-    failed_list, changed_list, unreported_list, mismatch_list, pending_list = dictstatus(
-        all_nodes_list,
-        reports_dict,
-        event_dict,
-        sort=True,
-        sortby='latestReport',
-        get_status='notall',
-        puppet_run_time=puppet_run_time)
-
-    pending_list = [x for x in pending_list if x not in unreported_list]
-    changed_list = [x for x in changed_list if
-                    x not in unreported_list and x not in failed_list and x not in pending_list]
-    failed_list = [x for x in failed_list if x not in unreported_list]
-    unreported_list = [x for x in unreported_list if x not in failed_list]
-
-    node_unreported_count = len(unreported_list)
-    node_fail_count = len(failed_list)
-    node_change_count = len(changed_list)
-    node_off_timestamps_count = len(mismatch_list)
-    node_pending_count = len(pending_list)
-
-    if dashboard_show == 'recent':
-        merged_nodes_list = dictstatus(node_list,
-                                       reports_dict,
-                                       event_dict,
-                                       sort=False,
-                                       get_status="all",
-                                       puppet_run_time=puppet_run_time)
-    elif dashboard_show == 'failed':
-        merged_nodes_list = failed_list
-    elif dashboard_show == 'unreported':
-        merged_nodes_list = unreported_list
-    elif dashboard_show == 'changed':
-        merged_nodes_list = changed_list
-    elif dashboard_show == 'mismatch':
-        merged_nodes_list = mismatch_list
-    elif dashboard_show == 'pending':
-        merged_nodes_list = pending_list
+    avg_resource_node = snapshot.resources['average']
+
+    status_counts = snapshot.status_counts(puppet_run_time)
+
+    if dashboard_show in BUCKETS:
+        merged_nodes_list = snapshot.status_list(dashboard_show, puppet_run_time)
     else:
-        merged_nodes_list = dictstatus(node_list,
-                                       reports_dict,
-                                       event_dict,
-                                       sort=False,
-                                       get_status="all",
-                                       puppet_run_time=puppet_run_time)
+        # The 25 nodes which reported last
+        merged_nodes_list = snapshot.recent(25)
 
     context['node_list'] = merged_nodes_list
     context['selected_view'] = dashboard_show
     context['population'] = puppet_population
     context['total_resource'] = total_resources['Value']
     context['avg_resource'] = "{:.2f}".format(avg_resource_node['Value'])
-    context['failed_nodes'] = node_fail_count
-    context['changed_nodes'] = node_change_count
-    context['unreported_nodes'] = node_unreported_count
-    context['mismatching_timestamps'] = node_off_timestamps_count
-    context['pending_nodes'] = node_pending_count
+    context['failed_nodes'] = status_counts['failed']
+    context['changed_nodes'] = status_counts['changed']
+    context['unreported_nodes'] = status_counts['unreported']
+    context['mismatching_timestamps'] = status_counts['mismatch']
+    context['pending_nodes'] = status_counts['pending']
 
-    return HttpResponse(json.dumps(context, indent=2), content_type="application/json")
+    return context
@@ -1,20 +1,53 @@
 import csv
 import datetime
 import json
+import logging
 
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponseBadRequest, HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect
 from django.views.decorators.csrf import ensure_csrf_cookie
 
-from panopuppet.pano.methods.dictfuncs import dictstatus as dictstatus
+from panopuppet.pano.methods.fleettable import FleetTable
+from panopuppet.pano.methods.nodecsv import csv_headers, export_rows, parse_facts
 from panopuppet.pano.puppetdb import puppetdb
-from panopuppet.pano.puppetdb.pdbutils import generate_csv
 from panopuppet.pano.puppetdb.puppetdb import set_server, get_server
 from panopuppet.pano.views import Echo
 
 __author__ = 'etaklar'
 
+logger = logging.getLogger(__name__)
+
+
+def csv_lines(rows, facts):
+    """
+    The status of the response has been sent before the rows are fetched. If fetching them fails a last
+    line saying so is written and the error is raised again, which aborts the transfer instead of ending
+    the file as if it were complete.
+    :return: generator of the lines of the CSV file
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(csv_headers(facts))
+    try:
+        for row in rows:
+            yield writer.writerow(row)
+    except Exception as e:
+        logger.exception('The CSV export of the nodes failed')
+        yield writer.writerow(['Export incomplete, PuppetDB could not be queried: %s' % e])
+        raise
+
+
+def csv_response(rows, facts):
+    """
+    :param rows: iterable of the node rows including the fact columns
+    :param facts: list of the fact names of the fact columns
+    :return: StreamingHttpResponse sending the headers before the first row is fetched
+    """
+    response = StreamingHttpResponse(csv_lines(rows, facts), content_type="text/csv")
+    response['Content-Disposition'] = 'attachment; filename="puppetdata-%s.csv"' % (datetime.datetime.now())
+    return response
+
+
 @ensure_csrf_cookie
 @login_required
 def nodes_json(request):
@@ -27,7 +60,6 @@ def nodes_json(request):
         return redirect(request.POST['return_url'])
 
     source_url, source_certs, source_verify = get_server(request)
-    puppet_run_time = get_server(request, type='run_time')
     valid_sort_fields = (
         'certname',
         'catalog_timestamp',
@@ -142,6 +174,13 @@ def nodes_json(request):
     node_params['include_total'] = 'true'
 
     node_sort_fields = ['certname', 'catalog_timestamp', 'report_timestamp', 'facts_timestamp']
+    status_sort_fields = ['successes', 'failures', 'skips', 'noops']
+    source = {'url': source_url, 'certs': source_certs, 'verify': source_verify}
+    facts = parse_facts(request.GET.get('include_facts', False))
+    if dl_csv is True and sort_field not in status_sort_fields:
+        # Streamed while the nodes are paged from PuppetDB in the requested order.
+        return csv_response(export_rows(source, node_params, facts, request), facts)
+
     try:
         node_list, node_headers = puppetdb.api_get(
             api_url=source_url,
@@ -157,8 +196,6 @@ def nodes_json(request):
         node_headers = dict()
         node_headers['X-Records'] = 0
 
-
-    status_sort_fields = ['successes', 'failures', 'skips', 'noops']
     # Create a filter part to limit the following API requests to data related to the node_list.
     # Skipt the filter completely if a large number of nodes are shown as the query tends to fail.
     node_filter = ''
@@ -221,105 +258,25 @@ def nodes_json(request):
 
     # Converts lists of dicts to dicts.
     report_dict = {item['subject']['title']: item for item in report_list} # /events-count
+    table = FleetTable.from_data(node_list, None, report_dict)
+    if sort_field in status_sort_fields:
+        # Only nodes with events in their latest report, sorted by the status field.
+        indexes = table.argsort(sort_field, reverse=sort_field_order == 'desc', indexes=table.with_events())
+        if dl_csv is False:
+            indexes = indexes[request.session['offset']:(request.session['limits'] + request.session['offset'])]
+    else:
+        # Already sorted and limited by PuppetDB
+        indexes = None
+    rows = table.rows(indexes, format_time=False)
     if sort_field_order == 'desc':
-        rows = dictstatus(node_list,
-                          None,
-                          report_dict,
-                          sortby=sort_field,
-                          asc=True,
-                          sort=False,
-                          puppet_run_time=puppet_run_time,
-                          format_time=False)
         sort_field_order_opposite = 'asc'
     elif sort_field_order == 'asc':
-        rows = dictstatus(node_list,
-                          None,
-                          report_dict,
-                          sortby=sort_field,
-                          asc=False,
-                          sort=False,
-                          puppet_run_time=puppet_run_time,
-                          format_time=False)
         sort_field_order_opposite = 'desc'
 
     if dl_csv is True:
-        if rows is []:
-            pass
-        else:
-            # Generate a sequence of rows. The range is based on the maximum number of
-            # rows that can be handled by a single sheet in most spreadsheet
-            # applications.
-            include_facts = request.GET.get('include_facts', False)
-            csv_headers = ['Certname',
-                           'Latest Catalog',
-                           'Latest Report',
-                           'Latest Facts',
-                           'Success',
-                           'Noop',
-                           'Failure',
-                           'Skipped',
-                           'Run Status']
-            if include_facts is not False:
-                merged_list_facts = []
-                facts = {}
-                for fact in include_facts.split(','):
-                    # Sanitize the fact input from the user
-                    fact = fact.strip()
-                    # Add the fact name to the headers list
-                    csv_headers.append(fact)
-
-                    # build the params for each fact.
-                    facts_params = {
-                        'query':
-                            {
-                                1: '["=","name","' + fact + '"]'
-                            },
-                    }
-                    fact_list = puppetdb.api_get(
-                        api_url=source_url,
-                        cert=source_certs,
-                        verify=source_verify,
-                        path='facts',
-                        params=puppetdb.mk_puppetdb_query(facts_params),
-                        api_version='v4',
-                    )
-                    # Populate the facts dict with the facts we have retrieved
-                    # Convert the fact list into a fact dict!
-                    facts[fact] = {item['certname']: item for item in fact_list}
-
-                i = 1
-                jobs = {}
-                # Add ID to each job so that it can be assembled in
-                # the same order after we recieve the job results
-                # We do this via jobs so that we can get faster results.
-                for node in rows:
-                    jobs[i] = {
-                        'id': i,
-                        'include_facts': include_facts.split(','),
-                        'node': node,
-                        'facts': facts,
-                    }
-                    i += 1
+        # Already sorted by the event counts, only joined with the facts while they are written.
+        return csv_response(export_rows(source, None, facts, request, rows=rows), facts)
 
-                csv_results = generate_csv(jobs)
-                rows = []
-                i = 1
-                # with the job results we can now recreate merged_list
-                # in the order we sent them.
-                while i <= len(csv_results):
-                    rows.append(csv_results[i])
-                    i += 1
-            # Insert the csv header to the top of the list.
-            rows.insert(0, csv_headers)
-            pseudo_buffer = Echo()
-            writer = csv.writer(pseudo_buffer)
-            response = StreamingHttpResponse((writer.writerow(row) for row in rows),
-                                             content_type="text/csv")
-            response['Content-Disposition'] = 'attachment; filename="puppetdata-%s.csv"' % (datetime.datetime.now())
-            return response
-
-    if sort_field in status_sort_fields:
-        rows = rows[request.session['offset']:(request.session['limits']+request.session['offset'])]
     """
     c_r_s* = current request sort
     c_r_* = current req
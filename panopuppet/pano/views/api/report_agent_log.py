@@ -9,6 +9,7 @@
 
 from panopuppet.pano.puppetdb import puppetdb
 from panopuppet.pano.puppetdb.puppetdb import get_server
+from panopuppet.pano.puppetdb.reportcache import report_cache
 from panopuppet.pano.settings import CACHE_TIME
 
 __author__ = 'etaklar'
@@ -25,18 +26,23 @@ def report_log_json(request, report_hash=None):
         context['error'] = 'Report Hash not provided.'
         return HttpResponse(json.dumps(context, indent=2), content_type="application/json")
 
-    report_logs = puppetdb.api_get(
-        api_url=source_url,
-        cert=source_certs,
-        verify=source_verify,
-        path='/reports/' + report_hash + '/logs',
-        api_version='v4',
-    )
-    if 'error' in report_logs:
-        context = report_logs
-        return HttpResponse(json.dumps(context, indent=2), content_type="application/json")
-
-    # Remove the dict from the list...
+    report_logs = report_cache.get(source_url, report_hash, 'logs')
+    if report_logs is None:
+        report_logs = puppetdb.api_get(
+            api_url=source_url,
+            cert=source_certs,
+            verify=source_verify,
+            path='/reports/' + report_hash + '/logs',
+            api_version='v4',
+        )
+        if 'error' in report_logs:
+            context = report_logs
+            return HttpResponse(json.dumps(context, indent=2), content_type="application/json")
+        if report_logs:
+            report_cache.set(source_url, report_hash, 'logs', report_logs)
+
+    # Copy the logs, the cached ones keep the original timestamps.
+    report_logs = [dict(log) for log in report_logs]
     for log in report_logs:
         # Parse... 2015-09-18T18:02:04.753163330+02:00
         # Puppetlabs... has a super long millisecond counter (9 digits!!!)
@@ -9,11 +9,61 @@
 from panopuppet.pano.puppetdb import puppetdb
 from panopuppet.pano.puppetdb.pdbutils import json_to_datetime
 from panopuppet.pano.puppetdb.puppetdb import get_server
+from panopuppet.pano.puppetdb.reportcache import report_cache
 from panopuppet.pano.settings import CACHE_TIME
 
 __author__ = 'etaklar'
 
 
+def report_event_counts(source_url, source_certs, source_verify, reports_list, request=None):
+    """
+    Fetches the event counts of every report that is not cached yet in one request.
+    Grouping by resource gives one row per resource and event status of a report, counting the rows per status
+    gives the same resource counts as /event-counts.
+    The counts are only cached if PuppetDB answered with them, otherwise the reports have no counts this time.
+    :param reports_list: list of reports as returned by /reports
+    :return: dict of report hash and a dict of event status and count
+    """
+    event_counts = {}
+    uncached_reports = []
+    for report in reports_list:
+        counts = report_cache.get(source_url, report['hash'], 'event_counts')
+        if counts is None:
+            uncached_reports.append(report)
+        else:
+            event_counts[report['hash']] = counts
+    if not uncached_reports:
+        return event_counts
+    events_params = {
+        'query':
+            {
+                'extract': '["extract",[["function","count"],"report","status","resource_type","resource_title"],'
+                           '%s,["group_by","report","status","resource_type","resource_title"]]',
+                1: '["or",%s]' % ','.join('["=","report","%s"]' % report['hash'] for report in uncached_reports)
+            },
+    }
+    try:
+        # Streamed because an error answer, which is not a JSON array, then raises ValueError.
+        events_count_list = list(puppetdb.api_get(
+            path='events',
+            api_url=source_url,
+            api_version='v4',
+            verify=source_verify,
+            cert=source_certs,
+            params=puppetdb.mk_puppetdb_query(events_params, request),
+            stream=True,
+        ))
+    except ValueError:
+        return event_counts
+    for item in events_count_list:
+        counts = event_counts.setdefault(item['report'], {})
+        counts[item['status']] = counts.get(item['status'], 0) + 1
+    # Reports without events have no rows but are known to exist, cache them as well.
+    for report in uncached_reports:
+        report_cache.set(source_url, report['hash'], 'event_counts', event_counts.get(report['hash'], {}))
+    return event_counts
+
+
 @login_required
 @cache_page(CACHE_TIME)
 def reports_json(request, certname=None):
@@ -46,6 +96,7 @@ def reports_json(request, certname=None):
                         'order': 'desc',
                     },
             },
+        'fields': puppetdb.REPORT_LIST_FIELDS,
         'limit': 25,
         'include_total': 'true',
         'offset': offset,
@@ -68,62 +119,27 @@ def reports_json(request, certname=None):
     else:
         num_pages = num_pages_wodec
 
+    event_counts = report_event_counts(source_url, source_certs, source_verify, reports_list, request)
+
     report_status = []
     for report in reports_list:
-        found_report = False
-        events_params = {
-            'query':
-                {
-                    1: '["=","report","' + report['hash'] + '"]'
-                },
-            'summarize_by': 'certname',
-        }
-        eventcount_list = puppetdb.api_get(
-            path='event-counts',
-            api_url=source_url,
-            api_version='v4',
-            verify=source_verify,
-            cert=source_certs,
-            params=puppetdb.mk_puppetdb_query(events_params, request),
-        )
-        # Make list of the results
-        for event in eventcount_list:
-            if event['subject']['title'] == report['certname']:
-                found_report = True
-                report_status.append({
-                    'hash': report['hash'],
-                    'certname': report['certname'],
-                    'environment': report['environment'],
-                    'is_noop': report['noop'],
-                    'start_time': filters.date(localtime(json_to_datetime(report['start_time'])), 'Y-m-d H:i:s'),
-                    'end_time': filters.date(localtime(json_to_datetime(report['end_time'])), 'Y-m-d H:i:s'),
-                    'events_successes': event['successes'],
-                    'events_noops': event['noops'],
-                    'events_failures': event['failures'],
-                    'events_skipped': event['skips'],
-                    'report_status': report['status'],
-                    'config_version': report['configuration_version'],
-                    'run_duration': "{0:.0f}".format(
-                        (json_to_datetime(report['end_time']) - json_to_datetime(report['start_time'])).total_seconds())
-                })
-                break
-        if found_report is False:
-            report_status.append({
-                'hash': report['hash'],
-                'certname': report['certname'],
-                'environment': report['environment'],
-                'is_noop': report['noop'],
-                'start_time': filters.date(localtime(json_to_datetime(report['start_time'])), 'Y-m-d H:i:s'),
-                'end_time': filters.date(localtime(json_to_datetime(report['end_time'])), 'Y-m-d H:i:s'),
-                'events_successes': 0,
-                'events_noops': 0,
-                'events_failures': 0,
-                'events_skipped': 0,
-                'report_status': report['status'],
-                'config_version': report['configuration_version'],
-                'run_duration': "{0:.0f}".format(
-                    (json_to_datetime(report['end_time']) - json_to_datetime(report['start_time'])).total_seconds())
-            })
+        counts = event_counts.get(report['hash'], {})
+        report_status.append({
+            'hash': report['hash'],
+            'certname': report['certname'],
+            'environment': report['environment'],
+            'is_noop': report['noop'],
+            'start_time': filters.date(localtime(json_to_datetime(report['start_time'])), 'Y-m-d H:i:s'),
+            'end_time': filters.date(localtime(json_to_datetime(report['end_time'])), 'Y-m-d H:i:s'),
+            'events_successes': counts.get('success', 0),
+            'events_noops': counts.get('noop', 0),
+            'events_failures': counts.get('failure', 0),
+            'events_skipped': counts.get('skipped', 0),
+            'report_status': report['status'],
+            'config_version': report['configuration_version'],
+            'run_duration': "{0:.0f}".format(
+                (json_to_datetime(report['end_time']) - json_to_datetime(report['start_time'])).total_seconds())
+        })
 
     context['certname'] = certname
     context['reports_list'] = report_status
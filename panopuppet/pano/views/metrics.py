@@ -0,0 +1,19 @@
+import hmac
+
+from django.http import HttpResponse, HttpResponseForbidden, Http404
+
+from panopuppet.pano.methods.metrics import registry
+from panopuppet.pano.settings import ENABLE_METRICS, METRICS_TOKEN
+
+__author__ = 'etaklar'
+
+
+def metrics(request):
+    # Not behind the login so that Prometheus can scrape it, disable it with ENABLE_METRICS.
+    if not ENABLE_METRICS:
+        raise Http404
+    if METRICS_TOKEN:
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if not hmac.compare_digest(authorization.encode('utf-8'), ('Bearer %s' % METRICS_TOKEN).encode('utf-8')):
+            return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
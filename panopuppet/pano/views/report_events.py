@@ -7,6 +7,7 @@
 from panopuppet.pano.puppetdb import puppetdb
 from panopuppet.pano.puppetdb.pdbutils import json_to_datetime
 from panopuppet.pano.puppetdb.puppetdb import set_server, get_server
+from panopuppet.pano.puppetdb.reportcache import report_cache
 from panopuppet.pano.settings import AVAILABLE_SOURCES, CACHE_TIME
 
 __author__ = 'etaklar'
@@ -42,14 +43,19 @@ def detailed_events(request, hashid=None):
                 'query_field': {'field': 'certname'},
             },
     }
-    events_list = puppetdb.api_get(
-        api_url=source_url,
-        cert=source_certs,
-        verify=source_verify,
-        path='/events',
-        api_version='v4',
-        params=puppetdb.mk_puppetdb_query(events_params),
-    )
+    events_list = report_cache.get(source_url, hashid, 'events')
+    if events_list is None:
+        events_list = puppetdb.api_get(
+            api_url=source_url,
+            cert=source_certs,
+            verify=source_verify,
+            path='/events',
+            api_version='v4',
+            params=puppetdb.mk_puppetdb_query(events_params),
+        )
+        # An unknown hash also returns no events, only remember reports we found.
+        if events_list and 'error' not in events_list:
+            report_cache.set(source_url, hashid, 'events', events_list)
     environment = ''
     certname = ''
     event_execution_times = []
@@ -42,6 +42,7 @@ def reports(request, certname=None):
                                 'order': 'desc',
                             },
                     },
+                'fields': ['hash', 'environment', 'start_time'],
                 'limit': 1,
             }
             latest_report = puppetdb.api_get(
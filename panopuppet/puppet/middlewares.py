@@ -1,8 +1,12 @@
 __author__ = 'etaklar'
 
+import time
+
 import pytz
 from django.utils import timezone
 
+from panopuppet.pano.methods import metrics
+
 
 class TimezoneMiddleware(object):
     def process_request(self, request):
@@ -11,3 +15,22 @@ def process_request(self, request):
             timezone.activate(pytz.timezone(tzname))
         else:
             timezone.deactivate()
+
+
+class MetricsMiddleware(object):
+    """
+    Records the time taken to answer each request and its status code by URL name.
+    """
+
+    def process_request(self, request):
+        request.metrics_started = time.time()
+
+    def process_response(self, request, response):
+        started = getattr(request, 'metrics_started', None)
+        if started is None:
+            return response
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match is not None and match.url_name else 'unknown'
+        metrics.VIEW_SECONDS.observe(time.time() - started, view=view)
+        metrics.VIEW_RESPONSES.inc(view=view, status=response.status_code)
+        return response
@@ -49,6 +49,8 @@
 )
 
 MIDDLEWARE_CLASSES = (
+    # first so that the time spent in the other middlewares is included
+    'panopuppet.puppet.middlewares.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import TestCase
+
+from pano.puppetdb import aio, pdbutils
+
+__author__ = 'etaklar'
+
+
+class AsyncPuppetdbJobs(TestCase):
+    def setUp(self):
+        patch = mock.patch.object(pdbutils, '_executor', ThreadPoolExecutor(max_workers=4))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_api_get(self):
+        with mock.patch.object(aio.puppetdb, 'api_get', return_value=([{'certname': 'node1'}], {'X-Records': '1'})) \
+                as api_get:
+            results = aio.run(aio.api_get(api_url='http://puppetdb.example.com:8080/', path='/nodes',
+                                          params={'limit': 1}))
+        self.assertEqual(results, ([{'certname': 'node1'}], {'X-Records': '1'}))
+        self.assertEqual(api_get.call_args[1]['path'], '/nodes')
+        self.assertEqual(api_get.call_args[1]['params'], {'limit': 1})
+
+    def test_jobs_are_gathered_concurrently(self):
+        """
+        Every job waits until both have started, which only happens if they run at the same time.
+        """
+        barrier = threading.Barrier(2, timeout=5)
+
+        def api_get(path=None, **kwargs):
+            barrier.wait()
+            return [path]
+
+        jobs = {
+            'nodes': {'id': 'nodes', 'path': '/nodes', 'url': 'http://puppetdb.example.com:8080/'},
+            'reports': {'id': 'reports', 'path': '/reports', 'url': 'http://puppetdb.example.com:8080/'},
+        }
+        with mock.patch.object(aio.puppetdb, 'api_get', api_get):
+            results = aio.run(aio.run_puppetdb_jobs(jobs))
+        self.assertEqual(results, {'nodes': ['/nodes'], 'reports': ['/reports']})
+
+    def test_job_timeout(self):
+        released = threading.Event()
+        self.addCleanup(released.set)
+
+        def api_get(**kwargs):
+            released.wait(5)
+            return []
+
+        jobs = {'nodes': {'id': 'nodes', 'path': '/nodes', 'url': 'http://puppetdb.example.com:8080/',
+                          'timeout': 0.1}}
+        with mock.patch.object(aio.puppetdb, 'api_get', api_get):
+            self.assertRaises(asyncio.TimeoutError, aio.run, aio.run_puppetdb_jobs(jobs))
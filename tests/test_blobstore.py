@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from pano.methods.blobstore import BlobStore, md5sum_of
+
+__author__ = 'etaklar'
+
+
+class BlobStoreMemory(TestCase):
+    def test_get_and_set(self):
+        store = BlobStore(directory=None, max_bytes=1024 * 1024, compress=True)
+        content = 'line one\nline two åäö\n'
+        md5sum = md5sum_of(content)
+        self.assertIsNone(store.get(md5sum))
+        self.assertTrue(store.set(md5sum, content))
+        self.assertEqual(store.get(md5sum), content)
+
+    def test_wrong_md5sum_is_not_stored(self):
+        store = BlobStore(directory=None, max_bytes=1024 * 1024, compress=False)
+        self.assertFalse(store.set(md5sum_of('other content'), 'content'))
+        self.assertFalse(store.set('../../etc/passwd', 'content'))
+        self.assertIsNone(store.get(md5sum_of('other content')))
+
+    def test_lru_eviction(self):
+        contents = ['a' * 100, 'b' * 100, 'c' * 100]
+        store = BlobStore(directory=None, max_bytes=250, compress=False)
+        store.set(md5sum_of(contents[0]), contents[0])
+        store.set(md5sum_of(contents[1]), contents[1])
+        # Reading the first content makes the second one the least recently used
+        store.get(md5sum_of(contents[0]))
+        store.set(md5sum_of(contents[2]), contents[2])
+        self.assertEqual(store.total_bytes, 200)
+        self.assertIsNone(store.get(md5sum_of(contents[1])))
+        self.assertEqual(store.get(md5sum_of(contents[0])), contents[0])
+        self.assertEqual(store.get(md5sum_of(contents[2])), contents[2])
+
+
+class BlobStoreDisk(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_persistent(self):
+        content = 'file content\n' * 100
+        md5sum = md5sum_of(content)
+        store = BlobStore(directory=self.directory, max_bytes=1024 * 1024, compress=True)
+        store.set(md5sum, content)
+        # Compressed on disk
+        self.assertLess(os.path.getsize(store.path(md5sum)), len(content))
+        # A new store, i.e. after a restart, finds the content and its size
+        store = BlobStore(directory=self.directory, max_bytes=1024 * 1024, compress=True)
+        self.assertEqual(store.get(md5sum), content)
+        self.assertEqual(store.total_bytes, os.path.getsize(store.path(md5sum)))
+
+    def test_eviction_removes_files(self):
+        contents = ['a' * 100, 'b' * 100]
+        store = BlobStore(directory=self.directory, max_bytes=150, compress=False)
+        for content in contents:
+            store.set(md5sum_of(content), content)
+        self.assertFalse(os.path.exists(store.path(md5sum_of(contents[0]))))
+        self.assertTrue(os.path.exists(store.path(md5sum_of(contents[1]))))
+
+    def test_shared_directory(self):
+        """
+        A content stored by another process sharing the directory should be found.
+        """
+        content = 'file content\n' * 100
+        md5sum = md5sum_of(content)
+        reader = BlobStore(directory=self.directory, max_bytes=1024 * 1024, compress=True)
+        self.assertIsNone(reader.get(md5sum))
+        writer = BlobStore(directory=self.directory, max_bytes=1024 * 1024, compress=True)
+        writer.set(md5sum, content)
+        self.assertEqual(reader.get(md5sum), content)
+        self.assertEqual(reader.total_bytes, os.path.getsize(reader.path(md5sum)))
@@ -0,0 +1,72 @@
+import time
+
+from django.test import TestCase
+
+from pano.methods.catalogdiff import compare_catalogues
+
+__author__ = 'etaklar'
+
+
+def resource(rtype, title, **parameters):
+    return {
+        'certname': 'node.example.com',
+        'type': rtype,
+        'title': title,
+        'exported': False,
+        'tags': [rtype.lower()],
+        'parameters': parameters,
+    }
+
+
+def edge(source_title, target_title, relationship='contains'):
+    return {
+        'certname': 'node.example.com',
+        'source_type': 'Class',
+        'source_title': source_title,
+        'relationship': relationship,
+        'target_type': 'File',
+        'target_title': target_title,
+    }
+
+
+class CompareCatalogues(TestCase):
+    def test_resources(self):
+        from_resources = [
+            resource('File', '/etc/motd', ensure='file', content='hello'),
+            resource('File', '/etc/hosts', ensure='file'),
+            resource('Service', 'ntp', ensure='running'),
+        ]
+        against_resources = [
+            resource('File', '/etc/motd', ensure='file', content='hello world', mode='0644'),
+            resource('File', '/etc/hosts', ensure='file'),
+            # Same title as the service but another type
+            resource('Package', 'ntp', ensure='installed'),
+        ]
+        diff = compare_catalogues(from_resources, against_resources, 'resources')
+        self.assertEqual([(entry['type'], entry['title']) for entry in diff['added_entries']], [('Package', 'ntp')])
+        self.assertEqual([(entry['type'], entry['title']) for entry in diff['deleted_entries']], [('Service', 'ntp')])
+        self.assertEqual(len(diff['changed_entries']), 1)
+        change = diff['changed_entries'][0]
+        self.assertEqual(change['from']['title'], '/etc/motd')
+        self.assertEqual(change['changed_parameters'], {
+            'content': {'from': 'hello', 'against': 'hello world'},
+            'mode': {'from': None, 'against': '0644'},
+        })
+        self.assertNotIn('certname', change['against'])
+
+    def test_edges(self):
+        from_edges = [edge('Motd', '/etc/motd'), edge('Hosts', '/etc/hosts')]
+        against_edges = [edge('Motd', '/etc/motd'), edge('Hosts', '/etc/hosts', 'before')]
+        diff = compare_catalogues(from_edges, against_edges, 'edges')
+        self.assertEqual([entry['relationship'] for entry in diff['added_entries']], ['before'])
+        self.assertEqual([entry['relationship'] for entry in diff['deleted_entries']], ['contains'])
+        self.assertEqual(diff['changed_entries'], [])
+
+    def test_large_catalogues(self):
+        from_resources = [resource('File', '/tmp/file%d' % i, ensure='file', content='x' * 100) for i in range(20000)]
+        against_resources = [resource('File', '/tmp/file%d' % i, ensure='file', content='x' * 100) for i in range(20000)]
+        against_resources[100]['parameters']['content'] = 'changed'
+        started = time.time()
+        diff = compare_catalogues(from_resources, against_resources, 'resources')
+        self.assertLess(time.time() - started, 2)
+        self.assertEqual(len(diff['changed_entries']), 1)
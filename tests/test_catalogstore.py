@@ -0,0 +1,103 @@
+import datetime
+import json
+
+from django.test import TestCase
+
+from pano.methods.catalogstore import split_catalogue, compress, decompress, store_catalogue, get_saved_catalogue, \
+    load_catalogue, load_section
+from panopuppet.pano.models import SavedCatalogs, CatalogResource
+
+__author__ = 'etaklar'
+
+
+class SplitCatalogue(TestCase):
+    def test_sections(self):
+        catalogue = {
+            'certname': 'node.example.com',
+            'hash': 'e4fug294hf3293hf9348g3804hg3084h',
+            'version': '1474192855',
+            'edges': {'href': '/pdb/query/v4/catalogs/node.example.com/edges', 'data': [{'relationship': 'contains'}]},
+            'resources': {'href': '/pdb/query/v4/catalogs/node.example.com/resources',
+                          'data': [{'type': 'File', 'title': '/etc/motd'}]},
+        }
+        metadata, edges, resources = split_catalogue(catalogue)
+        self.assertEqual(metadata['edges'], {'href': '/pdb/query/v4/catalogs/node.example.com/edges'})
+        self.assertEqual(metadata['hash'], 'e4fug294hf3293hf9348g3804hg3084h')
+        self.assertEqual(edges, [{'relationship': 'contains'}])
+        self.assertEqual(resources, [{'type': 'File', 'title': '/etc/motd'}])
+
+    def test_compress(self):
+        data = [{'type': 'File', 'title': '/tmp/file%d' % i, 'parameters': {'ensure': 'file'}} for i in range(100)]
+        blob = compress(data)
+        self.assertLess(len(blob), len(str(data)))
+        self.assertEqual(decompress(memoryview(blob)), data)
+
+
+def make_catalogue(version, titles):
+    return {
+        'certname': 'node.example.com',
+        'hash': 'catalogue-%s' % version,
+        'version': version,
+        'producer_timestamp': '2016-09-18T10:00:00.000Z',
+        'edges': {'href': '/pdb/query/v4/catalogs/node.example.com/edges',
+                  'data': [{'relationship': 'contains',
+                            'source_type': 'Class', 'source_title': 'Main',
+                            'target_type': 'File', 'target_title': title} for title in titles]},
+        'resources': {'href': '/pdb/query/v4/catalogs/node.example.com/resources',
+                      'data': [{'type': 'File', 'title': title, 'parameters': {'ensure': 'file'}}
+                               for title in titles]},
+    }
+
+
+class StoreCatalogue(TestCase):
+    timestamp = datetime.datetime(2016, 9, 18, 10, 0, tzinfo=datetime.timezone.utc)
+
+    def store(self, catalogue):
+        return store_catalogue('node.example.com', catalogue, 'report-%s' % catalogue['version'], self.timestamp)
+
+    def test_shared_resources(self):
+        """
+        Resources already saved for the host should not be saved again by a later catalogue.
+        """
+        self.store(make_catalogue('1', ['/etc/motd', '/etc/hosts']))
+        self.store(make_catalogue('2', ['/etc/motd', '/etc/hosts', '/etc/issue']))
+        self.assertEqual(CatalogResource.objects.filter(hostname='node.example.com').count(), 3)
+        # Another host does not share the resources
+        store_catalogue('other.example.com', make_catalogue('1', ['/etc/motd']), 'report-1', self.timestamp)
+        self.assertEqual(CatalogResource.objects.count(), 4)
+
+    def test_round_trip(self):
+        catalogue = make_catalogue('1', ['/etc/motd', '/etc/hosts'])
+        saved = self.store(catalogue)
+        saved = SavedCatalogs.objects.get(pk=saved.pk)
+        self.assertEqual(load_catalogue(saved), catalogue)
+        self.assertEqual(saved.catalogue, '')
+
+    def test_deferred_sections(self):
+        """
+        Only the columns of the requested sections should be loaded.
+        """
+        catalogue = make_catalogue('1', ['/etc/motd'])
+        self.store(catalogue)
+        saved = get_saved_catalogue('node.example.com', 'catalogue-1', sections=('metadata',))
+        self.assertEqual(saved.get_deferred_fields(), {'edges_blob', 'resources_blob', 'catalogue'})
+        with self.assertNumQueries(0):
+            self.assertEqual(load_section(saved, 'metadata')['version'], '1')
+        saved = get_saved_catalogue('node.example.com', 'catalogue-1', sections=('metadata', 'edges', 'resources'))
+        self.assertEqual(saved.get_deferred_fields(), {'catalogue'})
+        with self.assertNumQueries(1):
+            self.assertEqual(load_section(saved, 'resources'), catalogue['resources']['data'])
+
+    def test_legacy_catalogue(self):
+        """
+        Catalogues saved as a single JSON document should still be readable.
+        """
+        catalogue = make_catalogue('1', ['/etc/motd'])
+        SavedCatalogs.objects.create(hostname='node.example.com', catalogue_id='catalogue-1',
+                                     linked_report='report-1', timestamp=self.timestamp,
+                                     catalogue=json.dumps(catalogue))
+        saved = get_saved_catalogue('node.example.com', 'catalogue-1')
+        self.assertEqual(load_catalogue(saved), catalogue)
+        self.assertEqual(load_section(saved, 'edges'), catalogue['edges']['data'])
+        self.assertEqual(load_section(saved, 'resources'), catalogue['resources']['data'])
+        self.assertRaises(ValueError, load_section, saved, 'facts')
@@ -0,0 +1,42 @@
+from unittest import mock
+
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from pano.management import sources
+from pano.management.commands import refresh_dashboard
+
+__author__ = 'etaklar'
+
+SOURCES = [{'url': 'http://puppetdb1.example.com:8080/'}, {'url': 'http://puppetdb2.example.com:8080/'}]
+
+
+class CountingCommand(sources.SourcesCommand):
+    def __init__(self, *args, **kwargs):
+        super(CountingCommand, self).__init__(*args, **kwargs)
+        self.handled = []
+
+    def handle_source(self, source):
+        self.handled.append(source['url'])
+        if source is SOURCES[0]:
+            raise ValueError('Unreachable')
+        return 'Handled %s' % source['url']
+
+
+class SourcesCommandTest(TestCase):
+    def test_once(self):
+        """
+        A failing source should be reported and not stop the other sources.
+        """
+        command = CountingCommand()
+        command.stdout = mock.Mock()
+        command.stderr = mock.Mock()
+        with mock.patch.object(sources, 'available_sources', return_value=SOURCES):
+            command.handle(interval=60, once=True, verbosity=2)
+        self.assertEqual(command.handled, [source['url'] for source in SOURCES])
+        self.assertIn('Unreachable', command.stderr.write.call_args[0][0])
+        self.assertTrue(command.stdout.write.call_args[0][0].startswith('Handled http://puppetdb2.example.com:8080/'))
+
+    def test_refresh_without_cache(self):
+        with mock.patch.object(refresh_dashboard, 'CACHE_TIME', 0):
+            self.assertRaises(CommandError, refresh_dashboard.Command().handle, interval=60, once=True, verbosity=1)
@@ -0,0 +1,81 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from pano.puppetdb import puppetdb
+# The module used by puppetdb.api_get
+from panopuppet.pano.puppetdb import connections
+
+__author__ = 'etaklar'
+
+
+class FakeSession(object):
+    def __init__(self, response=None):
+        self.response = response
+        self.closed = False
+
+    def get(self, url, **kwargs):
+        return self.response
+
+    def close(self):
+        self.closed = True
+
+
+def fake_response(chunks):
+    resp = mock.Mock(encoding='utf-8', status_code=200, headers={})
+    resp.iter_content.return_value = iter(chunks)
+    return resp
+
+
+class PooledSessions(TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(connections._sessions, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(connections, '_new_session', lambda cert, verify: FakeSession())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def session(self, url, cert=None, verify=False):
+        with connections.pooled_session(url, cert=cert, verify=verify) as session:
+            return session
+
+    def test_pooled_by_source(self):
+        session = self.session('https://puppetdb.example.com:8081/pdb/query/v4/nodes', ['cert.pem', 'key.pem'], 'ca.pem')
+        self.assertIs(self.session('https://puppetdb.example.com:8081/pdb/meta/v1/version', ('cert.pem', 'key.pem'),
+                                   'ca.pem'), session)
+        self.assertIsNot(self.session('http://puppetdb.example.com:8081/', ('cert.pem', 'key.pem'), 'ca.pem'), session)
+        self.assertIsNot(self.session('https://puppetdb.example.com:8082/', ('cert.pem', 'key.pem'), 'ca.pem'), session)
+        self.assertIsNot(self.session('https://puppetdb.example.com:8081/', None, 'ca.pem'), session)
+        self.assertIsNot(self.session('https://puppetdb.example.com:8081/', ('cert.pem', 'key.pem'), False), session)
+        self.assertEqual(len(connections._sessions), 5)
+
+    def test_idle_eviction(self):
+        """
+        Only sessions which are not in use should be closed as idle.
+        """
+        idle = self.session('http://idle.example.com:8080/')
+        key, busy = connections.checkout_session('http://busy.example.com:8080/')
+        with mock.patch.object(connections, 'POOL_IDLE_TIMEOUT', -1):
+            self.session('http://other.example.com:8080/')
+            self.assertTrue(idle.closed)
+            self.assertFalse(busy.closed)
+            connections.release_session(key, busy)
+            self.session('http://other.example.com:8080/')
+        self.assertTrue(busy.closed)
+        self.assertNotIn(key, connections._sessions)
+
+    def test_stream_keeps_session_in_use(self):
+        """
+        A streamed response should keep its session in use until its records have been consumed.
+        """
+        session = FakeSession(fake_response(['[{"certname": "node1"}', ',{"certname": "node2"}]']))
+        with mock.patch.object(connections, '_new_session', lambda cert, verify: session):
+            records = puppetdb.api_get(api_url='http://puppetdb.example.com:8080/', path='/nodes', stream=True,
+                                       cert=None, verify=False)
+        key = connections.pool_key('http://puppetdb.example.com:8080/')
+        self.assertEqual(connections._sessions[key][2], 1)
+        self.assertEqual(next(records), {'certname': 'node1'})
+        self.assertEqual(connections._sessions[key][2], 1)
+        self.assertEqual(list(records), [{'certname': 'node2'}])
+        self.assertEqual(connections._sessions[key][2], 0)
@@ -0,0 +1,61 @@
+import difflib
+import itertools
+import random
+from unittest import mock
+
+from django.test import TestCase
+
+from pano.methods import diffengine
+from pano.methods.diffengine import unified_diff, colorize
+
+__author__ = 'etaklar'
+
+
+def difflib_lines(from_lines, to_lines):
+    return [line for line in difflib.unified_diff(from_lines, to_lines, lineterm='')
+            if not line.startswith(('---', '+++'))]
+
+
+class UnifiedDiff(TestCase):
+    def test_same_hunks_as_difflib(self):
+        rand = random.Random(42)
+        for i in range(50):
+            from_lines = ['line %d' % rand.randint(0, 30) for j in range(rand.randint(0, 80))]
+            to_lines = list(from_lines)
+            for change in range(rand.randint(1, 5)):
+                position = rand.randint(0, len(to_lines))
+                if rand.random() < 0.5 and to_lines[position:]:
+                    del to_lines[position]
+                else:
+                    to_lines.insert(position, 'new line %d' % change)
+            diff = list(unified_diff(from_lines, to_lines))
+            self.assertEqual(diff[2:], difflib_lines(from_lines, to_lines))
+
+    def test_equal_files(self):
+        lines = ['a', 'b', 'c']
+        self.assertEqual(unified_diff(lines, list(lines)), [])
+
+    def test_summary_of_large_diff(self):
+        from_lines = ['same'] * 10 + ['old %d' % i for i in range(100)] + ['same'] * 10
+        to_lines = ['same'] * 10 + ['new %d' % i for i in range(100)] + ['same'] * 10
+        diff = list(unified_diff(from_lines, to_lines, max_lines=50))
+        self.assertEqual(diff[2], '@@ -11,100 +11,100 @@')
+        self.assertIn('too large', diff[3])
+
+    def test_colorize(self):
+        html = ''.join(colorize(['--- ', '+++ ', '@@ -1 +1 @@', '-<old>', '+new', ' same']))
+        self.assertIn('<span style="color:red">-&lt;old&gt;</span>', html)
+        self.assertIn('<span style="color:green">+new</span>', html)
+        self.assertIn('<br> same', html)
+
+    def test_summary_when_matching_is_slow(self):
+        """
+        If matching the lines takes longer than the timeout a summary should be shown instead.
+        """
+        from_lines = ['old %d' % i for i in range(100)]
+        to_lines = ['new %d' % i for i in range(100)]
+        # Every look at the clock is ten seconds later than the previous one
+        with mock.patch.object(diffengine.time, 'monotonic', side_effect=itertools.count(step=10)):
+            diff = list(unified_diff(from_lines, to_lines, timeout=1))
+        self.assertEqual(diff[2], '@@ -1,100 +1,100 @@')
+        self.assertIn('more than 1 seconds', diff[3])
@@ -0,0 +1,187 @@
+from datetime import datetime
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from pano.methods import eventrollup
+from pano.puppetdb.puppetdb import mk_puppetdb_query
+from pano.methods.eventrollup import event_hour, count_events, summary_of_resources
+from panopuppet.pano.models import EventRollup as EventRollupModel, EventRollupState
+
+__author__ = 'etaklar'
+
+
+class EventRollup(TestCase):
+    def test_event_hour(self):
+        hour = datetime(2016, 9, 18, 10, tzinfo=timezone.utc)
+        self.assertEqual(event_hour('2016-09-18T10:59:59.123Z'), hour)
+        self.assertEqual(event_hour('2016-09-18T12:30:00+02:00'), hour)
+
+    def test_count_events(self):
+        events = [
+            {'certname': 'node1', 'status': 'success', 'timestamp': '2016-09-18T10:01:00.000Z',
+             'resource_type': 'File', 'resource_title': '/etc/motd', 'containing_class': 'Motd'},
+            {'certname': 'node1', 'status': 'success', 'timestamp': '2016-09-18T10:02:00.000Z',
+             'resource_type': 'File', 'resource_title': '/etc/motd', 'containing_class': 'Motd'},
+            {'certname': 'node1', 'status': 'failure', 'timestamp': '2016-09-18T11:01:00.000Z',
+             'resource_type': 'Service', 'resource_title': 'ntp', 'containing_class': None},
+        ]
+        counts = count_events(iter(events))
+        ten = datetime(2016, 9, 18, 10, tzinfo=timezone.utc)
+        eleven = datetime(2016, 9, 18, 11, tzinfo=timezone.utc)
+        self.assertEqual(counts[(ten, 'node1', 'File', '/etc/motd', 'Motd', 'success')], 2)
+        self.assertEqual(counts[(eleven, 'node1', 'Service', 'ntp', None, 'failure')], 1)
+        self.assertEqual(len(counts), 2)
+
+    def test_summary_of_resources(self):
+        resources = [
+            ('node1', 'File', '/etc/motd', 'Motd', 'success'),
+            ('node2', 'File', '/etc/motd', 'Motd', 'success'),
+            ('node2', 'Service', 'ntp', None, 'failure'),
+        ]
+        summary = summary_of_resources(resources)
+        self.assertEqual(summary['nodes_success'], {'node1': 1, 'node2': 1})
+        self.assertEqual(summary['classes_success'], {'Motd': 2})
+        self.assertEqual(summary['resources_success'], {'/etc/motd': 2})
+        self.assertEqual(summary['types_failure'], {'Service': 1})
+        self.assertEqual(summary['nodes_total'], 3)
+        self.assertEqual(summary['counted'], 'resources')
+
+
+SOURCE = {'url': 'http://puppetdb.example.com:8080/', 'certs': None, 'verify': False}
+
+
+def rollup_event(certname, timestamp):
+    return {'certname': certname, 'status': 'success', 'timestamp': timestamp,
+            'resource_type': 'File', 'resource_title': '/etc/motd', 'containing_class': 'Motd'}
+
+
+class IngestEvents(TestCase):
+    now = datetime(2016, 9, 18, 12, 30, tzinfo=timezone.utc)
+
+    def ingest(self, events, count, now=None):
+        with mock.patch.object(eventrollup, 'pdb_api_get', return_value=[{'count': count}]) as api_get, \
+                mock.patch.object(eventrollup, 'iter_puppetdb_pages', return_value=events) as pages:
+            rows = eventrollup.ingest_events(SOURCE, now=now or self.now)
+        # Both queries cover the same range
+        count_query = api_get.call_args[1]['params']['query']
+        events_query = mk_puppetdb_query(pages.call_args[1]['params'])['query']
+        time_range = count_query[len('["extract",[["function","count"]],'):-1]
+        self.assertIn('["<","timestamp","%s"]' % (now or self.now).isoformat(), time_range)
+        self.assertTrue(events_query.endswith(',%s]' % time_range))
+        return rows
+
+    def rows(self):
+        return sorted(EventRollupModel.objects.values_list('certname', 'count'))
+
+    def setUp(self):
+        self.ingest(iter([rollup_event('node1', '2016-09-18T10:01:00.000Z'),
+                          rollup_event('node2', '2016-09-18T11:01:00.000Z')]), 2)
+
+    def test_ingest(self):
+        self.assertEqual(self.rows(), [('node1', 1), ('node2', 1)])
+        self.assertEqual(EventRollupState.objects.get(source=SOURCE['url']).until, self.now)
+
+    def test_failed_fetch(self):
+        """
+        An error while the events are fetched should keep the counts of the previous run.
+        """
+        def events():
+            yield rollup_event('node1', '2016-09-18T10:01:00.000Z')
+            raise ValueError('Truncated response')
+
+        later = datetime(2016, 9, 18, 13, 30, tzinfo=timezone.utc)
+        self.assertRaises(ValueError, self.ingest, events(), 3, now=later)
+        self.assertEqual(self.rows(), [('node1', 1), ('node2', 1)])
+        self.assertEqual(EventRollupState.objects.get(source=SOURCE['url']).until, self.now)
+
+    def test_short_fetch(self):
+        """
+        Fewer events than PuppetDB counted should not replace the counts.
+        """
+        later = datetime(2016, 9, 18, 13, 30, tzinfo=timezone.utc)
+        self.assertRaises(ValueError, self.ingest, iter([rollup_event('node1', '2016-09-18T10:01:00.000Z')]), 2,
+                          now=later)
+        self.assertEqual(self.rows(), [('node1', 1), ('node2', 1)])
+        self.assertEqual(EventRollupState.objects.get(source=SOURCE['url']).until, self.now)
+
+    def test_count_query(self):
+        with mock.patch.object(eventrollup, 'pdb_api_get', return_value=[{'count': 2}]) as api_get:
+            self.assertEqual(eventrollup.number_of_events(SOURCE, {1: '["=","certname","node1"]'}), 2)
+        self.assertEqual(api_get.call_args[1]['params'],
+                         {'query': '["extract",[["function","count"]],["and",["=","certname","node1"]]]'})
+        with mock.patch.object(eventrollup, 'pdb_api_get', return_value={'error': 'Unsupported query'}):
+            self.assertRaises(ValueError, eventrollup.number_of_events, SOURCE, {1: '["=","certname","node1"]'})
+
+
+def hour(h, minute=0):
+    return datetime(2016, 9, 18, h, minute, tzinfo=timezone.utc)
+
+
+class RollupSummary(TestCase):
+    def setUp(self):
+        EventRollupState.objects.create(source=SOURCE['url'], first_hour=hour(9), until=hour(12, 30))
+        for h, certname, resource_type, title, containing_class, status in [
+                (9, 'node2', 'Package', 'ntp', None, 'success'),
+                (10, 'node1', 'File', '/etc/motd', 'Motd', 'success'),
+                (11, 'node1', 'File', '/etc/motd', 'Motd', 'success'),
+                (11, 'node2', 'Service', 'ntp', None, 'failure'),
+                (11, 'node3', 'Service', 'ntp', None, 'failure')]:
+            EventRollupModel.objects.create(source=SOURCE['url'], hour=hour(h), certname=certname,
+                                            resource_type=resource_type, resource_title=title,
+                                            containing_class=containing_class, status=status, count=2)
+
+    def summary(self, dt_from, dt_to, live=None):
+        with mock.patch.object(eventrollup, 'active_certnames', return_value={'node1', 'node2'}), \
+                mock.patch.object(eventrollup, 'live_resources', side_effect=live or []) as live_resources:
+            summary = eventrollup.rollup_summary(SOURCE, dt_from.isoformat(), dt_to.isoformat())
+        return summary, [c[0] for c in live_resources.call_args_list]
+
+    def test_edges_and_tail(self):
+        """
+        A range ending after the last run should read its whole hours up to the last run
+        and fetch the rest of the range, counting every resource of an active node once.
+        """
+        live = [
+            {('node2', 'Package', 'ntp', None, 'success')},
+            {('node1', 'File', '/etc/motd', 'Motd', 'success')},
+        ]
+        summary, calls = self.summary(hour(9, 45), hour(12, 50), live)
+        self.assertEqual(calls, [(SOURCE, '>', hour(9, 45), hour(10)), (SOURCE, '>=', hour(12), hour(12, 50))])
+        self.assertEqual(summary['counted'], 'resources')
+        self.assertEqual(summary['nodes_success'], {'node1': 1, 'node2': 1})
+        self.assertEqual(summary['nodes_failure'], {'node2': 1})
+        self.assertEqual(summary['resources_success'], {'/etc/motd': 1, 'ntp': 1})
+        self.assertEqual(summary['types_failure'], {'Service': 1})
+
+    def test_whole_hours(self):
+        summary, calls = self.summary(hour(10), hour(12))
+        self.assertEqual(calls, [])
+        self.assertEqual(summary['nodes_success'], {'node1': 1})
+        self.assertEqual(summary['nodes_failure'], {'node2': 1})
+
+    def test_live_path(self):
+        # Within an hour, before the first ingested hour and without any run
+        self.assertEqual(self.summary(hour(10, 15), hour(10, 45)), (None, []))
+        self.assertEqual(self.summary(hour(7, 30), hour(12)), (None, []))
+        self.assertEqual(self.summary(hour(12), hour(12, 50)), (None, []))
+        EventRollupState.objects.all().delete()
+        self.assertEqual(self.summary(hour(10), hour(12)), (None, []))
+
+    def test_live_resources(self):
+        events = [
+            {'certname': 'node1', 'status': 'success', 'resource_type': 'File', 'resource_title': '/etc/motd',
+             'containing_class': 'Motd'},
+            {'certname': 'node1', 'status': 'success', 'resource_type': 'File', 'resource_title': '/etc/motd',
+             'containing_class': 'Motd'},
+            {'certname': 'node1', 'status': 'audit', 'resource_type': 'File', 'resource_title': '/etc/hosts',
+             'containing_class': 'Motd'},
+        ]
+        with mock.patch.object(eventrollup, 'iter_puppetdb_pages', return_value=iter(events)) as pages:
+            resources = eventrollup.live_resources(SOURCE, '>=', hour(12), hour(12, 50))
+        self.assertEqual(resources, {('node1', 'File', '/etc/motd', 'Motd', 'success')})
+        query = mk_puppetdb_query(pages.call_args[1]['params'])['query']
+        self.assertIn('["and",[">=","timestamp","%s"],["<","timestamp","%s"],'
+                      '["in","certname",["extract","certname",["select_nodes",["null?","deactivated",true]]]]]'
+                      % (hour(12).isoformat(), hour(12, 50).isoformat()), query)
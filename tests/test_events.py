@@ -0,0 +1,90 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from pano.methods import events as events_module
+from pano.methods.events import summary_of_events, summary_of_event_counts
+
+__author__ = 'etaklar'
+
+
+def event(certname, status, resource_type='File', resource_title='/etc/motd', containing_class='Motd'):
+    return {
+        'certname': certname,
+        'status': status,
+        'resource_type': resource_type,
+        'resource_title': resource_title,
+        'containing_class': containing_class,
+    }
+
+
+class SummaryOfEvents(TestCase):
+    def test_counts(self):
+        events = iter([
+            event('node1', 'success'),
+            event('node2', 'success'),
+            event('node2', 'failure', 'Service', 'ntp', 'Ntp'),
+            event('node3', 'noop', 'Service', 'ntp', 'Ntp'),
+        ])
+        summary = summary_of_events(events)
+        self.assertEqual(summary['classes_success'], {'Motd': 2})
+        self.assertEqual(summary['nodes_success'], {'node1': 1, 'node2': 1})
+        self.assertEqual(summary['types_failure'], {'Service': 1})
+        self.assertEqual(summary['resources_noop'], {'ntp': 1})
+        self.assertEqual(summary['resources_skipped'], {})
+        self.assertEqual(summary['nodes_total'], 4)
+        self.assertEqual(summary['classes_total'], 3)
+        self.assertEqual(summary['counted'], 'events')
+
+    def test_event_counts(self):
+        event_counts = {
+            'classes': [{'subject_type': 'containing_class', 'subject': {'title': 'Ntp'},
+                         'failures': 1, 'successes': 0, 'noops': 1, 'skips': 0}],
+            'nodes': [{'subject_type': 'certname', 'subject': {'title': 'node2'},
+                       'failures': 1, 'successes': 1, 'noops': 0, 'skips': 0}],
+            'resources': [
+                {'subject_type': 'resource', 'subject': {'type': 'Service', 'title': 'ntp'},
+                 'failures': 1, 'successes': 0, 'noops': 1, 'skips': 0},
+                {'subject_type': 'resource', 'subject': {'type': 'Package', 'title': 'ntp'},
+                 'failures': 1, 'successes': 0, 'noops': 0, 'skips': 0},
+            ],
+        }
+        summary = summary_of_event_counts(event_counts)
+        self.assertEqual(summary['classes_failure'], {'Ntp': 1})
+        self.assertEqual(summary['classes_success'], {})
+        self.assertEqual(summary['nodes_success'], {'node2': 1})
+        self.assertEqual(summary['resources_failure'], {'ntp': 2})
+        self.assertEqual(summary['types_failure'], {'Service': 1, 'Package': 1})
+        self.assertEqual(summary['types_noop'], {'Service': 1})
+        self.assertEqual(summary['types_total'], 3)
+        self.assertEqual(summary['counted'], 'resources')
+
+
+class GetEventsSummary(TestCase):
+    def summary(self, **run_puppetdb_jobs):
+        streamed = [event('node1', 'failure')]
+        with mock.patch.object(events_module, 'get_server', return_value=('http://puppetdb.example.com:8080/',
+                                                                           None, False)), \
+                mock.patch.object(events_module, 'run_puppetdb_jobs', **run_puppetdb_jobs), \
+                mock.patch.object(events_module, 'iter_puppetdb_pages', return_value=iter(streamed)) as pages:
+            summary = events_module.get_events_summary(mock.Mock(), timespan='latest')
+        return summary, pages
+
+    def test_event_counts(self):
+        counts = [{'subject': {'type': 'File', 'title': 'node1'}, 'failures': 1}]
+        summary, pages = self.summary(return_value={'classes': counts, 'nodes': counts, 'resources': counts})
+        self.assertEqual(summary['counted'], 'resources')
+        self.assertFalse(pages.called)
+
+    def test_error_answer(self):
+        """
+        Events should be counted locally if PuppetDB answers /event-counts with an error.
+        """
+        error = {'error': 'Unsupported query'}
+        with self.assertLogs(events_module.logger, 'WARNING'):
+            summary, pages = self.summary(return_value={'classes': error, 'nodes': [], 'resources': []})
+        self.assertEqual(summary['counted'], 'events')
+        self.assertEqual(summary['nodes_failure'], {'node1': 1})
+
+    def test_connection_error(self):
+        self.assertRaises(ConnectionError, self.summary, side_effect=ConnectionError)
@@ -0,0 +1,94 @@
+import time
+from contextlib import nullcontext
+from unittest import mock
+
+from django.test import TestCase
+
+from pano.methods import filebucket
+from pano.methods.blobstore import BlobStore
+
+__author__ = 'etaklar'
+
+OLD_FILE = 'line 1\nline 2\n'
+NEW_FILE = 'line 1\nline 3\n'
+SERVERS = {
+    'puppetdb': ('http://puppetdb.example.com:8080/', None, False),
+    'filebucket': ('https://puppet.example.com:8140/', None, False, True),
+    'fileserver': ('https://puppet.example.com:8140/', None, False, True),
+}
+
+
+class FakeResponse(object):
+    def __init__(self, text=None):
+        self.status_code = 404 if text is None else 200
+        self.text = text or ''
+        self.content = self.text.encode('utf-8')
+
+
+class FakeSession(object):
+    """
+    Answers filebucket requests with the files stored by MD5 sum.
+    """
+
+    def __init__(self, files, delays=None):
+        self.files = files
+        self.delays = delays or {}
+        self.urls = []
+
+    def get(self, url, **kwargs):
+        self.urls.append(url)
+        md5sum = url.rsplit('/', 1)[-1]
+        time.sleep(self.delays.get(md5sum, 0))
+        return FakeResponse(self.files.get(md5sum))
+
+
+class FilebucketDiff(TestCase):
+    def diff(self, files, resources, delays=None):
+        session = FakeSession(files, delays)
+        with mock.patch.object(filebucket, 'get_server', lambda request, type='puppetdb': SERVERS[type]), \
+                mock.patch.object(filebucket, 'pooled_session', lambda *args, **kwargs: nullcontext(session)), \
+                mock.patch.object(filebucket, 'blob_store', BlobStore(directory=None, max_bytes=0)), \
+                mock.patch.object(filebucket, 'pdb_api_get', return_value=resources) as pdb_api_get:
+            diff = filebucket.get_file(None, 'node1.example.com', 'production', '/etc/motd', 'File',
+                                       md5sum_from='{md5}%s' % filebucket.get_hash(OLD_FILE),
+                                       md5sum_to='{md5}%s' % filebucket.get_hash(NEW_FILE),
+                                       diff=True, file_status='both')
+        return diff, session, pdb_api_get
+
+    def test_both_files_in_filebucket(self):
+        """
+        PuppetDB should not be asked for the resource if both files are in the filebucket.
+        """
+        files = {filebucket.get_hash(OLD_FILE): OLD_FILE, filebucket.get_hash(NEW_FILE): NEW_FILE}
+        diff, session, pdb_api_get = self.diff(files, [])
+        self.assertEqual(list(diff)[2:], ['@@ -1,3 +1,3 @@', ' line 1', '-line 2', '+line 3', ' '])
+        self.assertEqual(len(session.urls), 2)
+        self.assertFalse(pdb_api_get.called)
+
+    def test_new_file_from_resource(self):
+        """
+        A new file missing from the filebucket should be taken from the content of the resource in PuppetDB.
+        """
+        files = {filebucket.get_hash(OLD_FILE): OLD_FILE}
+        resources = [{'parameters': {'content': NEW_FILE}}]
+        diff, session, pdb_api_get = self.diff(files, resources)
+        self.assertEqual(list(diff)[2:], ['@@ -1,3 +1,3 @@', ' line 1', '-line 2', '+line 3', ' '])
+        self.assertEqual(pdb_api_get.call_count, 1)
+
+    def test_slow_filebucket(self):
+        """
+        The new file should be taken from PuppetDB without waiting for a filebucket which is slow to miss.
+        """
+        files = {filebucket.get_hash(OLD_FILE): OLD_FILE}
+        resources = [{'parameters': {'content': NEW_FILE}}]
+        started = time.time()
+        with mock.patch.object(filebucket, 'RESOURCE_FALLBACK_DELAY', 0.01):
+            diff, session, pdb_api_get = self.diff(files, resources, {filebucket.get_hash(NEW_FILE): 2})
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(list(diff)[2:], ['@@ -1,3 +1,3 @@', ' line 1', '-line 2', '+line 3', ' '])
+        self.assertEqual(pdb_api_get.call_count, 1)
+
+    def test_old_file_missing(self):
+        files = {filebucket.get_hash(NEW_FILE): NEW_FILE}
+        diff, session, pdb_api_get = self.diff(files, [])
+        self.assertFalse(diff)
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from pano.methods import fleet
+
+__author__ = 'etaklar'
+
+SOURCE = {
+    'url': 'http://puppetdb.example.com:8080/',
+    'certs': None,
+    'verify': False,
+    'puppetdb_vers': 4,
+    'run_time': 30,
+}
+
+
+class FakeRequest(object):
+    def __init__(self, session=None):
+        self.session = session or {}
+
+
+class FakeSnapshotJobs(object):
+    """
+    Stands in for aio.run_puppetdb_jobs, answers the snapshot jobs slowly and counts how often it was called.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    async def __call__(self, jobs):
+        with self.lock:
+            self.calls += 1
+        await asyncio.sleep(0.2)
+        return {
+            'snapshot_nodes': [{'certname': 'node1.example.com', 'report_timestamp': None,
+                                'catalog_timestamp': None, 'facts_timestamp': None}],
+            'snapshot_reports': [{'certname': 'node1.example.com', 'status': 'failed'}],
+            'snapshot_event_counts': [],
+            'snapshot_tot_resource': {'Value': 10},
+            'snapshot_avg_resource': {'Value': 10.0},
+        }
+
+
+class PermissionFilter(TestCase):
+    def test_without_ldap_permissions(self):
+        with mock.patch.object(fleet, 'AUTH_METHOD', 'basic'):
+            self.assertEqual(fleet.permission_filter(FakeRequest({'permission_filter': '["=","a","b"]'})), '')
+
+    def test_ldap_permissions(self):
+        """
+        Users without a filter should share the key of the snapshots built by the refresher,
+        users without any permission should not.
+        """
+        with mock.patch.object(fleet, 'AUTH_METHOD', 'ldap'), mock.patch.object(fleet, 'ENABLE_PERMISSIONS', True):
+            self.assertEqual(fleet.permission_filter(FakeRequest({'permission_filter': False})), '')
+            self.assertEqual(fleet.permission_filter(FakeRequest()), '')
+            self.assertEqual(fleet.permission_filter(None), '')
+            self.assertEqual(fleet.permission_filter(FakeRequest({'permission_filter': None})), 'None')
+            self.assertEqual(fleet.permission_filter(FakeRequest({'permission_filter': '["=","a","b"]'})),
+                             '["=","a","b"]')
+
+    def test_snapshot_key(self):
+        url = SOURCE['url']
+        self.assertEqual(fleet.snapshot_key(url, ''), fleet.snapshot_key(url))
+        self.assertNotEqual(fleet.snapshot_key(url, ''), fleet.snapshot_key(url, 'None'))
+        self.assertNotEqual(fleet.snapshot_key(url), fleet.snapshot_key('http://other-puppetdb.example.com:8080/'))
+
+    def test_detached_request(self):
+        detached = fleet.DetachedRequest(FakeRequest({'permission_filter': '["=","a","b"]', 'other': 1}))
+        self.assertEqual(detached.session, {'permission_filter': '["=","a","b"]'})
+
+
+class FleetSnapshotCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.jobs = FakeSnapshotJobs()
+        patches = [
+            mock.patch.object(fleet, 'CACHE_TIME', 60),
+            mock.patch.object(fleet, 'FLEET_REFRESH_INTERVAL', 0),
+            mock.patch.object(fleet, 'request_source', return_value=SOURCE),
+            mock.patch.object(fleet.aio, 'run_puppetdb_jobs', self.jobs),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_single_flight(self):
+        """
+        Requests arriving while the snapshot is built should wait for it instead of building it again.
+        """
+        snapshots = []
+
+        def get_snapshot():
+            snapshots.append(fleet.get_fleet_snapshot(FakeRequest()))
+
+        threads = [threading.Thread(target=get_snapshot) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(self.jobs.calls, 1)
+        self.assertEqual(len(snapshots), 4)
+        self.assertEqual(snapshots[0].population, 1)
+
+    def test_stale_snapshot(self):
+        """
+        A stale snapshot should be served at once while it is rebuilt in the background.
+        """
+        snapshot = fleet.get_fleet_snapshot(FakeRequest())
+        snapshot.built_at -= 120
+        cache.set(fleet.snapshot_key(SOURCE['url']), snapshot)
+
+        started = time.time()
+        self.assertEqual(fleet.get_fleet_snapshot(FakeRequest()).built_at, snapshot.built_at)
+        self.assertLess(time.time() - started, 0.2)
+
+        # The lock is released once the new snapshot has been cached
+        deadline = time.time() + 5
+        while cache.get(fleet.snapshot_key(SOURCE['url']) + '_lock') is not None:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+        self.assertGreater(cache.get(fleet.snapshot_key(SOURCE['url'])).built_at, snapshot.built_at)
+        self.assertEqual(self.jobs.calls, 2)
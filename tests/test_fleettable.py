@@ -0,0 +1,156 @@
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+
+from pano.methods.dictfuncs import dictstatus
+from pano.methods.fleettable import FleetTable, to_epoch, to_timestamp
+
+__author__ = 'etaklar'
+
+
+def timestamp(minutes):
+    return (datetime.utcnow() - timedelta(minutes=minutes)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def fleet_data():
+    nodes_data = [
+        {
+            'certname': 'failed-node.example.com',
+            'catalog_timestamp': timestamp(11),
+            'facts_timestamp': timestamp(10),
+            'report_timestamp': timestamp(9),
+        },
+        {
+            'certname': 'missmatch-node.example.com',
+            'catalog_timestamp': timestamp(11),
+            'facts_timestamp': timestamp(55),
+            'report_timestamp': timestamp(8),
+        },
+        {
+            'certname': 'unreported-node.example.com',
+            'catalog_timestamp': timestamp(127),
+            'facts_timestamp': timestamp(126),
+            'report_timestamp': timestamp(125),
+        },
+        {
+            'certname': 'changed-node.example.com',
+            'catalog_timestamp': timestamp(11),
+            'facts_timestamp': timestamp(10),
+            'report_timestamp': timestamp(7),
+        },
+        {
+            'certname': 'pending-node.example.com',
+            'catalog_timestamp': timestamp(16),
+            'facts_timestamp': timestamp(13),
+            'report_timestamp': timestamp(10),
+        },
+        {
+            'certname': 'no-events-node.example.com',
+            'catalog_timestamp': timestamp(16),
+            'facts_timestamp': timestamp(13),
+            'report_timestamp': timestamp(12),
+        },
+        {
+            'certname': 'new-node.example.com',
+            'catalog_timestamp': None,
+            'facts_timestamp': timestamp(1),
+            'report_timestamp': None,
+        },
+    ]
+    events_data = {
+        'failed-node.example.com': {'failures': 20, 'noops': 0, 'skips': 10, 'successes': 5},
+        'missmatch-node.example.com': {'failures': 0, 'noops': 0, 'skips': 0, 'successes': 25},
+        'unreported-node.example.com': {'failures': 0, 'noops': 0, 'skips': 0, 'successes': 0},
+        'changed-node.example.com': {'failures': 0, 'noops': 0, 'skips': 0, 'successes': 78},
+        'pending-node.example.com': {'failures': 0, 'noops': 100, 'skips': 0, 'successes': 0},
+    }
+    reports_data = {
+        'failed-node.example.com': {'status': 'failed'},
+        'missmatch-node.example.com': {'status': 'changed'},
+        'unreported-node.example.com': {'status': 'unchanged'},
+        'changed-node.example.com': {'status': 'changed'},
+        'pending-node.example.com': {'status': 'unchanged'},
+        'no-events-node.example.com': {'status': 'unchanged'},
+    }
+    return nodes_data, reports_data, events_data
+
+
+class FleetTableData(TestCase):
+    def test_classify(self):
+        """
+        Every node with a report should be in exactly one of the failed, changed, unreported
+        and pending buckets, while the mismatch bucket is independent.
+        """
+        nodes_data, reports_data, events_data = fleet_data()
+        table = FleetTable.from_data(nodes_data, reports_data, dict(events_data))
+        buckets = table.classify(puppet_run_time=60)
+
+        def certnames(bucket):
+            return [table.certnames[i] for i in table.argsort('report_timestamp', indexes=buckets[bucket])]
+
+        self.assertEqual(certnames('failed'), ['failed-node.example.com'])
+        self.assertEqual(certnames('changed'), ['missmatch-node.example.com', 'changed-node.example.com'])
+        self.assertEqual(certnames('unreported'), ['unreported-node.example.com'])
+        self.assertEqual(certnames('pending'), ['pending-node.example.com'])
+        self.assertEqual(certnames('mismatch'), ['missmatch-node.example.com'])
+
+    def test_classify_unreported_and_duplicates(self):
+        """
+        An unreported node should only be in the unreported bucket, nodes without a report in none
+        and a certname listed twice only once.
+        """
+        recent = timestamp(9)
+        old = timestamp(125)
+
+        def node(certname, report, catalog=recent):
+            return {
+                'certname': certname,
+                'catalog_timestamp': catalog,
+                'facts_timestamp': recent,
+                'report_timestamp': report,
+            }
+
+        nodes_data = [
+            node('unreported-failed-node.example.com', old),
+            node('changed-node.example.com', recent),
+            node('changed-node.example.com', recent),
+            node('pending-node.example.com', recent, catalog=old),
+            node('no-report-node.example.com', recent, catalog=old),
+        ]
+        reports_data = {
+            'unreported-failed-node.example.com': {'status': 'failed'},
+            'changed-node.example.com': {'status': 'changed'},
+            'pending-node.example.com': {'status': 'unchanged'},
+        }
+        events_data = {
+            'pending-node.example.com': {'failures': 0, 'noops': 3, 'skips': 0, 'successes': 0},
+        }
+        table = FleetTable.from_data(nodes_data, reports_data, events_data)
+        buckets = table.classify(puppet_run_time=60)
+        counts = {key: len(value) for key, value in buckets.items()}
+        self.assertEqual(counts, {'failed': 0, 'changed': 1, 'unreported': 1, 'mismatch': 2, 'pending': 1})
+        self.assertEqual(sorted(table.certnames[i] for i in buckets['mismatch']),
+                         ['pending-node.example.com', 'unreported-failed-node.example.com'])
+
+    def test_rows_like_dictstatus(self):
+        """
+        All rows of the table should match dictstatus(get_status='all').
+        """
+        nodes_data, reports_data, events_data = fleet_data()
+        table = FleetTable.from_data(nodes_data, reports_data, dict(events_data))
+        expected = dictstatus(nodes_data, reports_data, dict(events_data), sort=False, format_time=True)
+        self.assertEqual(table.rows(), expected)
+
+    def test_sort_and_slice(self):
+        nodes_data, reports_data, events_data = fleet_data()
+        table = FleetTable.from_data(nodes_data, reports_data, events_data)
+        indexes = table.argsort('successes', reverse=True, indexes=table.with_events())
+        rows = table.rows(indexes[1:3])
+        self.assertEqual([row[0] for row in rows], ['missmatch-node.example.com', 'failed-node.example.com'])
+        self.assertEqual(table.status(table.index('pending-node.example.com')), 'pending')
+        self.assertEqual(table.status(table.index('no-events-node.example.com')), 'unknown')
+
+    def test_timestamps(self):
+        for date in ['2016-09-18T10:04:15.123Z', '2016-09-18T10:04:15.123456Z']:
+            self.assertEqual(to_timestamp(to_epoch(date)), date)
+        self.assertEqual(to_timestamp(to_epoch(None)), '')
@@ -0,0 +1,74 @@
+import json
+from unittest import TestCase, mock
+
+from pano.puppetdb import jsonstream
+from pano.puppetdb.jsonstream import iter_json_array
+
+__author__ = 'etaklar'
+
+
+class IterJsonArray(TestCase):
+    def test_records_split_across_chunks(self):
+        """
+        Records which are split over several chunks should be
+        decoded once the whole record has arrived.
+        """
+        chunks = ['  [{"certname": "node1.example', '.com", "noops": 1}', ',{"certname"',
+                  ': "node2.example.com", "noops": 0}]']
+        expected_results = [
+            {'certname': 'node1.example.com', 'noops': 1},
+            {'certname': 'node2.example.com', 'noops': 0},
+        ]
+        results = list(iter_json_array(chunks))
+        self.assertEqual(expected_results, results)
+
+    def test_one_character_chunks(self):
+        """
+        Decoding should give the same result no matter how small the chunks are.
+        """
+        document = '[{"a": [1, 2, {"b": "]"}]}, 12345, "x,y", null, true]'
+        expected_results = [{'a': [1, 2, {'b': ']'}]}, 12345, 'x,y', None, True]
+        results = list(iter_json_array(iter(document)))
+        self.assertEqual(expected_results, results)
+
+    def test_large_element_in_small_chunks(self):
+        """
+        An element spanning many chunks should not be decoded again for every chunk.
+        """
+        element = {'certname': 'node1.example.com', 'facts': {'fact%d' % i: 'x' * 50 for i in range(2000)}}
+        document = json.dumps([element, 1])
+        chunks = [document[i:i + 100] for i in range(0, len(document), 100)]
+        decode_calls = []
+        decoder = json.JSONDecoder
+
+        class CountingDecoder(decoder):
+            def raw_decode(self, s, idx=0):
+                decode_calls.append(idx)
+                return decoder.raw_decode(self, s, idx)
+
+        with mock.patch.object(jsonstream.json, 'JSONDecoder', CountingDecoder):
+            results = list(iter_json_array(chunks))
+        self.assertEqual(results, [element, 1])
+        self.assertGreater(len(chunks), 1000)
+        self.assertLess(len(decode_calls), 30)
+
+    def test_empty_array(self):
+        results = list(iter_json_array(['[', ' ]']))
+        self.assertEqual([], results)
+
+    def test_not_an_array(self):
+        """
+        PuppetDB error responses are not JSON arrays and should raise ValueError.
+        """
+        self.assertRaises(ValueError, list, iter_json_array(['{"error": "not found"}']))
+
+    def test_truncated_array(self):
+        self.assertRaises(ValueError, list, iter_json_array(['[{"certname": "node1"}, {"cert']))
+
+    def test_missing_comma(self):
+        self.assertRaises(ValueError, list, iter_json_array(['[1 2]']))
+        self.assertRaises(ValueError, list, iter_json_array(['[{"a": 1}', '{"a": 2}]']))
+
+    def test_misplaced_commas(self):
+        for document in ['[1,]', '[,1]', '[1,,2]', '[,]']:
+            self.assertRaises(ValueError, list, iter_json_array([document]))
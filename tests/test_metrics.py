@@ -0,0 +1,58 @@
+from unittest import mock
+
+from django.http import Http404
+from django.test import TestCase, RequestFactory
+
+from pano.methods.metrics import Counter, Histogram, Registry, puppetdb_endpoint
+from pano.views import metrics as metrics_view
+
+__author__ = 'etaklar'
+
+
+class Metrics(TestCase):
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', 'Test latency.', ['endpoint'], buckets=(0.1, 1))
+        histogram.observe(0.05, endpoint='nodes')
+        histogram.observe(0.1, endpoint='nodes')
+        histogram.observe(5, endpoint='nodes')
+        lines = histogram.render().split('\n')
+        self.assertEqual(lines[1], '# TYPE test_seconds histogram')
+        self.assertIn('test_seconds_bucket{endpoint="nodes",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{endpoint="nodes",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{endpoint="nodes",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{endpoint="nodes"} 3', lines)
+        self.assertEqual(histogram.get(endpoint='nodes'), (3, 5.15))
+
+    def test_counter(self):
+        registry = Registry()
+        counter = registry.register(Counter('test_total', 'Test counter.', ['cache', 'result']))
+        counter.inc(cache='report', result='hit')
+        counter.inc(2, cache='report', result='hit')
+        counter.inc(cache='re"port', result='miss')
+        text = registry.render()
+        self.assertIn('test_total{cache="report",result="hit"} 3.0\n', text)
+        self.assertIn('test_total{cache="re\\"port",result="miss"} 1.0\n', text)
+
+    def test_puppetdb_endpoint(self):
+        self.assertEqual(puppetdb_endpoint('/catalogs/node.example.com'), 'catalogs')
+        self.assertEqual(puppetdb_endpoint('nodes?query=x'), 'nodes')
+        self.assertEqual(puppetdb_endpoint('/'), 'root')
+
+
+class MetricsView(TestCase):
+    def get(self, **headers):
+        return metrics_view.metrics(RequestFactory().get('/pano/metrics', **headers))
+
+    def test_disabled(self):
+        with mock.patch.object(metrics_view, 'ENABLE_METRICS', False):
+            self.assertRaises(Http404, self.get)
+
+    def test_token(self):
+        with mock.patch.object(metrics_view, 'ENABLE_METRICS', True), \
+                mock.patch.object(metrics_view, 'METRICS_TOKEN', 's3cret'):
+            self.assertEqual(self.get().status_code, 403)
+            self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.get(HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        with mock.patch.object(metrics_view, 'ENABLE_METRICS', True), \
+                mock.patch.object(metrics_view, 'METRICS_TOKEN', ''):
+            self.assertEqual(self.get().status_code, 200)
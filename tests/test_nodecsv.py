@@ -0,0 +1,126 @@
+import json
+from unittest import mock
+
+from django.test import TestCase
+
+from pano.methods import nodecsv
+from pano.methods.nodecsv import parse_facts, csv_headers, with_facts, export_rows
+from pano.views.api import node_data
+
+__author__ = 'etaklar'
+
+SOURCE = {'url': 'http://puppetdb.example.com:8080/', 'certs': None, 'verify': False}
+FACTS = {
+    'node1.example.com': {'kernel': 'Linux', 'osfamily': 'RedHat'},
+    'node2.example.com': {'kernel': 'Linux'},
+    'node3.example.com': {'kernel': 'windows', 'osfamily': 'windows'},
+}
+
+
+def node(certname):
+    return {'certname': certname, 'latest_report_status': 'unchanged',
+            'report_timestamp': '2016-09-18T10:00:00.000Z'}
+
+
+class FakeFactJobs(object):
+    """
+    Answers the /facts jobs of fact_values with the FACTS of the certnames in the query of each job.
+    """
+
+    def __init__(self, fail_on_call=None):
+        self.certnames = []
+        self.fail_on_call = fail_on_call
+
+    def __call__(self, jobs):
+        if self.fail_on_call == len(self.certnames):
+            raise ValueError('Unsupported query')
+        certnames = []
+        results = {}
+        for job_id, job in jobs.items():
+            self.assert_paged(job)
+            query = json.loads(job['params']['query'][2])
+            job_certnames = [condition[2] for condition in query[1:]]
+            certnames.extend(job_certnames)
+            results[job_id] = [{'certname': certname, 'name': name, 'value': value}
+                               for certname in job_certnames
+                               for name, value in sorted(FACTS.get(certname, {}).items())]
+        self.certnames.append(certnames)
+        return results
+
+    @staticmethod
+    def assert_paged(job):
+        assert job['path'] == '/facts' and job['paged']
+
+
+class NodeCsv(TestCase):
+    def test_parse_facts(self):
+        self.assertEqual(parse_facts(' kernel, osfamily ,,'), ['kernel', 'osfamily'])
+        self.assertEqual(parse_facts(False), [])
+        self.assertEqual(csv_headers(['kernel'])[-2:], ['Run Status', 'kernel'])
+
+    def test_with_facts(self):
+        rows = iter([
+            ('node1.example.com', '', '', '', 0, 0, 0, 0, 'unchanged'),
+            ('node2.example.com', '', '', '', 1, 0, 0, 0, 'changed'),
+        ])
+        values = {'node1.example.com': ('Linux', None)}
+        result = list(with_facts(rows, ['kernel', 'osfamily'], values))
+        self.assertEqual(result[0][-2:], ('Linux', ''))
+        self.assertEqual(result[1][-2:], ('', ''))
+
+
+class ExportRows(TestCase):
+    def export(self, fact_jobs, event_counts=None, nodes=None):
+        nodes = nodes or [node(certname) for certname in ('node3.example.com', 'node1.example.com',
+                                                          'node2.example.com')]
+        if event_counts is None:
+            event_counts = [{'subject': {'title': 'node1.example.com'},
+                             'successes': 2, 'noops': 0, 'failures': 1, 'skips': 0}]
+        with mock.patch.object(nodecsv, 'PUPPETDB_PAGE_SIZE', 2), \
+                mock.patch.object(nodecsv, 'FACT_QUERY_CERTNAMES', 1), \
+                mock.patch.object(nodecsv, 'api_get', return_value=event_counts), \
+                mock.patch.object(nodecsv, 'iter_puppetdb_pages', return_value=iter(nodes)) as pages, \
+                mock.patch.object(nodecsv, 'run_puppetdb_jobs', fact_jobs):
+            rows = []
+            try:
+                for row in export_rows(SOURCE, {'query': {}}, ['kernel', 'osfamily']):
+                    rows.append(row)
+            finally:
+                self.rows = rows
+        self.assertEqual(pages.call_args[0][0], '/nodes')
+        return rows
+
+    def test_facts_by_page(self):
+        """
+        The facts should only be fetched for the nodes of each page, in the order of the nodes.
+        """
+        fact_jobs = FakeFactJobs()
+        rows = self.export(fact_jobs)
+        self.assertEqual([row[0] for row in rows], ['node3.example.com', 'node1.example.com', 'node2.example.com'])
+        self.assertEqual(fact_jobs.certnames, [['node3.example.com', 'node1.example.com'], ['node2.example.com']])
+        self.assertEqual(rows[0][-2:], ('windows', 'windows'))
+        self.assertEqual(rows[1][4:], (2, 0, 1, 0, 'unchanged', 'Linux', 'RedHat'))
+        self.assertEqual(rows[2][-2:], ('Linux', ''))
+
+    def test_error_after_first_page(self):
+        """
+        A failed query of a later page should be raised after the rows of the earlier pages.
+        """
+        self.assertRaises(ValueError, self.export, FakeFactJobs(fail_on_call=1))
+        self.assertEqual([row[0] for row in self.rows], ['node3.example.com', 'node1.example.com'])
+
+    def test_event_counts_error(self):
+        self.assertRaises(ValueError, self.export, FakeFactJobs(), event_counts={'error': 'Unsupported query'})
+        self.assertEqual(self.rows, [])
+
+    def test_csv_lines(self):
+        def rows():
+            yield ('node1.example.com', '', '', '', 0, 0, 0, 0, 'unchanged')
+            raise ValueError('Unsupported query')
+
+        lines = node_data.csv_lines(rows(), [])
+        self.assertTrue(next(lines).startswith('Certname,'))
+        self.assertTrue(next(lines).startswith('node1.example.com,'))
+        with self.assertLogs(node_data.logger, 'ERROR'):
+            self.assertIn('Export incomplete', next(lines))
+        self.assertRaises(ValueError, next, lines)
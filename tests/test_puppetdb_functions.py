@@ -1,5 +1,10 @@
+import threading
+from unittest import mock
+
 from django.test import TestCase
 
+from pano.puppetdb import puppetdb
+from pano.puppetdb.connections import pool_key
 from pano.puppetdb.puppetdb import mk_puppetdb_query
 
 __author__ = 'etaklar'
@@ -136,6 +141,32 @@ def test_order_by_query_with_double_search_query_with_operator(self):
         results = mk_puppetdb_query(content)
         self.assertEqual(expected_results, results)
 
+    def test_fields_query_with_single_search_query(self):
+        content = {
+            'query':
+                {
+                    1: '["=","latest_report?",true]'
+                },
+            'fields': ['certname', 'status'],
+        }
+        expected_results = {
+            'query': '["extract",["certname","status"],["and",["=","latest_report?",true]]]'
+        }
+        results = mk_puppetdb_query(content)
+        self.assertEqual(expected_results, results)
+
+    def test_fields_query_without_search_query(self):
+        content = {
+            'fields': ['start_time', 'end_time'],
+            'limit': 100,
+        }
+        expected_results = {
+            'query': '["extract",["start_time","end_time"]]',
+            'limit': 100,
+        }
+        results = mk_puppetdb_query(content)
+        self.assertEqual(expected_results, results)
+
     def test_query_with_string(self):
         content = "string value"
         self.assertRaises(TypeError, mk_puppetdb_query, params=content)
@@ -152,3 +183,81 @@ def test_query_with_empty_dict(self):
         content = {}
         expected_results = {}
         self.assertEquals(content, expected_results)
+
+
+class PuppetdbVersion(TestCase):
+    def setUp(self):
+        puppetdb._pdb_versions.clear()
+
+    def tearDown(self):
+        puppetdb._pdb_versions.clear()
+        puppetdb._pdb_versions_probing.clear()
+
+    def test_version_is_memoized(self):
+        with mock.patch.object(puppetdb, 'ident_pdb_vers', return_value=4) as ident:
+            self.assertEqual(puppetdb.pdb_version('http://puppetdb.example.com:8080/', None, False), 4)
+            self.assertEqual(puppetdb.pdb_version('http://puppetdb.example.com:8080/', None, False), 4)
+            self.assertEqual(ident.call_count, 1)
+            self.assertEqual(puppetdb.pdb_version('http://other-puppetdb.example.com:8080/', None, False), 4)
+            self.assertEqual(ident.call_count, 2)
+
+    def test_unreachable_source(self):
+        with mock.patch.object(puppetdb, 'ident_pdb_vers', side_effect=ConnectionError):
+            self.assertIsNone(puppetdb.pdb_version('http://puppetdb.example.com:8080/', None, False))
+
+    def test_error_response_is_retried(self):
+        """
+        No version in the answer of PuppetDB should be checked again after PDB_VERSION_RETRY, not the TTL.
+        """
+        key = pool_key('http://puppetdb.example.com:8080/', cert=None, verify=False)
+        with mock.patch.object(puppetdb, 'ident_pdb_vers', return_value=None):
+            self.assertIsNone(puppetdb.pdb_version('http://puppetdb.example.com:8080/', None, False))
+        version, checked_at, failed = puppetdb._pdb_versions[key]
+        self.assertTrue(failed)
+        puppetdb._pdb_versions[key] = (version, checked_at - puppetdb.PDB_VERSION_RETRY - 1, failed)
+        with mock.patch.object(puppetdb, '_probe_pdb_version') as probe:
+            puppetdb.pdb_version('http://puppetdb.example.com:8080/', None, False)
+        self.assertTrue(probe.called)
+
+    def test_waits_for_running_check(self):
+        """
+        A lookup made while the source is checked in the background should wait for that check.
+        """
+        release = threading.Event()
+
+        def ident_pdb_vers(**kwargs):
+            release.wait(5)
+            return 4
+
+        with mock.patch.object(puppetdb, 'ident_pdb_vers', side_effect=ident_pdb_vers) as ident:
+            puppetdb._probe_pdb_version(pool_key('http://puppetdb.example.com:8080/', cert=None, verify=False),
+                                        'http://puppetdb.example.com:8080/', None, False)
+            threading.Timer(0.1, release.set).start()
+            self.assertEqual(puppetdb.pdb_version('http://puppetdb.example.com:8080/', None, False), 4)
+        self.assertEqual(ident.call_count, 1)
+        self.assertEqual(ident.call_args[1]['timeout'], puppetdb.PDB_VERSION_TIMEOUT)
+
+
+class StreamRecords(TestCase):
+    def response(self, chunks):
+        resp = mock.Mock(encoding='utf-8')
+        resp.iter_content.return_value = iter(chunks)
+        return resp
+
+    def test_records(self):
+        resp = self.response(['[{"certname": "node1"},', '{"certname": "node2"}]'])
+        results = list(puppetdb.stream_records(resp))
+        self.assertEqual(results, [{'certname': 'node1'}, {'certname': 'node2'}])
+        self.assertTrue(resp.close.called)
+
+    def test_error_response(self):
+        """
+        An error answered by PuppetDB should not look like an empty result.
+        """
+        resp = self.response(['{"error": "Unsupported query"}'])
+        self.assertRaises(ValueError, list, puppetdb.stream_records(resp))
+        self.assertTrue(resp.close.called)
+
+    def test_truncated_response(self):
+        self.assertRaises(ValueError, list, puppetdb.stream_records(self.response(['[{"certname": "no'])))
+        self.assertRaises(ValueError, list, puppetdb.stream_records(self.response([])))
@@ -1,7 +1,14 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from datetime import datetime, timedelta
+from unittest import mock
+
 from django.test import TestCase
 
-from pano.puppetdb.pdbutils import is_unreported
+from pano.puppetdb import pdbutils
+from pano.puppetdb.pdbutils import is_unreported, json_to_datetime, iter_puppetdb_pages, JobGroup
 
 __author__ = 'etaklar'
 
@@ -55,3 +62,161 @@ def test_unreported_date_with_hours_set_to_24_hours(self):
         date = (datetime.utcnow() - timedelta(hours=25)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
         results = is_unreported(date, unreported=24*60)
         self.assertEquals(results, True)
+
+
+class ParseJsonDatetime(TestCase):
+    def test_same_as_strptime(self):
+        """
+        The fast parser should give the same result as strptime
+        for fractions of any length.
+        """
+        for date in ['2016-09-18T10:04:15.123Z', '2016-09-18T10:04:15.1Z', '2016-02-29T23:59:59.999999Z']:
+            expected = datetime.strptime(date, '%Y-%m-%dT%H:%M:%S.%fZ')
+            results = json_to_datetime(date)
+            self.assertEqual(results.replace(tzinfo=None), expected)
+            self.assertEqual(results.utcoffset(), timedelta(0))
+
+    def test_invalid_dates(self):
+        for date in ['not_a_real_date', '2016-13-18T10:04:15.123Z', '2016-09-18T10:04:15Z', '2016-09-18 10:04:15.123Z']:
+            self.assertRaises(ValueError, json_to_datetime, date)
+
+
+class FakePages(object):
+    """
+    Stands in for api_get, answers each page of the records with an iterator like api_get(stream=True).
+    """
+
+    def __init__(self, records, fail_at=None):
+        self.records = records
+        self.fail_at = fail_at
+        self.params = []
+
+    def __call__(self, params=None, **kwargs):
+        self.params.append(params)
+        if params['offset'] == self.fail_at:
+            raise ConnectionError('PuppetDB went away')
+        return iter(self.records[params['offset']:params['offset'] + params['limit']])
+
+
+class IterPuppetdbPages(TestCase):
+    def pages(self, api_get, **kwargs):
+        with mock.patch.object(pdbutils.puppetdb, 'api_get', api_get):
+            return list(iter_puppetdb_pages('/nodes', url='http://puppetdb.example.com:8080/', **kwargs))
+
+    def test_short_last_page(self):
+        """
+        Iteration should stop after the first page with fewer records than the page size.
+        """
+        records = [{'certname': 'node%d' % i} for i in range(5)]
+        for prefetch in (True, False):
+            api_get = FakePages(records)
+            self.assertEqual(self.pages(api_get, page_size=2, prefetch=prefetch), records)
+            self.assertEqual([params['offset'] for params in api_get.params], [0, 2, 4])
+
+    def test_full_last_page(self):
+        records = [{'certname': 'node%d' % i} for i in range(4)]
+        for prefetch in (True, False):
+            api_get = FakePages(records)
+            self.assertEqual(self.pages(api_get, page_size=2, prefetch=prefetch), records)
+            self.assertEqual([params['offset'] for params in api_get.params], [0, 2, 4])
+
+    def test_failure_mid_stream(self):
+        """
+        A page which fails, also on the prefetch thread, should raise instead of ending the records early.
+        """
+        records = [{'certname': 'node%d' % i} for i in range(5)]
+        for prefetch in (True, False):
+            self.assertRaises(ConnectionError, self.pages, FakePages(records, fail_at=2),
+                              page_size=2, prefetch=prefetch)
+
+    def test_order_by(self):
+        """
+        The requested order should come first, followed by the fields giving the endpoint a stable order.
+        """
+        api_get = FakePages([])
+        params = {'order_by': {'order_field': {'field': 'report_timestamp', 'order': 'desc'}}}
+        self.pages(api_get, params=params)
+        self.assertEqual(json.loads(api_get.params[0]['order_by']),
+                         [{'field': 'report_timestamp', 'order': 'desc'}, {'field': 'certname', 'order': 'asc'}])
+
+        api_get = FakePages([])
+        params = {'order_by': {'order_field': {'field': 'certname', 'order': 'desc'}}}
+        self.pages(api_get, params=params)
+        self.assertEqual(json.loads(api_get.params[0]['order_by']), [{'field': 'certname', 'order': 'desc'}])
+
+
+class BlockingApiGet(object):
+    """
+    Stands in for api_get, every request waits until released and the most concurrent requests are counted.
+    """
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+
+    def __call__(self, path=None, **kwargs):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        try:
+            self.released.wait(5)
+            return [path]
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+class PuppetdbJobGroup(TestCase):
+    def setUp(self):
+        self.api_get = BlockingApiGet()
+        patches = [
+            mock.patch.object(pdbutils.puppetdb, 'api_get', self.api_get),
+            mock.patch.object(pdbutils, '_executor', ThreadPoolExecutor(max_workers=4)),
+            mock.patch.dict(pdbutils._source_semaphores, clear=True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.api_get.released.set)
+
+    def job(self, job_id, url='http://puppetdb.example.com:8080/'):
+        return {'id': job_id, 'path': '/nodes/%s' % job_id, 'url': url, 'api_version': 'v4'}
+
+    def test_results(self):
+        group = JobGroup(timeout=5)
+        group.submit(self.job('node1'))
+        group.submit(self.job('node2'))
+        self.api_get.released.set()
+        self.assertEqual(group.results(), {'node1': ['/nodes/node1'], 'node2': ['/nodes/node2']})
+
+    def test_timeout_cancels_waiting_jobs(self):
+        """
+        A job which does not finish within the timeout should raise and the jobs which have not started be cancelled.
+        """
+        with mock.patch.object(pdbutils, '_executor', ThreadPoolExecutor(max_workers=1)):
+            group = JobGroup(timeout=0.2)
+            first = group.submit(self.job('node1'))
+            second = group.submit(self.job('node2'))
+            started = time.time()
+            self.assertRaises(TimeoutError, group.results)
+            self.assertLess(time.time() - started, 2)
+            self.assertTrue(second.cancelled())
+            self.assertFalse(first.cancelled())
+
+    def test_requests_per_source(self):
+        """
+        No more than PUPPETDB_MAX_REQUESTS_PER_SOURCE requests should be sent to a source at a time,
+        other sources are not limited by it.
+        """
+        with mock.patch.object(pdbutils, 'PUPPETDB_MAX_REQUESTS_PER_SOURCE', 2):
+            group = JobGroup(timeout=5)
+            for i in range(3):
+                group.submit(self.job('node%d' % i))
+            group.submit(self.job('other', url='http://other-puppetdb.example.com:8080/'))
+            time.sleep(0.3)
+            self.assertEqual(self.api_get.most_running, 3)
+            self.api_get.released.set()
+            self.assertEqual(len(group.results()), 4)
+            self.assertEqual(self.api_get.most_running, 3)
@@ -0,0 +1,53 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from pano.puppetdb.reportcache import ReportCache
+from pano.views.api import report_data
+
+__author__ = 'etaklar'
+
+SOURCE_URL = 'http://puppetdb.example.com:8080/'
+REPORTS = [{'hash': 'abc'}, {'hash': 'def'}]
+
+
+def stream(records):
+    for record in records:
+        yield record
+
+
+def error_stream():
+    raise ValueError('Expected a JSON array from PuppetDB')
+    yield
+
+
+class ReportEventCounts(TestCase):
+    def setUp(self):
+        self.cache = ReportCache(max_entries=10, directory=None)
+
+    def counts(self, answer):
+        with mock.patch.object(report_data, 'report_cache', self.cache), \
+                mock.patch.object(report_data.puppetdb, 'api_get', return_value=answer) as api_get:
+            counts = report_data.report_event_counts(SOURCE_URL, None, False, REPORTS)
+        return counts, api_get
+
+    def test_counts_are_cached(self):
+        rows = [{'report': 'abc', 'status': 'success', 'count': 1},
+                {'report': 'abc', 'status': 'success', 'count': 2},
+                {'report': 'abc', 'status': 'failure', 'count': 1}]
+        counts, api_get = self.counts(stream(rows))
+        self.assertEqual(counts, {'abc': {'success': 2, 'failure': 1}})
+        self.assertEqual(self.cache.get(SOURCE_URL, 'abc', 'event_counts'), {'success': 2, 'failure': 1})
+        self.assertEqual(self.cache.get(SOURCE_URL, 'def', 'event_counts'), {})
+        counts, api_get = self.counts(stream([]))
+        self.assertFalse(api_get.called)
+        self.assertEqual(counts, {'abc': {'success': 2, 'failure': 1}, 'def': {}})
+
+    def test_error_is_not_cached(self):
+        """
+        An error answer from PuppetDB should not be cached as reports without events.
+        """
+        counts, api_get = self.counts(error_stream())
+        self.assertEqual(counts, {})
+        self.assertIsNone(self.cache.get(SOURCE_URL, 'abc', 'event_counts'))
+        self.assertIsNone(self.cache.get(SOURCE_URL, 'def', 'event_counts'))
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from pano.puppetdb.reportcache import ReportCache
+
+__author__ = 'etaklar'
+
+
+class ReportCacheMemory(TestCase):
+    def test_get_and_set(self):
+        cache = ReportCache(max_entries=10, directory=None)
+        self.assertIsNone(cache.get('http://puppetdb/', 'abc', 'events'))
+        cache.set('http://puppetdb/', 'abc', 'events', [{'status': 'success'}])
+        self.assertEqual(cache.get('http://puppetdb/', 'abc', 'events'), [{'status': 'success'}])
+        # Same hash on another source or of another kind is a different entry
+        self.assertIsNone(cache.get('http://other-puppetdb/', 'abc', 'events'))
+        self.assertIsNone(cache.get('http://puppetdb/', 'abc', 'logs'))
+
+    def test_lru_eviction(self):
+        cache = ReportCache(max_entries=2, directory=None)
+        cache.set('http://puppetdb/', 'first', 'events', [1])
+        cache.set('http://puppetdb/', 'second', 'events', [2])
+        # Using the first entry makes the second one the least recently used
+        cache.get('http://puppetdb/', 'first', 'events')
+        cache.set('http://puppetdb/', 'third', 'events', [3])
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('http://puppetdb/', 'second', 'events'))
+        self.assertEqual(cache.get('http://puppetdb/', 'first', 'events'), [1])
+        self.assertEqual(cache.get('http://puppetdb/', 'third', 'events'), [3])
+
+
+class ReportCacheDisk(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_disk_tier(self):
+        cache = ReportCache(max_entries=1, directory=self.directory)
+        cache.set('http://puppetdb/', 'first', 'event_counts', {'success': 2})
+        cache.set('http://puppetdb/', 'second', 'event_counts', {})
+        # Evicted from memory but still on disk
+        self.assertEqual(cache.get('http://puppetdb/', 'first', 'event_counts'), {'success': 2})
+        # Another process using the same directory
+        other_cache = ReportCache(max_entries=10, directory=self.directory)
+        self.assertEqual(other_cache.get('http://puppetdb/', 'second', 'event_counts'), {})
+        self.assertIsNone(other_cache.get('http://puppetdb/', 'third', 'event_counts'))
+
+    def test_paths_stay_in_directory(self):
+        """
+        Report hashes come from the URL, a hash like '..' must not write outside of the directory.
+        """
+        cache = ReportCache(max_entries=0, directory=self.directory)
+        cache.set('http://puppetdb/', '../..', 'events', [1])
+        self.assertEqual(cache.get('http://puppetdb/', '../..', 'events'), [1])
+        files = [os.path.join(root, name) for root, dirs, names in os.walk(self.directory) for name in names]
+        self.assertEqual(len(files), 1)
+        self.assertEqual(os.path.dirname(os.path.dirname(files[0])), self.directory)
+
+    def test_size_bounded_disk_tier(self):
+        """
+        The least recently used files should be removed once the files take more than max_bytes.
+        """
+        cache = ReportCache(max_entries=0, directory=self.directory, max_bytes=25)
+        cache.set('http://puppetdb/', 'first', 'events', [1, 2, 3])
+        cache.set('http://puppetdb/', 'second', 'events', [4, 5, 6])
+        # Using the first entry makes the second one the least recently used
+        self.assertEqual(cache.get('http://puppetdb/', 'first', 'events'), [1, 2, 3])
+        cache.set('http://puppetdb/', 'third', 'events', [7, 8, 9])
+        self.assertIsNone(cache.get('http://puppetdb/', 'second', 'events'))
+        self.assertEqual(cache.get('http://puppetdb/', 'first', 'events'), [1, 2, 3])
+        self.assertEqual(cache.get('http://puppetdb/', 'third', 'events'), [7, 8, 9])
+        self.assertLessEqual(cache.total_bytes, 25)
+
+        # A new process picks up the size of the files already in the directory
+        other_cache = ReportCache(max_entries=0, directory=self.directory, max_bytes=25)
+        self.assertEqual(other_cache.total_bytes, cache.total_bytes)